@@ -1,4 +1,10 @@
 from .core import *
 from .synapse import Synapse
+from .population import Population
+from .connectivity import connect_bulk
+from .parallel import register_transmitters, register_receivers, partition
+from .geometry import SegmentParameter
+from .recording import PopulationRecorder, StreamingRecorder, StreamReader
+from .snapshot import save_snapshot, load_snapshot
 
 __version__ = "2.0.0b8"
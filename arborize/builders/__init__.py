@@ -1 +1,4 @@
-from .rotation import rotate
+from .rotation import rotate, TransformBuilder
+from .swc import SWCBuilder, load_swc
+from .validation import ValidationBuilder, validate_morphology
+from .simplification import SimplifyBuilder, simplify_morphology
@@ -1,29 +1,96 @@
-import numpy as np, math
+import numpy as np, math, functools
+from ..core import Builder
+from ..morphology import _read_pt3d, _set_pt3d
 
 def rotate(v0, v):
     """
-        Return a builder function that rotates all section arrays (soma, dend, axon).
+        Return a builder that rotates all section arrays (soma, dend, axon, apic).
 
         Transforming a morphology every time it is loaded is not efficient. Instead use
         this function to rotate the morphology, then save it to a format that can be
         loaded directly. This way the rotation step can be removed.
+
+        When the builder follows a morphology file in the ``morphologies`` of a model,
+        the rotated morphology is computed once and reused by every cell. See
+        :class:`.TransformBuilder` for builders that create sections themselves.
     """
     # Get the rotation matrix for the transformation of v0 to v.
     R = get_rotation_matrix(v0, v)
-    # Create a builder function that changes all the pt3d information of all sections in
-    # the soma, dend or axon arrays according to this rotation.
-    def builder(model, *args, **kwargs):
-        # Loop over the sections
-        for s in iter(model.soma + model.dend + model.axon):
-            # Loop over the pt3d
-            for i in range(s.n3d()):
-                # Get the rotated point
-                pt0 = np.array([s.x3d(i), s.y3d(i), s.z3d(i)])
-                pt = R.dot(pt0)
-                # Change the pt3d information
-                s.pt3dchange(i, *pt, s.diam3d(i))
-    # Return the product function
-    return builder
+    return TransformBuilder(rotation=R)
+
+
+class TransformBuilder(Builder):
+    """
+        Builder that rotates, scales and translates the 3D points of all sections of a
+        model, treating all the points of a section as one array.
+
+        The coordinates are scaled, rotated and then, if ``translate`` is given,
+        translated to the ``position`` of the model. Placed after a morphology in a
+        builder pipeline, the scaled and rotated arrays are cached per morphology and
+        transformation, and the sections are created at their final location.
+
+        Only after builders that produce a :class:`~arborize.morphology.Morphology`,
+        such as morphology files and :class:`.SWCBuilder`, the transformation is applied
+        to the arrays. After builders that create the sections themselves, such as
+        builder functions, the transformation falls back to reading the 3D points of
+        every section and writing them back, which is much slower. Return a
+        :class:`~arborize.morphology.Morphology` from such builders, or convert their
+        sections once with :meth:`~arborize.morphology.Morphology.from_sections`, to use
+        the array path.
+
+        :param rotation: 3x3 rotation matrix.
+        :param translate: Translate the points to the position of the model.
+        :type translate: bool
+        :param scale: Scalar or per axis scale factors of the coordinates.
+        :param cache: Cache the transformed morphologies. Disable it for
+          transformations that are unique to a cell.
+        :type cache: bool
+    """
+    def __init__(self, rotation=None, translate=False, scale=None, cache=True):
+        self.rotation = None if rotation is None else np.asarray(rotation, dtype=float)
+        self.translate = translate
+        self.scale = None if scale is None else np.asarray(scale, dtype=float)
+        self.cache = cache
+
+    def transform_morphology(self, morphology, model):
+        """
+            Return the transformed :class:`~arborize.morphology.Morphology`.
+        """
+        if not self.cache:
+            morphology = morphology.transform(matrix=self.rotation, scale=self.scale)
+        elif self.rotation is not None or self.scale is not None:
+            morphology = _transform(morphology, _key(self.rotation), _key(self.scale))
+        if self.translate:
+            morphology = morphology.transform(translation=model.position)
+        return morphology
+
+    def instantiate(self, model, *args, **kwargs):
+        # Fallback for sections that were created by a previous builder: transform the
+        # points of each section. `transform_morphology` is used when possible.
+        translation = model.position if self.translate else None
+        for s in iter(model.soma + (model.dend or []) + model.dendrites + model.axon + (getattr(model, "apic", None) or [])):
+            points, diameters = _read_pt3d(s)
+            if self.scale is not None:
+                points = points * self.scale
+            if self.rotation is not None:
+                points = points @ self.rotation.T
+            if translation is not None:
+                points = points + translation
+            _set_pt3d(s, points, diameters)
+
+
+def _key(array):
+    # Hashable representation of an optional array for the transformation cache
+    return None if array is None else (array.shape, array.tobytes())
+
+
+@functools.lru_cache(maxsize=256)
+def _transform(morphology, rotation, scale):
+    if rotation is not None:
+        rotation = np.frombuffer(rotation[1]).reshape(rotation[0])
+    if scale is not None:
+        scale = np.frombuffer(scale[1]).reshape(scale[0])
+    return morphology.transform(matrix=rotation, scale=scale)
 
 
 def get_rotation_matrix(v0, v):
@@ -34,32 +101,18 @@ def get_rotation_matrix(v0, v):
 
     # Normalize orientation vectors
     v0 = v0 / np.linalg.norm(v0)
-    v = v / np.linalg.norm(v0)
-    alpha = np.arccos(np.dot(v0, v))
+    v = v / np.linalg.norm(v)
+    alpha = np.arccos(np.clip(np.dot(v0, v), -1.0, 1.0))
 
     if math.isclose(alpha, 0.0):
-        report(
-            "Rotating morphology between parallel orientation vectors, {} and {}!".format(
-                v0, v
-            ),
-            level=3,
-        )
-        # We will not rotate the morphology, thus R = I
+        # Parallel orientation vectors: we will not rotate the morphology, thus R = I
         return I
     elif math.isclose(alpha, np.pi):
-        report(
-            "Rotating morphology between antiparallel orientation vectors, {} and {}!".format(
-                v0, v
-            ),
-            level=3,
-        )
-        # We will rotate the morphology of 180° around a vector orthogonal to the starting
-        # vector v0 (the same would be if we take the ending vector v) We set the first
-        # and second components to 1; the third one is obtained to have the scalar product
-        # with v0 equal to 0
-        kx, ky = 1, 1
-        kz = -(v0[0] + v0[1]) / v0[2]
-        k = np.array([kx, ky, kz])
+        # Antiparallel orientation vectors: we will rotate the morphology of 180° around
+        # a vector orthogonal to the starting vector v0 (the same would be if we take the
+        # ending vector v), the cross product of v0 with the axis it is least aligned to.
+        k = np.cross(v0, I[np.argmin(np.abs(v0))])
+        k = k / np.linalg.norm(k)
     else:
         k = (np.cross(v0, v)) / math.sin(alpha)
         k = k / np.linalg.norm(k)
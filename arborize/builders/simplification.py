@@ -0,0 +1,376 @@
+import numpy as np
+from ..core import Builder, _morphology_labels, _morphology_nseg
+from ..morphology import Morphology, SECTION_TYPES, _geometry_digest, _cache_put
+from ..geometry import SectionProperties
+
+
+class SimplificationReport:
+    """
+        Result of :func:`.simplify_morphology`:
+
+        * ``sections_before``, ``sections_after``: Number of sections.
+        * ``compartments_before``, ``compartments_after``: Number of segments that cells
+          of the model class give the sections, with its ``discretization`` policy or
+          the default ``1 + 2 * int(L / 40)`` rule.
+        * ``merged``: Number of sections that were merged into their parent.
+        * ``reduced``: Number of subtrees that were reduced to an equivalent cylinder.
+        * ``label_changes``: Number of sections that would get other labels after the
+          simplification. Merges that change labels are undone, so this is 0 unless
+          that didn't converge.
+    """
+    def __init__(self, sections_before, sections_after, compartments_before, compartments_after, merged, reduced, label_changes):
+        self.sections_before = sections_before
+        self.sections_after = sections_after
+        self.compartments_before = compartments_before
+        self.compartments_after = compartments_after
+        self.merged = merged
+        self.reduced = reduced
+        self.label_changes = label_changes
+
+    def __repr__(self):
+        return "<{}: {} -> {} sections, {} -> {} compartments>".format(
+            self.__class__.__name__, self.sections_before, self.sections_after,
+            self.compartments_before, self.compartments_after,
+        )
+
+    def to_dict(self):
+        """
+            Return the report as a JSON serializable dictionary.
+        """
+        return dict(vars(self))
+
+
+def simplify_morphology(morphology, model=None, merge_chains=True, reduce_order=None, tolerance=0.05):
+    """
+        Reduce the number of sections, and thereby compartments, of a morphology:
+
+        * Unbranched chains of sections, each attached to the end of the previous one,
+          are merged into one section. Their points are kept, so the geometry doesn't
+          change. A longer section can need more segments than its parts together, so
+          a chain is only merged as far as that doesn't increase the number of
+          segments that the model class gives it.
+        * If ``reduce_order`` is given, each subtree that starts at that branch order is
+          reduced to a single equivalent cylinder (Rall), if the diameters of the
+          children at each of its branch points satisfy the 3/2 power rule and all its
+          tips are at the same electrotonic distance, both within ``tolerance``. The
+          cylinder has the diameter of the subtree's first section and the same
+          electrotonic length, so that its membrane area and input resistance are
+          preserved.
+
+        Only sections with the same labels are merged or reduced together. Labels are
+        predicted from the ``labels`` of the ``model`` class, as
+        :meth:`~arborize.core.NeuronModel._apply_labels` would apply them, and merges
+        that would change the labels of a section are undone.
+
+        :param morphology: Morphology to simplify.
+        :type morphology: :class:`~arborize.morphology.Morphology`
+        :param model: Model class whose labels should be kept.
+        :type model: :class:`~arborize.core.NeuronModel` subclass
+        :param merge_chains: Merge unbranched chains of sections.
+        :type merge_chains: bool
+        :param reduce_order: Branch order from which subtrees are reduced to equivalent
+          cylinders. Subtrees are not reduced if omitted.
+        :type reduce_order: int
+        :param tolerance: Relative deviation from the 3/2 power rule and between the
+          electrotonic lengths of the tips that is allowed in reduced subtrees.
+        :type tolerance: float
+        :returns: The simplified morphology and the report.
+        :rtype: tuple of :class:`~arborize.morphology.Morphology` and :class:`.SimplificationReport`
+    """
+    n = len(morphology)
+    labels = _morphology_labels(morphology, model)
+    ids = {}
+    keys = np.array([ids.setdefault(l, len(ids)) for l in labels], dtype=int)
+    key_labels = list(ids)
+
+    def nseg(L, diam, keys):
+        return _morphology_nseg(model, L, diam, [key_labels[k] for k in keys])
+
+    excluded = np.zeros(n, dtype=bool)
+    for _ in range(3):
+        result, new_index, merged, reduced = _simplify(
+            morphology, keys, excluded, merge_chains, reduce_order, tolerance, nseg,
+        )
+        new_labels = _morphology_labels(result, model)
+        changed = np.array([labels[i] != new_labels[new_index[i]] for i in range(n)], dtype=bool)
+        if not changed.any():
+            break
+        # Keep all sections that were combined into a section with changed labels apart.
+        excluded |= np.isin(new_index, new_index[changed])
+    report = SimplificationReport(
+        n, len(result), _compartments(morphology, model, labels),
+        _compartments(result, model, new_labels), merged, reduced,
+        int(np.count_nonzero(changed)),
+    )
+    return result, report
+
+
+def _simplify(morphology, keys, excluded, merge_chains, reduce_order, tolerance, nseg):
+    # Return the simplified morphology and the index of each old section in it.
+    n = len(morphology)
+    new_index = np.arange(n)
+    merged = reduced = 0
+    if merge_chains:
+        morphology, new_index, merged = _merge_chains(morphology, keys, excluded, nseg)
+        # The sections of a chain all have the same key and exclusion.
+        keys = _take_first(keys, new_index, len(morphology))
+        excluded = _take_first(excluded, new_index, len(morphology))
+    if reduce_order is not None:
+        morphology, index, reduced = _reduce_subtrees(morphology, keys, excluded, reduce_order, tolerance)
+        new_index = index[new_index]
+    return morphology, new_index, merged, reduced
+
+
+def _merge_chains(morphology, keys, excluded, nseg=None):
+    n = len(morphology)
+    parents = np.asarray(morphology.parents)
+    types = np.asarray(morphology.types)
+    offsets = np.asarray(morphology.offsets)
+    points = np.asarray(morphology.points, dtype=float)
+    has_parent = parents >= 0
+    parent = np.where(has_parent, parents, 0)
+    children = np.bincount(parents[has_parent], minlength=n)
+    # A section is merged into its parent if it is its only child, attached to its end.
+    link = (
+        has_parent & (children[parent] == 1)
+        & (np.asarray(morphology.parent_x) == 1) & (np.asarray(morphology.child_x) == 0)
+        & (types == types[parent]) & (keys == keys[parent]) & ~excluded & ~excluded[parent]
+        & (np.diff(offsets) > 0) & (np.diff(offsets)[parent] > 0)
+    )
+    properties = SectionProperties.from_morphology(morphology)
+    L = properties.L
+    if nseg is not None:
+        link = _limit_chains(link, parents, L, properties.diam, keys, nseg)
+    # Find the first section of each chain and the position of each section in it.
+    up = np.where(link, parents, np.arange(n))
+    depth = link.astype(int)
+    for _ in range(max(n, 1).bit_length()):
+        depth = depth + np.where(up != np.arange(n), depth[up], 0)
+        up = up[up]
+    head = up
+    is_head = ~link
+    index = np.cumsum(is_head) - 1
+    new_index = index[head]
+    order = np.lexsort((depth, new_index))
+    counts = np.diff(offsets)
+    # Drop the first point of merged sections if it repeats the last point of the parent.
+    first = offsets[:-1]
+    repeat = link & (points[np.minimum(first, len(points) - 1)] == points[np.maximum(offsets[1:][parent] - 1, 0)]).all(axis=1)
+    take = _ranges(first[order] + repeat[order], counts[order] - repeat[order])
+    new_counts = np.bincount(new_index, weights=counts - repeat, minlength=index[-1] + 1).astype(np.int64)
+    new_offsets = np.zeros(len(new_counts) + 1, dtype=np.int64)
+    np.cumsum(new_counts, out=new_offsets[1:])
+    # Children of a chain are attached to its last section; rescale their position to
+    # the length of the merged section.
+    before = np.zeros(n)
+    sorted_L = L[order]
+    cumulative = np.cumsum(sorted_L) - sorted_L
+    group_start = np.zeros(n)
+    starts = np.flatnonzero(is_head[order])
+    group_start[order] = np.repeat(cumulative[starts], np.diff(np.append(starts, n)))
+    before[order] = cumulative - group_start[order]
+    total = np.bincount(new_index, weights=L, minlength=len(new_counts))
+    heads = np.flatnonzero(is_head)
+    head_parent = parents[heads]
+    attached = head_parent >= 0
+    parent_x = np.asarray(morphology.parent_x, dtype=float)[heads].copy()
+    p = head_parent[attached]
+    length = total[new_index[p]]
+    x = parent_x[attached]
+    # Other sections only branch off the last section of a chain, so its end stays 1.
+    parent_x[attached] = np.where(
+        (length > 0) & (x != 1), (before[p] + x * L[p]) / np.where(length > 0, length, 1), x
+    )
+    new_parents = np.where(attached, new_index[np.maximum(head_parent, 0)], -1)
+    result = Morphology(
+        points[take], np.asarray(morphology.diameters, dtype=float)[take], new_offsets, types[heads],
+        new_parents, parent_x, np.asarray(morphology.child_x)[heads],
+    )
+    return result, new_index, int(np.count_nonzero(link))
+
+
+def _limit_chains(link, parents, L, diam, keys, nseg):
+    # Undo the links of sections that would give their chain more segments than the
+    # merged part of the chain and the section have apart, walking each chain from
+    # its first section.
+    link = link.copy()
+    own = nseg(L, diam, keys)
+    next_section = np.full(len(link), -1)
+    next_section[parents[link]] = np.flatnonzero(link)
+    for head in np.flatnonzero(~link & (next_section >= 0)).tolist():
+        length, weighted, segments = L[head], L[head] * diam[head], own[head]
+        i = next_section[head]
+        while i >= 0:
+            merged_length = length + L[i]
+            merged_weighted = weighted + L[i] * diam[i]
+            merged_diam = merged_weighted / merged_length if merged_length > 0 else diam[i]
+            merged = nseg([merged_length], [merged_diam], [keys[i]])[0]
+            if merged <= segments + own[i]:
+                length, weighted, segments = merged_length, merged_weighted, merged
+            else:
+                link[i] = False
+                length, weighted, segments = L[i], L[i] * diam[i], own[i]
+            i = next_section[i]
+    return link
+
+
+def _reduce_subtrees(morphology, keys, excluded, reduce_order, tolerance):
+    n = len(morphology)
+    parents = np.asarray(morphology.parents)
+    offsets = np.asarray(morphology.offsets)
+    points = np.asarray(morphology.points, dtype=float)
+    diameters = np.asarray(morphology.diameters, dtype=float)
+    counts = np.diff(offsets)
+    properties = SectionProperties.from_morphology(morphology)
+    order = properties.branch_order
+    has_parent = parents >= 0
+    parent = np.where(has_parent, parents, 0)
+    # Root of the subtree of every section at or beyond the reduction order.
+    up = np.where(order > reduce_order, parents, np.arange(n))
+    for _ in range(max(n, 1).bit_length()):
+        up = up[up]
+    member = (order >= reduce_order) & (np.asarray(morphology.types) != SECTION_TYPES.index("soma")) & (counts > 1)
+    root = np.where(member, up, -1)
+    is_root = member & (root == np.arange(n))
+    children = np.bincount(parents[has_parent], minlength=n)
+    # Subtrees can't be reduced if any section has other labels, is excluded, or has
+    # children attached elsewhere than at its end.
+    bad = np.zeros(n, dtype=bool)
+    inside = member & ~is_root
+    np.logical_or.at(bad, root[inside], (keys[inside] != keys[root[inside]]) | (np.asarray(morphology.parent_x)[inside] != 1))
+    np.logical_or.at(bad, root[member], excluded[member] | ~member[root[member]])
+    # The 3/2 power rule at every branch point of the subtree.
+    start_d = diameters[np.minimum(offsets[:-1], len(diameters) - 1)]
+    end_d = diameters[np.maximum(offsets[1:] - 1, 0)]
+    branch_sum = np.bincount(parent[inside], weights=start_d[inside] ** 1.5, minlength=n)
+    branching = member & (children > 0)
+    deviation = np.abs(branch_sum[branching] / end_d[branching] ** 1.5 - 1)
+    np.logical_or.at(bad, root[branching], deviation > tolerance)
+    # Electrotonic length of each section, in units of sqrt(diameter), summed from the
+    # subtree root to every tip.
+    section_of = np.repeat(np.arange(n), counts)
+    same = section_of[1:] == section_of[:-1]
+    segment = np.linalg.norm(np.diff(points, axis=0), axis=1)[same]
+    mean_d = (diameters[1:][same] + diameters[:-1][same]) / 2
+    electrotonic = np.bincount(section_of[1:][same], weights=segment / np.sqrt(np.maximum(mean_d, 1e-12)), minlength=n)
+    # The subtree roots are left out of the jumps, or they would be added repeatedly.
+    path = np.where(inside, electrotonic, 0)
+    up = np.where(inside, parents, np.arange(n))
+    for _ in range(max(n, 1).bit_length()):
+        path = path + np.where(up != np.arange(n), path[up], 0)
+        up = up[up]
+    path = np.where(member, path + electrotonic[np.maximum(root, 0)], 0)
+    tips = member & (children == 0)
+    longest = np.zeros(n)
+    shortest = np.full(n, np.inf)
+    np.maximum.at(longest, root[tips], path[tips])
+    np.minimum.at(shortest, root[tips], path[tips])
+    reduce = is_root & ~bad & (children > 0) & (longest <= shortest * (1 + tolerance))
+    # Replace each reduced subtree by a cylinder towards the mean of its tips.
+    roots = np.flatnonzero(reduce)
+    removed = inside & reduce[np.maximum(root, 0)]
+    kept = ~removed
+    index = np.cumsum(kept) - 1
+    index[removed] = index[root[removed]]
+    d = start_d[roots]
+    length = (longest[roots] + shortest[roots]) / 2 * np.sqrt(d)
+    start = points[offsets[:-1][roots]]
+    tip_points = np.zeros((n, 3))
+    tip_count = np.bincount(root[tips], minlength=n)
+    np.add.at(tip_points, root[tips], points[offsets[1:][tips] - 1])
+    direction = tip_points[roots] / np.maximum(tip_count[roots], 1)[:, None] - start
+    norm = np.linalg.norm(direction, axis=1)
+    direction = np.where(norm[:, None] > 0, direction / np.where(norm > 0, norm, 1)[:, None], [1., 0., 0.])
+    cylinders = np.stack((start, start + direction * length[:, None]), axis=1).reshape(-1, 3)
+    all_points = np.concatenate((points, cylinders))
+    all_diameters = np.concatenate((diameters, np.repeat(d, 2)))
+    starts = offsets[:-1].copy()
+    lengths = counts.copy()
+    starts[roots] = len(points) + 2 * np.arange(len(roots))
+    lengths[roots] = 2
+    take = _ranges(starts[kept], lengths[kept])
+    new_offsets = np.zeros(np.count_nonzero(kept) + 1, dtype=np.int64)
+    np.cumsum(lengths[kept], out=new_offsets[1:])
+    result = Morphology(
+        all_points[take], all_diameters[take], new_offsets, np.asarray(morphology.types)[kept],
+        np.where(has_parent[kept], index[parent[kept]], -1), np.asarray(morphology.parent_x)[kept],
+        np.asarray(morphology.child_x)[kept],
+    )
+    return result, index, len(roots)
+
+
+def _ranges(starts, lengths):
+    # Concatenation of the index ranges [start, start + length).
+    lengths = np.asarray(lengths, dtype=np.int64)
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    offsets = np.repeat(np.asarray(starts, dtype=np.int64) - (ends - lengths), lengths)
+    return offsets + np.arange(total)
+
+
+def _take_first(values, new_index, n):
+    result = np.empty(n, dtype=values.dtype)
+    result[new_index[::-1]] = values[::-1]
+    return result
+
+
+def _compartments(morphology, model, labels):
+    properties = SectionProperties.from_morphology(morphology)
+    return int(_morphology_nseg(model, properties.L, properties.diam, labels).sum())
+
+
+class SimplifyBuilder(Builder):
+    """
+        Builder that simplifies the morphology before it is instantiated, using
+        :func:`.simplify_morphology` with the labels of the model class. Place it after
+        a morphology in the ``morphologies`` of a model:
+
+        .. code-block:: python
+
+            class MyNeuron(NeuronModel):
+                morphologies = [("cell.asc", SimplifyBuilder(reduce_order=4))]
+
+        Each morphology is simplified once per model class and its report is kept in
+        ``reports``. Morphologies are recognized by their content, also when they were
+        translated to the position of each cell by an earlier builder.
+
+        :param kwargs: Keyword arguments for :func:`.simplify_morphology`.
+    """
+    def __init__(self, **kwargs):
+        self.options = kwargs
+        #: Report of each simplified morphology, in the order they were simplified.
+        self.reports = []
+        self._simplified = {}
+
+    def transform_morphology(self, morphology, model):
+        """
+            Return the simplified :class:`~arborize.morphology.Morphology`.
+        """
+        digest, origin = _geometry_digest(morphology)
+        key = (digest, model.__class__)
+        cached = self._simplified.get(key)
+        if cached is None:
+            simplified, report = simplify_morphology(morphology, model.__class__, **self.options)
+            self.reports.append(report)
+            cached = _cache_put(self._simplified, key, (simplified, origin))
+        simplified, cached_origin = cached
+        if (origin != cached_origin).any():
+            # Move the result of an earlier, translated copy onto this morphology.
+            simplified = simplified.transform(translation=origin - cached_origin)
+        return simplified
+
+    def instantiate(self, model, *args, **kwargs):
+        # Replace the sections that were created by a previous builder by those of the
+        # simplified morphology.
+        lists = [name for name in (*SECTION_TYPES, "dendrites") if getattr(model, name, None)]
+        sections = [s for name in lists for s in getattr(model, name)]
+        types = [
+            SECTION_TYPES.index("dend" if name == "dendrites" else name)
+            for name in lists for _ in getattr(model, name)
+        ]
+        simplified = self.transform_morphology(Morphology.from_sections(sections, types), model)
+        for name in lists:
+            setattr(model, name, [])
+        simplified.instantiate(model)
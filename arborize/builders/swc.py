@@ -0,0 +1,152 @@
+import os, functools
+import numpy as np
+from ..core import Builder
+from ..morphology import Morphology, _check_file, _file_digest
+
+# SWC structure identifiers mapped onto `SECTION_TYPES`: soma, dend, axon & apic, like
+# Import3D. Custom types are treated as dendrites.
+_SOMA, _DEND, _AXON, _APIC = range(4)
+_SWC_TYPES = {1: _SOMA, 2: _AXON, 4: _APIC}
+
+
+class SWCBuilder(Builder):
+    """
+        Builder that reads an SWC file with NumPy and creates all sections in bulk,
+        without going through NEURON's Import3D. Use it as an entry of the
+        ``morphologies`` of a model:
+
+        .. code-block:: python
+
+            class MyNeuron(NeuronModel):
+                morphologies = [
+                    SWCBuilder("cell.swc"),
+                    (SWCBuilder("cell2.swc"), rotate([0., 1., 0.], [1., 0., 0.])),
+                ]
+
+        Relative paths are resolved against the ``morphology_directory`` of the model.
+    """
+    def __init__(self, file):
+        self.file = file
+
+    def get_morphology(self, model):
+        file = self.file
+        if not os.path.isabs(file):
+            file = os.path.join(model.__class__.morphology_directory, file)
+        return load_swc(file)
+
+    def instantiate(self, model, *args, **kwargs):
+        self.get_morphology(model).instantiate(model)
+
+
+def load_swc(file):
+    """
+        Parse an SWC file into a :class:`~arborize.morphology.Morphology`. Parsed files
+        are cached in memory by the hash of their content.
+    """
+    _check_file(file)
+    return _load_swc(_file_digest(file), file)
+
+
+@functools.lru_cache(maxsize=128)
+def _load_swc(digest, file):
+    return parse_swc(np.loadtxt(file, comments="#", ndmin=2))
+
+
+def parse_swc(data):
+    """
+        Convert the rows of an SWC file into a :class:`~arborize.morphology.Morphology`.
+        Unbranched chains of samples of the same type become a section, all soma samples
+        are merged into a single soma section.
+
+        :param data: Array with the ``id, type, x, y, z, radius, parent`` SWC columns.
+        :type data: :class:`numpy.ndarray`
+    """
+    ids = data[:, 0].astype(np.int64)
+    types = np.array([_SWC_TYPES.get(t, _DEND) for t in data[:, 1].astype(int)], dtype=np.int8)
+    points = data[:, 2:5]
+    diameters = data[:, 5] * 2
+    # Map the parent ids onto row indices.
+    order = np.argsort(ids)
+    parent_ids = data[:, 6].astype(np.int64)
+    is_root = parent_ids < 0
+    parents = order[np.searchsorted(ids[order], parent_ids)]
+    parents[is_root] = -1
+    n = len(ids)
+    rows = np.arange(n)
+    soma = types == _SOMA
+    # A sample starts a new section if it is a root, if its type differs from its
+    # parent, or if its parent branches.
+    children = np.bincount(parents[~is_root], minlength=n)
+    is_start = is_root | (types != types[parents]) | (children[parents] > 1)
+    # The soma is handled separately, and doesn't start sections.
+    is_start[soma] = False
+    # Find the first sample of every section and the distance along the section
+    # by pointer jumping towards the section start.
+    head = np.where(is_start | soma, rows, parents)
+    depth = (~(is_start | soma)).astype(np.int64)
+    while True:
+        jump = head[head]
+        if np.array_equal(jump, head):
+            break
+        depth = depth + depth[head]
+        head = jump
+    starts = rows[is_start]
+    # Order the sections soma, dend, axon, apic; keeping the file order within each type.
+    starts = starts[np.argsort(types[starts], kind="stable")]
+    section_of = np.full(n, -1, dtype=np.int64)
+    has_soma = soma.any()
+    offset = int(has_soma)
+    section_of[starts] = np.arange(len(starts)) + offset
+    section_of[~soma] = section_of[head[~soma]]
+    # Sort the non-soma samples by section and distance along it.
+    samples = rows[~soma]
+    samples = samples[np.lexsort((depth[samples], section_of[samples]))]
+    counts = np.bincount(section_of[samples], minlength=len(starts) + offset)
+    # Sections that don't start on the soma or a root include their parent's last point
+    start_parents = parents[starts]
+    attach = (start_parents >= 0) & ~soma[np.maximum(start_parents, 0)]
+    counts[offset:] += attach
+    section_points = []
+    section_diameters = []
+    soma_points, soma_diameters = _soma_points(points[soma], diameters[soma], rows[soma], parents[soma])
+    if has_soma:
+        section_points.append(soma_points)
+        section_diameters.append(soma_diameters)
+    # Gather the sample indices of each section in one flat array.
+    flat = np.empty(counts[offset:].sum(), dtype=np.int64)
+    section_offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(counts[offset:], out=section_offsets[1:])
+    own = np.ones(len(flat), dtype=bool)
+    own[section_offsets[:-1][attach]] = False
+    flat[own] = samples
+    flat[section_offsets[:-1][attach]] = start_parents[attach]
+    section_points.append(points[flat])
+    section_diameters.append(diameters[flat])
+    offsets = np.zeros(len(starts) + offset + 1, dtype=np.int64)
+    offsets[offset:] = section_offsets + (len(soma_points) if has_soma else 0)
+    # Connect sections to the end of their parent section, or the middle of the soma.
+    section_parents = np.where(start_parents >= 0, section_of[np.maximum(start_parents, 0)], -1)
+    section_parents[(start_parents >= 0) & ~attach] = 0 if has_soma else -1
+    parent_x = np.where(attach, 1.0, 0.5)
+    return Morphology(
+        np.concatenate(section_points),
+        np.concatenate(section_diameters),
+        offsets,
+        np.concatenate(([_SOMA] if has_soma else [], types[starts])).astype(np.int8),
+        np.concatenate(([-1] if has_soma else [], section_parents)).astype(np.int64),
+        np.concatenate(([1.0] if has_soma else [], parent_x)),
+        np.zeros(len(starts) + offset),
+    )
+
+
+def _soma_points(points, diameters, rows, parents):
+    if len(points) == 1:
+        # Single point soma: a cylinder along the y-axis with the soma's diameter as
+        # length, which has the same surface as the sphere.
+        r = diameters[0] / 2
+        offset = np.array([0, r, 0])
+        return np.array([points[0] - offset, points[0], points[0] + offset]), np.repeat(diameters, 3)
+    if len(points) == 3 and (parents[1:] == rows[0]).all():
+        # Three point soma convention: the root sample with two children on either side.
+        return points[[1, 0, 2]], np.repeat(diameters[0], 3)
+    return points, diameters
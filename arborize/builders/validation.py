@@ -0,0 +1,277 @@
+import warnings
+import numpy as np
+from ..core import Builder
+from ..exceptions import MorphologyValidationError
+from ..morphology import Morphology, SECTION_TYPES, _set_pt3d, _geometry_digest, _cache_put
+
+class MorphologyReport:
+    """
+        Statistics and problems of a morphology, as found by
+        :func:`.validate_morphology`:
+
+        * ``sections``, ``points``: Number of sections and 3D points.
+        * ``length``: Total length of all sections.
+        * ``compartments``: Number of segments with the default ``1 + 2 * int(L / 40)``
+          rule, and ``max_nseg`` of the longest section.
+        * ``problems``: Number of sections or points with each problem, before repairs.
+        * ``repaired``: Names of the repaired problems.
+    """
+    def __init__(self, sections, points, length, compartments, max_nseg, problems, repaired):
+        self.sections = sections
+        self.points = points
+        self.length = length
+        self.compartments = compartments
+        self.max_nseg = max_nseg
+        self.problems = problems
+        self.repaired = repaired
+
+    def __repr__(self):
+        return "<{} of {} sections, {} compartments, problems: {}>".format(
+            self.__class__.__name__, self.sections, self.compartments, self.problems or "none"
+        )
+
+    @property
+    def unrepaired(self):
+        """
+            Problems that were found but not repaired.
+        """
+        return {k: v for k, v in self.problems.items() if k not in self.repaired}
+
+    def to_dict(self):
+        """
+            Return the report as a JSON serializable dictionary.
+        """
+        return {
+            "sections": self.sections,
+            "points": self.points,
+            "length": self.length,
+            "compartments": self.compartments,
+            "max_nseg": self.max_nseg,
+            "problems": dict(self.problems),
+            "repaired": list(self.repaired),
+        }
+
+
+def validate_morphology(morphology, repair=True, min_diameter=0.1, min_length=0.01, max_compartments=None):
+    """
+        Check all points and sections of a morphology at once for problems that make
+        simulations slow or fail, and repair those that can be repaired:
+
+        * ``invalid_parents``: Sections with a parent that doesn't exist, or that are
+          part of a cycle.
+        * ``non_finite_points``: Points with a NaN or infinite coordinate or diameter.
+        * ``empty_sections``: Sections without points.
+        * ``thin_diameters``: Points with a diameter smaller than ``min_diameter``.
+          Repaired by setting them to ``min_diameter``.
+        * ``duplicate_points``: Consecutive points at the same location. Repaired by
+          removing them.
+        * ``short_sections``: Sections shorter than ``min_length``. Repaired by moving
+          their last point to ``min_length`` from their first, in the direction of
+          their parent.
+        * ``disconnected_trees``: Root sections other than the first. Repaired by
+          connecting them to the middle of the first soma section, or the end of the
+          first root section.
+        * ``too_many_compartments``: More compartments than ``max_compartments``.
+
+        :param morphology: Morphology to validate.
+        :type morphology: :class:`~arborize.morphology.Morphology`
+        :param repair: Repair the problems that can be repaired.
+        :type repair: bool
+        :param min_diameter: Smallest allowed diameter.
+        :param min_length: Smallest allowed section length.
+        :param max_compartments: Largest allowed number of compartments.
+        :returns: The repaired morphology, or the given morphology if nothing was
+          repaired, and the report.
+        :rtype: tuple of :class:`~arborize.morphology.Morphology` and :class:`.MorphologyReport`
+    """
+    n = len(morphology)
+    points = np.asarray(morphology.points, dtype=float)
+    diameters = np.asarray(morphology.diameters, dtype=float)
+    offsets = np.asarray(morphology.offsets)
+    parents = np.asarray(morphology.parents)
+    parent_x = np.asarray(morphology.parent_x)
+    counts = np.diff(offsets)
+    problems = {}
+    repaired = []
+
+    def found(name, mask):
+        count = int(np.count_nonzero(mask))
+        if count:
+            problems[name] = count
+        return count
+
+    # Structure: parents must exist, and every section must lead to a root.
+    invalid = (parents < -1) | (parents >= n) | (parents == np.arange(n))
+    found("invalid_parents", invalid | (_roots(np.where(invalid, -1, parents)) < 0))
+    finite = np.isfinite(points).all(axis=1) & np.isfinite(diameters)
+    found("non_finite_points", ~finite)
+    found("empty_sections", counts == 0)
+    fixable = not problems
+
+    thin = finite & (diameters < min_diameter)
+    if found("thin_diameters", thin) and repair and fixable:
+        diameters = np.where(thin, min_diameter, diameters)
+        repaired.append("thin_diameters")
+
+    section_of = np.repeat(np.arange(n), counts)
+    same = section_of[1:] == section_of[:-1]
+    # Of consecutive points at the same location keep the last, so that sections keep
+    # their ends, and the first of sections at a single location, so that they keep 2.
+    duplicate = np.zeros(len(points), dtype=bool)
+    duplicate[:-1] = same & (points[1:] == points[:-1]).all(axis=1)
+    single = np.bincount(section_of[~duplicate], minlength=n) == 1
+    duplicate[offsets[:-1][single]] = False
+    if found("duplicate_points", duplicate) and repair and fixable:
+        points, diameters = points[~duplicate], diameters[~duplicate]
+        counts = np.bincount(section_of[~duplicate], minlength=n)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        section_of = section_of[~duplicate]
+        same = section_of[1:] == section_of[:-1]
+        repaired.append("duplicate_points")
+
+    lengths = _section_lengths(points, section_of, same, n)
+    # Allow for rounding, so that repaired sections pass validation.
+    short = (counts > 1) & (lengths < min_length * (1 - 1e-6))
+    found("short_sections", short | (counts == 1))
+    if short.any() and repair and fixable:
+        points = points.copy()
+        first, end = offsets[:-1][short], offsets[1:][short] - 1
+        points[end] = points[first] + _directions(points, offsets, parents, short) * min_length
+        lengths = _section_lengths(points, section_of, same, n)
+        if not (counts == 1).any():
+            repaired.append("short_sections")
+
+    roots = np.flatnonzero(parents == -1)
+    parents = parents.copy()
+    parent_x = parent_x.copy()
+    if found("disconnected_trees", np.isin(np.arange(n), roots[1:])) and repair and fixable:
+        soma = np.flatnonzero(np.asarray(morphology.types) == SECTION_TYPES.index("soma"))
+        main = soma[0] if len(soma) and parents[soma[0]] == -1 else roots[0]
+        parents[roots[roots != main]] = main
+        parent_x[roots[roots != main]] = 0.5 if main in soma else 1.0
+        repaired.append("disconnected_trees")
+
+    # Non-finite points are reported above, don't let them spoil the statistics.
+    lengths = np.where(np.isfinite(lengths), lengths, 0)
+    nseg = 1 + 2 * (lengths // 40).astype(int)
+    compartments = int(nseg.sum())
+    if max_compartments is not None and compartments > max_compartments:
+        problems["too_many_compartments"] = compartments
+    report = MorphologyReport(
+        n, len(points), float(lengths.sum()), compartments, int(nseg.max()) if n else 0, problems, repaired,
+    )
+    if not repaired:
+        return morphology, report
+    return Morphology(
+        points, diameters, offsets, np.asarray(morphology.types), parents, parent_x,
+        np.asarray(morphology.child_x),
+    ), report
+
+
+def _roots(parents):
+    # Root of every section by pointer jumping, or -1 for sections in a cycle.
+    n = len(parents)
+    up = np.where(parents < 0, np.arange(n), parents)
+    for _ in range(max(n, 1).bit_length() + 1):
+        up = up[up]
+    return np.where(parents[up] < 0, up, -1)
+
+
+def _section_lengths(points, section_of, same, n):
+    segments = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    return np.bincount(section_of[1:][same], weights=segments[same], minlength=n)
+
+
+def _directions(points, offsets, parents, sections):
+    # Unit vector along the last segment of the parent of each section, or the x-axis.
+    directions = np.zeros((np.count_nonzero(sections), 3))
+    directions[:, 0] = 1
+    parent = parents[sections]
+    has_parent = parent >= 0
+    end = offsets[parent[has_parent] + 1] - 1
+    start = np.maximum(end - 1, offsets[parent[has_parent]])
+    vectors = points[end] - points[start]
+    norms = np.linalg.norm(vectors, axis=1)
+    valid = norms > 0
+    directions[np.flatnonzero(has_parent)[valid]] = vectors[valid] / norms[valid, None]
+    return directions
+
+
+class ValidationBuilder(Builder):
+    """
+        Builder that validates, and by default repairs, the morphology before it is
+        instantiated, using :func:`.validate_morphology`. Place it after a morphology
+        in the ``morphologies`` of a model:
+
+        .. code-block:: python
+
+            class MyNeuron(NeuronModel):
+                morphologies = [("cell.asc", ValidationBuilder(max_compartments=5000))]
+
+        Each morphology is validated once and its report is kept in ``reports``.
+        Morphologies are recognized by their content, also when they were translated to
+        the position of each cell by an earlier builder.
+        Problems that are not repaired raise a
+        :class:`~arborize.exceptions.MorphologyValidationError`, or a warning if
+        ``strict`` is ``False``.
+
+        :param strict: Raise an error for problems that were not repaired.
+        :type strict: bool
+        :param kwargs: Keyword arguments for :func:`.validate_morphology`.
+    """
+    def __init__(self, strict=True, **kwargs):
+        self.strict = strict
+        self.options = kwargs
+        #: Report of each validated morphology, in the order they were validated.
+        self.reports = []
+        self._validated = {}
+
+    def transform_morphology(self, morphology, model):
+        """
+            Return the validated and repaired :class:`~arborize.morphology.Morphology`.
+        """
+        return self._validate(morphology, model)
+
+    def instantiate(self, model, *args, **kwargs):
+        # Validate sections that were created by a previous builder, writing back the
+        # repaired points and connections.
+        sections = [s for name in SECTION_TYPES for s in (getattr(model, name, None) or [])]
+        sections += model.dendrites or []
+        types = [SECTION_TYPES.index(name) for name in SECTION_TYPES for _ in (getattr(model, name, None) or [])]
+        types += [SECTION_TYPES.index("dend")] * len(model.dendrites or [])
+        morphology = Morphology.from_sections(sections, types)
+        repaired = self._validate(morphology, model)
+        if repaired is morphology:
+            return
+        for i, section in enumerate(sections):
+            points, diameters = repaired.section_points(i)
+            old_points, old_diameters = morphology.section_points(i)
+            if len(points) != len(old_points) or (points != old_points).any() or (diameters != old_diameters).any():
+                _set_pt3d(section, points, diameters)
+            if morphology.parents[i] == -1 and repaired.parents[i] != -1:
+                section.connect(sections[repaired.parents[i]], repaired.parent_x[i], 0)
+
+    def _validate(self, morphology, model):
+        # Return the repaired morphology, or the given morphology if nothing was repaired.
+        digest, origin = _geometry_digest(morphology)
+        cached = self._validated.get(digest)
+        if cached is None:
+            repaired, report = validate_morphology(morphology, **self.options)
+            self.reports.append(report)
+            unrepaired = report.unrepaired
+            if unrepaired:
+                message = "Morphology of {} has problems: {}".format(
+                    model.__class__.__name__, ", ".join("{} ({})".format(k, v) for k, v in unrepaired.items())
+                )
+                if self.strict:
+                    raise MorphologyValidationError(message, report)
+                warnings.warn(message)
+            cached = _cache_put(self._validated, digest, (None if repaired is morphology else repaired, origin))
+        repaired, cached_origin = cached
+        if repaired is None:
+            return morphology
+        if (origin != cached_origin).any():
+            # Move the repairs of an earlier, translated copy onto this morphology.
+            repaired = repaired.transform(translation=origin - cached_origin)
+        return repaired
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+from .core import _unpack_synapse_definition
+
+if not os.getenv('READTHEDOCS'):
+    from patch import p
+    from .synapse import Synapse
+    from .resolution import resolve
+
+
+def connect_bulk(pre_cells, pre_sections, post_cells, post_sections, synapse_types=None, weights=None, delays=None):
+    """
+        Create many connections at once. Each connection creates a synapse on a
+        postsynaptic section, like :meth:`~arborize.core.NeuronModel.connect`, and a
+        NetCon from the presynaptic section to it. The synapse type is validated and its
+        point process resolved once per model class, section labels and synapse type.
+
+        :param pre_cells: Presynaptic cell of each connection.
+        :type pre_cells: sequence of :class:`~arborize.core.NeuronModel`
+        :param pre_sections: Index of each presynaptic section in ``cell.sections``.
+        :type pre_sections: array-like of int
+        :param post_cells: Postsynaptic cell of each connection.
+        :type post_cells: sequence of :class:`~arborize.core.NeuronModel`
+        :param post_sections: Index of each postsynaptic section in ``cell.sections``.
+        :type post_sections: array-like of int
+        :param synapse_types: Synapse type of each connection, or a single type for all
+          connections. Can be omitted if each postsynaptic section has only 1 type.
+        :type synapse_types: str or array-like of str
+        :param weights: Weight of each NetCon, or a single weight for all of them.
+        :type weights: float or array-like of float
+        :param delays: Delay of each NetCon, or a single delay for all of them.
+        :type delays: float or array-like of float
+        :returns: The created synapses and NetCons.
+        :rtype: tuple of 2 lists
+    """
+    n = len(pre_cells)
+    if not (len(pre_sections) == len(post_cells) == len(post_sections) == n):
+        raise ValueError("All connection arrays must have the same length.")
+    pre_sections = np.asarray(pre_sections, dtype=int).tolist()
+    post_sections = np.asarray(post_sections, dtype=int).tolist()
+    synapse_types = _broadcast(synapse_types, n, object)
+    weights = _broadcast(weights, n, float)
+    delays = _broadcast(delays, n, float)
+    specs = {}
+    synapses = []
+    netcons = []
+    for i in range(n):
+        pre_section = pre_cells[i].sections[pre_sections[i]]
+        post_cell = post_cells[i]
+        post_section = post_cell.sections[post_sections[i]]
+        key = (post_cell.__class__, tuple(post_section.labels), synapse_types[i])
+        try:
+            spec = specs[key]
+        except KeyError:
+            spec = specs[key] = _synapse_spec(post_cell, post_section, synapse_types[i])
+        synapse_type, point_process, attributes, source, mod_name = spec
+        synapse = Synapse(post_cell, post_section, point_process, attributes, type=synapse_type, source=source, mod_name=mod_name)
+        post_cell._add_synapse(post_section, synapse)
+        kwargs = {}
+        if weights[i] is not None:
+            kwargs["weight"] = weights[i]
+        if delays[i] is not None:
+            kwargs["delay"] = delays[i]
+        # Ephemeral segments aren't referenced by the section: the NetCon keeps them.
+        netcon = p.NetCon(pre_section(0.5, ephemeral=True), synapse._point_process, sec=pre_section, **kwargs)
+        synapses.append(synapse)
+        netcons.append(netcon)
+    return synapses, netcons
+
+
+def _synapse_spec(cell, section, synapse_type):
+    # Validate the synapse type and resolve its point process once.
+    synapse_type, definition = cell._get_synapse_definition(section, synapse_type)
+    point_process, variant, attributes, source = _unpack_synapse_definition(definition)
+    mod_name = resolve(point_process, variant=variant, context=cell.__class__.glia_package)
+    return synapse_type, point_process, attributes, source, mod_name
+
+
+def _broadcast(values, n, dtype):
+    # Return a list of n values, or of n None's if no values are given.
+    if values is None:
+        return [None] * n
+    values = np.asarray(values, dtype=dtype)
+    if values.ndim == 0:
+        return [values.item()] * n
+    if len(values) != n:
+        raise ValueError("All connection arrays must have the same length.")
+    return values.tolist()
@@ -1,6 +1,8 @@
-import os, sys, errr
-from contextlib import contextmanager
+import os, time, bisect, weakref, itertools, errr
 from .exceptions import *
+from .population import Population, _population_arrays
+from . import profiling, resolution
+from .tables import Table, Receiver, Transmitter, SectionSynapses, SYNAPSE_COLUMNS, RECEIVER_COLUMNS, TRANSMITTER_COLUMNS
 import numpy as np
 
 if not os.getenv('READTHEDOCS'):
@@ -8,6 +10,9 @@ if not os.getenv('READTHEDOCS'):
     from patch.objects import Section
     import glia as g
     from .synapse import Synapse
+    from .morphology import Morphology, SECTION_TYPES, load_morphology, preprocess_morphologies, _import3d_load
+    from .resolution import resolve
+    from .geometry import SectionProperties, SegmentProperties, SegmentParameter, discretize
     import glia.exceptions
     p.load_file('stdlib.hoc')
     p.load_file('import3d.hoc')
@@ -60,21 +65,62 @@ class ComboBuilder(Builder):
             :param path: Root path that all non absolute path strings will be combined with.
             :type path: string
         """
-        builder_pipe = [make_builder(part, path=path) for part in pipeline]
+        self.builder_pipe = [make_builder(part, path=path) for part in pipeline]
         def outer_builder(model, *args, **kwargs):
-            # Apply all builders in the pipeline sequence in order.
-            for builder in builder_pipe:
-                builder.instantiate(model, *args, **kwargs)
+            _run_pipeline(self.builder_pipe, model, *args, **kwargs)
 
         self.builder = outer_builder
 
+    def get_morphology(self, model):
+        """
+            Return the array morphology that this pipeline produces, if it consists of
+            an array morphology followed by transformations only.
+        """
+        return _fold_pipeline(self.builder_pipe, model)
+
 class NeuronModel:
     """
         The base class that helps you describe your model. Generate all the required
         sections, insert all mechanisms and define all synapses using the appropriate
         class variables. See the :doc:`/neuron_model`
+
+        By default each section gets ``1 + 2 * int(L / 40)`` segments. Set the
+        ``discretization`` class variable to a dictionary of keyword arguments for
+        :func:`~arborize.geometry.discretize` to change this, for example
+        ``{"d_lambda": 0.1, "frequency": 100, "max_nseg": 51}``. It is evaluated for all
+        sections at once, after the section attributes are set.
+
+        Sections are labelled ``soma``, ``dendrites``, ``axon`` or ``apic`` after the list
+        they were created in; Import3D and :class:`~arborize.builders.SWCBuilder` put
+        apical dendrites in the ``apic`` list.
+
+        Set the ``lazy_morphologies`` class variable to ``True`` to not load the
+        morphologies when the class is defined, but when the first cell of each
+        morphology is created. When the first cell of the class is created, the files of
+        all its morphologies are parsed in the background by the worker processes of
+        :func:`~arborize.morphology.preprocess_morphologies`, if the disk cache of
+        :data:`~arborize.morphology.cache_directory` is enabled. No processes are
+        started when the class is defined, so that defining models in the main module of
+        spawned processes is safe. Under MPI no processes are started at all, and each
+        rank loads the files it needs itself.
+
+        Cells created with ``deferred=True``, or of a class with the ``deferred`` class
+        variable set, only get their geometry, labels, ``nseg`` and synapse types. Their
+        mechanisms and attributes are recorded as a plan, and are inserted and set for
+        all deferred cells of the class at once by :meth:`.materialize`, which is called
+        automatically at the start of ``finitialize``. Their ``boot`` method is called
+        after materialization.
+
+        Set the ``prototype_geometry`` class variable to ``True`` to build only the first
+        cell of each morphology with its builders. Its geometry, labels and ``nseg`` are
+        captured as a prototype, from which the sections of later cells are created in
+        bulk. If the last builder translates the morphology to the cell's ``position``,
+        the prototype is translated to the position of each cell; morphologies that are
+        translated by an earlier builder are not prototyped. Only use it for builders
+        that create the same geometry for every cell, and nothing else. Cells with a
+        ``rotation`` are always built by their builders.
     """
-    def __init__(self, position=None, morphology=0, candidate=0, synapses=0):
+    def __init__(self, position=None, morphology=0, candidate=0, synapses=0, rotation=None, deferred=None):
         if self.__class__._abstract:
             raise NotImplementedError(f"Can't instantiate abstract NeuronModel {self.__class__.__name__}")
         # Initialize variables
@@ -82,55 +128,180 @@ class NeuronModel:
         self.dendrites = []
         self.axon = []
         self.soma = []
+        self.apic = []
 
-        morphology_loader = self.__class__.imported_morphologies[morphology]
-        # Use the Import3D/Builder to instantiate this cell.
-        morphology_loader.instantiate(self)
-        self._wrap_sections()
-        self._collect_sections()
+        timer = profiling.start(self.__class__)
+        # Finish the timer also if the build fails, or later counts would go to it.
+        try:
+            self._morphology = morphology
+            prototypes = self.__class__._arbz_prototypes
+            capture = self.__class__.prototype_geometry and rotation is None and morphology not in prototypes
+            prototype = prototypes.get(morphology) if rotation is None else None
+            if prototype is not None:
+                prototype.instantiate(self)
+                if timer:
+                    timer.lap("prototype")
+            else:
+                morphology_loader = self.__class__.imported_morphologies[morphology]
+                pipeline = [morphology_loader]
+                if rotation is not None:
+                    from .builders import TransformBuilder
+                    pipeline.append(TransformBuilder(rotation=rotation, cache=False))
+                # Use the Import3D/Builder to instantiate this cell.
+                _run_pipeline(pipeline, self)
+                if timer:
+                    timer.lap("morphology")
+                self._wrap_sections()
+                self._collect_sections()
+                if timer:
+                    timer.lap("sections")
+
+                # Do labelling of sections into special sections
+                self._apply_labels()
+                if timer:
+                    timer.lap("labels")
+            nsegs = prototype.nseg if prototype is not None and prototype.nseg else itertools.repeat(None)
+
+            if deferred is None:
+                deferred = self.__class__.deferred
+            if deferred:
+                # Record the template of each section, to be applied by `materialize`.
+                with g.context(pkg=self._package):
+                    state = resolution.state()
+                    self._plan = [
+                        self._init_section(section, deferred=True, nseg=nseg, state=state)
+                        for section, nseg in zip(self.sections, nsegs)
+                    ]
+                if capture:
+                    self._capture_prototype()
+                _defer(self)
+                if timer:
+                    timer.lap("plan")
+                return
+            self._plan = None
 
-        # Do labelling of sections into special sections
-        self._apply_labels()
+            # Set up preferred glia context
+            with g.context(pkg=self._package):
+                # Initialize the labelled sections
+                # This inserts all mechanisms
+                segment_parameters = []
+                state = resolution.state()
+                for section, nseg in zip(self.sections, nsegs):
+                    self._init_section(section, segment_parameters, nseg=nseg, state=state)
+                if capture:
+                    self._capture_prototype()
+                if self.__class__.discretization is not None:
+                    self._discretize()
+                    if timer:
+                        timer.lap("discretization")
+                if segment_parameters:
+                    self._apply_segment_parameters(segment_parameters)
+                    if timer:
+                        timer.lap("segment_parameters")
 
-        # Set up preferred glia context
-        with g.context(pkg=self._package):
-            # Initialize the labelled sections
-            # This inserts all mechanisms
-            for section in self.sections:
-                self._init_section(section)
+            # Call boot method so that child classes can easily do stuff after init.
+            self.boot()
+            if timer:
+                timer.lap("boot")
+        finally:
+            if timer:
+                timer.finish()
+
+    @classmethod
+    def create_population(cls, positions, morphologies=None, rotations=None, deferred=None):
+        """
+            Create a cell for each of the given positions. The cells are built one by
+            one, like cells created directly, and share what the class caches: the
+            loaded morphologies, the compiled section templates, the label indices and
+            discretizations of each morphology, and the prototypes of each morphology if
+            ``prototype_geometry`` is set. Pass ``deferred=True`` to insert the
+            mechanisms of the whole population at once, see :meth:`.materialize`.
 
-        # Call boot method so that child classes can easily do stuff after init.
-        self.boot()
+            :param positions: Positions of the cells.
+            :type positions: array-like of shape (n, 3)
+            :param morphologies: Index of the morphology of each cell, or a single index
+              for all cells. Defaults to the first morphology.
+            :type morphologies: int or array-like of shape (n,)
+            :param rotations: Rotation matrix of each cell, or a single rotation matrix
+              for all cells. Rotations are applied by a
+              :class:`~arborize.builders.TransformBuilder`, on the arrays of the
+              morphology if its builders produce one.
+            :type rotations: array-like of shape (n, 3, 3) or (3, 3)
+            :param deferred: Defer the insertion of mechanisms, see :meth:`.materialize`.
+              Defaults to the ``deferred`` class variable.
+            :type deferred: bool
+            :returns: The created cells and the throughput of their construction.
+            :rtype: :class:`~arborize.population.Population`
+        """
+        positions, morphologies, rotations = _population_arrays(cls, positions, morphologies, rotations)
+        start = time.perf_counter()
+        cells = [
+            cls(
+                position=position,
+                morphology=morphology,
+                rotation=None if rotations is None else rotations[i],
+                deferred=deferred,
+            )
+            for i, (position, morphology) in enumerate(zip(positions, morphologies))
+        ]
+        build_time = time.perf_counter() - start
+        for cell in cells:
+            # Cache the cost of the first cell of each morphology.
+            if cell._plan is None and cell._morphology not in cls._arbz_costs:
+                cls._arbz_costs[cell._morphology] = cell.cost
+        return Population(cls, cells, positions, morphologies, rotations, build_time)
 
     def _wrap_sections(self):
         # Wrap the neuron sections in our own Section, if not done by the Builder
         self.soma = [s if isinstance(s, Section) else Section(p, s) for s in (self.soma or [])]
         self.dend = [s if isinstance(s, Section) else Section(p, s) for s in (self.dend or [])]
         self.axon = [s if isinstance(s, Section) else Section(p, s) for s in (self.axon or [])]
+        self.apic = [s if isinstance(s, Section) else Section(p, s) for s in (getattr(self, "apic", None) or [])]
 
     def _collect_sections(self):
         self.dendrites = self.dend + self.dendrites
         del self.dend
-        self.sections = self.soma + self.dendrites + self.axon
-        for section in self.sections:
+        self.sections = self.soma + self.dendrites + self.axon + self.apic
+        for i, section in enumerate(self.sections):
+            # Position of the section in the rows of the synapse/receiver tables.
+            section._cell_index = i
             self._prep_section(section)
 
     def _prep_section(self, section):
-        section._synapses = []
-        section.synapses = section._synapses
+        section.synapses = SectionSynapses(self, section._cell_index)
 
     def __init_subclass__(cls, abstract=False, **kwargs):
         super().__init_subclass__(**kwargs)
         cls._abstract = abstract
+        cls._arbz_section_templates = {}
+        cls._arbz_label_indices = {}
+        cls._arbz_section_properties = {}
+        cls._arbz_segment_properties = {}
+        cls._arbz_discretizations = {}
+        cls._arbz_synapse_type_ids = {}
+        cls._arbz_costs = {}
+        cls._arbz_synapse_type_names = []
+        cls._arbz_deferred = []
+        cls._arbz_prototypes = {}
         if not abstract:
             cls._init_morphologies()
         if not hasattr(cls, "section_types"):
             cls.section_types = {}
-        for default_type in ["soma", "dendrites", "axon"]:
+        for default_type in ["soma", "dendrites", "axon", "apic"]:
             if default_type not in cls.section_types:
                 cls.section_types[default_type] = {}
         if not hasattr(cls, "glia_package"):
             cls.glia_package = None
+        if not hasattr(cls, "discretization"):
+            cls.discretization = None
+        if not hasattr(cls, "mechanism_costs"):
+            cls.mechanism_costs = {}
+        if not hasattr(cls, "lazy_morphologies"):
+            cls.lazy_morphologies = False
+        if not hasattr(cls, "deferred"):
+            cls.deferred = False
+        if not hasattr(cls, "prototype_geometry"):
+            cls.prototype_geometry = False
 
     @classmethod
     def _init_morphologies(cls):
@@ -142,15 +313,24 @@ class NeuronModel:
             cls._import_morphologies()
 
     def __getattr__(self, attribute):
+        if attribute.startswith("__"):
+            # Don't pretend to implement protocols, such as numpy's array interface
+            raise AttributeError(attribute)
         if attribute == "Vm":
             raise NotRecordingError("Trying to read Vm of a cell that is not recording." + " Use `.record_soma()` to enable recording of the soma.")
         if attribute in self.section_types:
-            return [s for s in self.sections if attribute in s.labels]
+            index = self.__dict__.get("_label_index")
+            if index is None:
+                return [s for s in self.sections if attribute in s.labels]
+            return [self.sections[i] for i in index.get(attribute, ())]
 
     @classmethod
     def _import_morphologies(cls):
         m_dir = getattr(cls, "morphology_directory", cls._get_default_morphology_dir())
         cls.morphology_directory = os.path.abspath(m_dir)
+        if getattr(cls, "lazy_morphologies", False):
+            cls.imported_morphologies = _LazyBuilders(cls, m_dir)
+            return
         cls.imported_morphologies = []
         for morphology in cls.morphologies:
             builder = cls.make_builder(morphology, path=m_dir)
@@ -167,16 +347,18 @@ class NeuronModel:
 
     def _apply_labels(self):
         for section in self.sections:
-            if not hasattr(section, "labels"):
-                section.labels = []
+            section.labels = LabelSet(getattr(section, "labels", ()))
         for section in self.soma:
             section.labels.insert(0, "soma")
         for section in self.dendrites:
             section.labels.insert(0, "dendrites")
         for section in self.axon:
             section.labels.insert(0, "axon")
+        for section in self.apic:
+            section.labels.insert(0, "apic")
 
         # Apply special labels
+        positions = None
         if hasattr(self.__class__, "labels"):
             for label, category in self.__class__.labels.items():
                 targets = self.__dict__[category["from"]]
@@ -190,103 +372,272 @@ class NeuronModel:
                     for id, target in enumerate(targets):
                         if l(target.diam):
                             target.labels.append(label)
+                elif "where" in category:
+                    # Vectorized predicate: receives the SectionProperties of all
+                    # targets and returns a boolean mask.
+                    if positions is None:
+                        positions = {s: i for i, s in enumerate(self.sections)}
+                    properties = self._get_section_properties().subset([positions[t] for t in targets])
+                    mask = np.asarray(category["where"](properties), dtype=bool)
+                    for i in np.flatnonzero(mask):
+                        targets[i].labels.append(label)
+        self._index_labels()
+
+    def _get_section_properties(self):
+        # The properties of all sections, computed once per morphology.
+        cache = self.__class__._arbz_section_properties
+        properties = cache.get(self._morphology)
+        if properties is None or len(properties) != len(self.sections):
+            root = self.soma[0] if self.soma else None
+            properties = cache[self._morphology] = SectionProperties.from_sections(self.sections, root=root)
+        return properties
 
+    def _index_labels(self):
+        # Map each label to the indices of its sections. Cells with the same morphology
+        # usually have the same labels, so identical indices are shared between them.
+        index = {}
+        for i, section in enumerate(self.sections):
+            for label in section.labels:
+                index.setdefault(label, []).append(i)
+            section.labels._bind(self, section)
+        shared = self.__class__._arbz_label_indices.setdefault(self._morphology, index)
+        self._label_index = shared if shared == index else index
 
-    def _init_section(self, section):
+    def _label_changed(self, section, label, added):
+        # Keep the label index up to date, copying it first if it is shared.
+        index = self._label_index
+        if index is self.__class__._arbz_label_indices.get(self._morphology):
+            index = self._label_index = {k: v.copy() for k, v in index.items()}
+        i = section._cell_index
+        if added:
+            bisect.insort(index.setdefault(label, []), i)
+        else:
+            index[label].remove(i)
+
+
+    def _init_section(self, section, segment_parameters=None, deferred=False, nseg=None, state=None):
         section.cell = self
-        # Set the amount of sections to some standard odd amount
-        section.nseg = 1 + (2 * int(section.L / 40))
-        # Store a map of mechanisms to full mod_names for the attribute setter
-        section._arbz_resolved_mechanisms = {}
-        for label in section.labels:
-            if label not in self.__class__.section_types:
-                raise LabelNotDefinedError("Label '{}' given to a section but not defined in {}".format(
-                    label,
-                    self.__class__.__name__
-                ))
-            self._init_section_label(section, label)
-        del section._arbz_resolved_mechanisms
-
-    def _init_section_label(self, section, label):
-        definition = self.__class__.section_types[label]
-        skipped_mechs = True
-        if "mechanisms" in definition:
-            self._apply_section_mechanisms(section, definition["mechanisms"])
-            skipped_mechs = False
-        if "attributes" in definition:
-            try:
-                self._apply_section_attributes(section, definition["attributes"])
-            except SectionAttributeError as e:
-                errr.wrap(SectionAttributeError, e, prepend="No mechanisms were inserted! ")
-        if "synapses" in definition:
-            self._apply_section_synapses(section, definition["synapses"])
-
-    def _apply_section_mechanisms(self, section, mechanisms):
-        # Insert the mechanisms
-        for mechanism in mechanisms:
-            try:
-                # Use Glia to resolve the mechanism selection.
-                if isinstance(mechanism, tuple):
-                    # Mechanism defined as: `(mech_name, mech_variant [, package])`
-                    name = mechanism[0]
-                    variant = mechanism[1]
-                    select = {"variant": variant}
-                    if len(mechanism) == 3:
-                        select["pkg"] = mechanism[2]
-                    mod_name = g.resolve(name, **select)
-                else:
-                    # Mechanism defined as string
-                    name = mechanism
-                    variant = "0"
-                    mod_name = g.resolve(mechanism)
-            except glia.exceptions.NoMatchesError as e:
-                e = MechanismNotFoundError("Could not find '{}.{}' in the glia library".format(name, variant), name, variant)
-                raise e from None
-            # Map the mechanism to the mod name
-            section._arbz_resolved_mechanisms[mechanism] = mod_name
-            # Use Glia to insert the resolved mod.
-            g.insert(section, mod_name)
+        if nseg is not None:
+            section.nseg = nseg
+        elif self.__class__.discretization is None:
+            # Set the amount of sections to some standard odd amount
+            section.nseg = 1 + (2 * int(section.L / 40))
+        # Replay the precompiled mechanisms, attributes and synapses of the labels
+        template = self.__class__._get_section_template(section.labels, state)
+        if deferred:
+            template.apply_synapse_types(section)
+        else:
+            template.apply(section, segment_parameters)
+        return template
 
-    def _apply_section_attributes(self, section, attributes):
-        # Set the attributes on this section and its mechanisms
-        for attribute, value in attributes.items():
-            mechanism_notice = ""
-            if isinstance(attribute, tuple):
-                # `attribute` is an attribute of a specific mechanism and defined
-                # as `(attribute, mechanism)`. This makes use of the fact that
-                # NEURON provides shorthands to a mechanism's attribute as
-                # `attribute_mechanism` instead of having to iterate over all
-                # the segments and setting `mechanism.attribute` for each
-                mechanism = attribute[1]
-                mechanism_notice = " specified for '{}'".format(mechanism)
-                # Check if we can unambiguously find a match for the specified mech
-                mod = _try_mech_presence(mechanism, section._arbz_resolved_mechanisms)
-                if not mod:
-                    raise MechanismNotPresentError("The attribute " + repr(attribute) + " specifies a mechanism '{}' that was not inserted in this section.".format(mechanism), mechanism) from None
-                attribute_name = attribute[0] + "_" + mod
-            else:
-                # `attribute` is an attribute of the section and is defined as string
-                attribute_name = attribute
-            # Check whether the value is callable, if so, pass it the section diameter
-            # and update the local variable to the return value. This allows parameters to
-            # depend on the diameter of the section.
-            if callable(value):
-                value = value(section.diam)
-            # Use setattr to set the obtained attribute information. __dict__
-            # does not work as NEURON's Python interface is incomplete.
+    def _capture_prototype(self):
+        translated = _translation(self.__class__.imported_morphologies[self._morphology])
+        # Morphologies that can't be prototyped are stored as None, to not try again.
+        prototype = None if translated is None else _Prototype(self, translated)
+        self.__class__._arbz_prototypes[self._morphology] = prototype
+
+    @classmethod
+    def materialize(cls):
+        """
+            Insert the mechanisms and set the attributes of all deferred cells of this
+            class. Sections with the same template are processed together, one
+            mechanism and attribute at a time across all cells. The cells are then
+            discretized, get their segment parameters and are booted.
+        """
+        cells = [cell for cell in (ref() for ref in cls._arbz_deferred) if cell is not None and cell._plan is not None]
+        cls._arbz_deferred = []
+        _deferred_models.discard(cls)
+        if not cells:
+            return
+        groups = {}
+        segment_parameters = []
+        with g.context(pkg=cells[0]._package):
+            # Recompile the planned templates if glia selections changed since.
+            state = resolution.state()
+            for cell in cells:
+                for section, template in zip(cell.sections, cell._plan):
+                    template = cls._get_section_template(template.labels, state)
+                    groups.setdefault(template, []).append(section)
+            for template, sections in groups.items():
+                template.apply_many(sections, segment_parameters)
+            cell_parameters = {}
+            for parameter in segment_parameters:
+                cell_parameters.setdefault(id(parameter[0].cell), []).append(parameter)
+            for cell in cells:
+                cell._plan = None
+                if cls.discretization is not None:
+                    cell._discretize()
+                if id(cell) in cell_parameters:
+                    cell._apply_segment_parameters(cell_parameters[id(cell)])
+        for cell in cells:
+            cell.boot()
+
+    def _discretize(self):
+        # Set the nseg of all sections according to the discretization policy of the
+        # class, computed once per morphology.
+        policy = self.__class__.discretization
+        key = (self._morphology, tuple(sorted(policy.items())))
+        cache = self.__class__._arbz_discretizations
+        nseg = cache.get(key)
+        if nseg is None or len(nseg) != len(self.sections):
+            nrn_sections = [s.__neuron__() for s in self.sections]
+            nseg = cache[key] = discretize(
+                [s.L for s in nrn_sections],
+                [s.diam for s in nrn_sections],
+                [s.Ra for s in nrn_sections],
+                [s.cm for s in nrn_sections],
+                **policy
+            ).tolist()
+        for section, n in zip(self.sections, nseg):
+            section.nseg = n
+
+    @property
+    def compartment_count(self):
+        """
+            Total number of segments of this cell.
+        """
+        return sum(s.nseg for s in self.sections)
+
+    @property
+    def cost(self):
+        """
+            Estimated computational cost of simulating this cell: every segment costs 1,
+            plus the cost of each mechanism inserted in it. Mechanisms cost 1 unless
+            specified otherwise in the ``mechanism_costs`` class variable, which maps
+            mod names (or their unresolved asset names) to relative costs.
+        """
+        costs = self.__class__.mechanism_costs
+        cost = 0.0
+        for section in self.sections:
+            template = self.__class__._get_section_template(section.labels)
+            mechanisms = zip(template.mechanisms, template.mechanism_names)
+            cost += section.nseg * (1 + sum(costs.get(m, costs.get(n, 1)) for m, n in mechanisms))
+        return cost
+
+    @classmethod
+    def estimate_cost(cls, morphology=0):
+        """
+            Return the estimated :attr:`cost` of a cell of this class with the given
+            morphology, without creating the cell. The estimate is computed from the
+            arrays of the morphology: the labels that the ``labels`` of the class give
+            its sections, the mechanisms of their section templates and the ``nseg`` of
+            the ``discretization`` policy, evaluated with the ``Ra`` and ``cm`` that the
+            templates set. Labels that builders add to sections are not known to the
+            estimate. The estimate is cached per morphology.
+
+            Builders that create sections instead of an array morphology are run once on
+            an empty instance of the class to read back their geometry. The instance is
+            not built: no mechanisms are inserted and ``boot`` is not called.
+
+            :param morphology: Index of the morphology in ``morphologies``.
+            :type morphology: int
+        """
+        try:
+            return cls._arbz_costs[morphology]
+        except KeyError:
+            pass
+        arrays = cls._get_array_morphology(morphology)
+        properties = SectionProperties.from_morphology(arrays)
+        state = resolution.state()
+        labels = _morphology_labels(arrays, cls)
+        templates = [cls._get_section_template(l, state) for l in labels]
+        nseg = _morphology_nseg(cls, properties.L, properties.diam, labels)
+        costs = cls.mechanism_costs
+        cost = 0.0
+        for template, n in zip(templates, nseg.tolist()):
+            mechanisms = zip(template.mechanisms, template.mechanism_names)
+            cost += n * (1 + sum(costs.get(m, costs.get(name, 1)) for m, name in mechanisms))
+        cls._arbz_costs[morphology] = cost
+        return cost
+
+    @classmethod
+    def _get_array_morphology(cls, morphology):
+        # The array morphology that the builders of `morphology` produce, read on an
+        # empty instance that is never built.
+        shell = cls.__new__(cls)
+        shell.position = np.zeros(3)
+        shell.soma, shell.dendrites, shell.axon, shell.apic = [], [], [], []
+        shell._morphology = morphology
+        builder = cls.imported_morphologies[morphology]
+        arrays = _fold_pipeline([builder], shell)
+        if arrays is not None:
+            return arrays
+        _run_pipeline([builder], shell)
+        lists = [getattr(shell, name, None) or [] for name in ("soma", "dend", "dendrites", "axon", "apic")]
+        types = [SECTION_TYPES.index(name) for name, l in zip(("soma", "dend", "dend", "axon", "apic"), lists) for _ in l]
+        return Morphology.from_sections([s for l in lists for s in l], types)
+
+    def _apply_segment_parameters(self, segment_parameters):
+        # Evaluate each segment parameter once for all segments of all its sections.
+        properties = self._get_segment_properties()
+        bounds = np.searchsorted(properties.section, np.arange(len(self.sections) + 1))
+        index = {s: i for i, s in enumerate(self.sections)}
+        groups = {}
+        for section, attribute, attribute_name, value in segment_parameters:
+            key = (attribute_name, id(value))
+            if key not in groups:
+                groups[key] = (attribute, attribute_name, value, [])
+            groups[key][3].append(index[section])
+        # Split the values per section; a later parameter of the same name overrides
+        # an earlier one on the sections they share.
+        per_section = {}
+        for attribute, attribute_name, value, sections in groups.values():
+            sections = np.unique(sections)
+            selection = properties.subset(np.isin(properties.section, sections))
+            values = value.evaluate(selection).tolist()
+            start = 0
+            for i, n in zip(sections.tolist(), (bounds[sections + 1] - bounds[sections]).tolist()):
+                per_section.setdefault(i, {})[attribute_name] = (attribute, values[start:start + n])
+                start += n
+        count = 0
+        for i, parameters in per_section.items():
+            nrn_section = self.sections[i].__neuron__()
+            segments = None
             try:
-                setattr(section.__neuron__(), attribute_name, value)
-            except AttributeError as e:
-                raise SectionAttributeError("The attribute '{}'{} is not found on a section with labels {}.".format(
+                for attribute_name, (attribute, values) in parameters.items():
+                    if values.count(values[0]) == len(values):
+                        # Uniform over the section: a single section wide assignment.
+                        setattr(nrn_section, attribute_name, values[0])
+                        count += 1
+                        continue
+                    if segments is None:
+                        segments = list(nrn_section)
+                    for seg, v in zip(segments, values):
+                        setattr(seg, attribute_name, v)
+                    count += len(values)
+            except AttributeError:
+                section = self.sections[i]
+                raise SectionAttributeError("The attribute '{}' is not found on a section with labels {}.".format(
                     attribute_name,
-                    mechanism_notice,
                     ", ".join("'{}'".format(l) for l in section.labels)
                 ), attribute, section.labels) from None
+        profiling.count("setattr", count)
 
-    def _apply_section_synapses(self, section, synapses):
-        if not hasattr(section, "available_synapse_types"):
-            section.available_synapse_types = []
-        section.available_synapse_types.extend(synapses.copy())
+    def _get_segment_properties(self):
+        # The properties of all segments, computed once per morphology.
+        cache = self.__class__._arbz_segment_properties
+        properties = cache.get(self._morphology)
+        if properties is None or len(properties) != sum(s.nseg for s in self.sections):
+            root = self.soma[0] if self.soma else None
+            properties = cache[self._morphology] = SegmentProperties.from_sections(self.sections, root=root)
+        return properties
+
+    @classmethod
+    def _get_section_template(cls, labels, state=None):
+        # Templates store resolved mod names, so they are compiled per glia state.
+        if state is None:
+            state = resolution.state()
+        templates = cls._arbz_section_templates
+        key = (tuple(labels), state)
+        try:
+            return templates[key]
+        except KeyError:
+            if templates and next(iter(templates))[1][0] != state[0]:
+                # Glia reloaded or the resolutions were invalidated.
+                templates.clear()
+            template = _SectionTemplate(cls, key[0])
+            templates[key] = template
+            return template
 
     def boot(self):
         pass
@@ -321,7 +672,6 @@ class NeuronModel:
         '''
 
         synapse = self.create_synapse(to_section, synapse_type=synapse_type)
-        to_section._synapses.append(synapse)
         from_section.connect_points(synapse._point_process)
         return synapse
 
@@ -341,15 +691,17 @@ class NeuronModel:
             :param section: The section to insert the transmitter on. Each section can only have 1 transmitter
             :param gid: The global identifier of this transmitter. With this number receivers can subscribe to this transmitter's SpikeEvents
         """
-        if not hasattr(section, "_transmitter"):
-            section._transmitter = {
-                "gid": gid,
-                "connector": p.ParallelCon(section, gid, output=True),
-            }
-        if source_var is not None and "source" not in section._transmitter:
+        table = self._get_table("_transmitter_table", TRANSMITTER_COLUMNS)
+        rows = np.flatnonzero(table["section"] == section._cell_index)
+        if len(rows):
+            row = int(rows[0])
+        else:
+            connector = p.ParallelCon(section, gid, output=True).__neuron__()
+            row = table.append(section._cell_index, gid, connector, None)
+        if source_var is not None and table.get("source", row) is None:
             p.parallel.source_var(section(0.5)._ref_v, gid, sec=section.__neuron__())
-            section._transmitter["source"] = section(0.5)._ref_v
-        return section._transmitter
+            table.set("source", row, section(0.5)._ref_v)
+        return Transmitter(self, row)
 
     def create_receiver(self, section, gid, synapse_type):
         """
@@ -362,22 +714,19 @@ class NeuronModel:
             :param gid: The global identifier of this transmitter. With this number receivers can subscribe to this transmitter's SpikeEvents
             :param synapse_type: Name of the synapse. It needs to be a valid name defined on the section.
         """
-        if not hasattr(section, "_receivers"):
-            section._receivers = []
         synapse = self.create_synapse(section, synapse_type)
-        receiver_dict = {
-            "type": synapse_type,
-            "synapse": synapse,
-            "gid": gid
-        }
+        # `create_synapse` appended the synapse as the last row of the synapse table.
+        synapse_row = len(self._synapse_table) - 1
         if synapse.source is not None:
             p.parallel.target_var(getattr(synapse._point_process, "_ref_" + synapse.source), gid)
-            receiver_dict["source"] = synapse.source
+            parallel_con = None
         else:
-            parallel_con = p.ParallelCon(gid, synapse._point_process)
-            receiver_dict["receiver"] = parallel_con
-        section._receivers.append(receiver_dict)
-        return receiver_dict
+            # Store the bare NetCon, it's wrapped on access through the receiver.
+            parallel_con = p.parallel.gid_connect(gid, synapse.__neuron__())
+            parallel_con.threshold = -20.0
+        table = self._get_table("_receiver_table", RECEIVER_COLUMNS)
+        row = table.append(section._cell_index, self._synapse_type_id(synapse._type), gid, synapse_row, parallel_con)
+        return Receiver(self, row)
 
     def create_synapse(self, section, synapse_type=None):
         '''
@@ -390,6 +739,45 @@ class NeuronModel:
             :param synapse_type: The name of the synapse type.
             :type synapse_type: string
         '''
+        synapse_type, synapse_definition = self._get_synapse_definition(section, synapse_type)
+        synapse_point_process, synapse_variant, synapse_attributes, source = _unpack_synapse_definition(synapse_definition)
+        synapse = Synapse(self, section, synapse_point_process, synapse_attributes, variant=synapse_variant, type=synapse_type, source=source)
+        self._add_synapse(section, synapse)
+        return synapse
+
+    def _add_synapse(self, section, synapse):
+        # The synapse table of the cell is the only store of its synapses, and keeps
+        # them alive. `section.synapses` is a view on it.
+        table = self._get_table("_synapse_table", SYNAPSE_COLUMNS)
+        return table.append(section._cell_index, self._synapse_type_id(synapse._type), synapse)
+
+    def _get_table(self, name, columns):
+        # Tables are only created for cells that get synapses, receivers or transmitters.
+        table = self.__dict__.get(name)
+        if table is None:
+            table = self.__dict__[name] = Table(columns)
+        return table
+
+    @classmethod
+    def _synapse_type_id(cls, synapse_type):
+        # Intern the synapse type names of the class as small integers.
+        ids = cls._arbz_synapse_type_ids
+        id = ids.get(synapse_type)
+        if id is None:
+            id = ids[synapse_type] = len(cls._arbz_synapse_type_names)
+            cls._arbz_synapse_type_names.append(synapse_type)
+        return id
+
+    @classmethod
+    def _synapse_type_ids(cls, types):
+        # Return the ids of the given synapse type names, or None to select all types.
+        if types is None:
+            return None
+        ids = cls._arbz_synapse_type_ids
+        return [ids[t] for t in _as_list(types) if t in ids]
+
+    def _get_synapse_definition(self, section, synapse_type=None):
+        # Validate the synapse type for the section and return it with its definition
         labels = section.labels
         labels_name = ",".join(labels)
         if not hasattr(self.__class__, "synapse_types"):
@@ -412,24 +800,440 @@ class NeuronModel:
                 raise SynapseNotDefinedError("The synapse type '{}' is used on '{}' labelled section but not defined in the model.".format(synapse_type, labels_name))
             else:
                 synapse_definition = synapse_types[synapse_type]
-
-        synapse_attributes = synapse_definition["attributes"] if "attributes" in synapse_definition else {}
-        synapse_point_process = synapse_definition["point_process"]
-        synapse_variant = None
-        if isinstance(synapse_point_process, tuple):
-            synapse_variant = synapse_point_process[1]
-            synapse_point_process = synapse_point_process[0]
-        source = synapse_definition.get("source", None)
-        synapse = Synapse(self, section, synapse_point_process, synapse_attributes, variant=synapse_variant, type=synapse_type, source=source)
-        if not hasattr(section, "_synapses"):
-            section._synapses = []
-        section._synapses.append(synapse)
-        return synapse
+        return synapse_type, synapse_definition
 
     @classmethod
     def make_builder(cls, morphology, path=None):
         return make_builder(morphology, path=path or cls.morphology_directory)
 
+class LabelSet:
+    """
+        Ordered set of the labels of a section. Changes are reported to the cell that
+        owns the section, which keeps an index of the sections of each label.
+    """
+    def __init__(self, labels=()):
+        self._labels = dict.fromkeys(labels)
+        self._cell = None
+        self._section = None
+
+    def _bind(self, cell, section):
+        self._cell = cell
+        self._section = section
+
+    def __contains__(self, label):
+        return label in self._labels
+
+    def __iter__(self):
+        return iter(self._labels)
+
+    def __len__(self):
+        return len(self._labels)
+
+    def __getitem__(self, index):
+        return list(self._labels)[index]
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+    def __repr__(self):
+        return "LabelSet({})".format(list(self._labels))
+
+    def add(self, label):
+        """
+            Add a label at the end, if it isn't present yet.
+        """
+        if label not in self._labels:
+            self._labels[label] = None
+            self._changed(label, True)
+
+    append = add
+
+    def insert(self, index, label):
+        """
+            Add a label at the given position, if it isn't present yet.
+        """
+        if label not in self._labels:
+            labels = list(self._labels)
+            labels.insert(index, label)
+            self._labels = dict.fromkeys(labels)
+            self._changed(label, True)
+
+    def remove(self, label):
+        """
+            Remove a label. Raises a KeyError if it isn't present.
+        """
+        del self._labels[label]
+        self._changed(label, False)
+
+    def discard(self, label):
+        """
+            Remove a label, if it is present.
+        """
+        if label in self._labels:
+            self.remove(label)
+
+    def _changed(self, label, added):
+        if self._cell is not None:
+            self._cell._label_changed(self._section, label, added)
+
+
+class _SectionTemplate:
+    """
+        Mechanism insertions, attribute assignments and synapse types that the
+        ``section_types`` of a model class prescribe for a combination of labels.
+        Templates are compiled once per class and label combination, so that building
+        a cell only replays the resolved operations onto its sections. The operations
+        are kept per label and replayed in label order: the mechanisms of a label are
+        inserted and then its attributes are set, before the next label is applied.
+    """
+    def __init__(self, model_class, labels):
+        self.labels = labels
+        self.mechanisms = []
+        # Asset name of each mechanism
+        self.mechanism_names = []
+        # Mechanisms to insert and attributes to set for each label, in label order
+        self.steps = []
+        self.synapses = None
+        # Store a map of mechanisms to full mod_names for the attribute names
+        resolved = {}
+        for label in labels:
+            if label not in model_class.section_types:
+                raise LabelNotDefinedError("Label '{}' given to a section but not defined in {}".format(
+                    label,
+                    model_class.__name__
+                ))
+            definition = model_class.section_types[label]
+            mechanisms = []
+            attributes = []
+            if "mechanisms" in definition:
+                mechanisms = self._compile_mechanisms(definition["mechanisms"], resolved)
+            if "attributes" in definition:
+                try:
+                    attributes = self._compile_attributes(definition["attributes"], resolved)
+                except SectionAttributeError as e:
+                    errr.wrap(SectionAttributeError, e, prepend="No mechanisms were inserted! ")
+            if mechanisms or attributes:
+                self.steps.append((mechanisms, attributes))
+            if "synapses" in definition:
+                if self.synapses is None:
+                    self.synapses = ()
+                self.synapses += tuple(definition["synapses"])
+
+    def _compile_mechanisms(self, mechanisms, resolved):
+        inserted = []
+        for mechanism in mechanisms:
+            try:
+                # Use Glia to resolve the mechanism selection.
+                if isinstance(mechanism, tuple):
+                    # Mechanism defined as: `(mech_name, mech_variant [, package])`
+                    name = mechanism[0]
+                    variant = mechanism[1]
+                    select = {"variant": variant}
+                    if len(mechanism) == 3:
+                        select["pkg"] = mechanism[2]
+                    mod_name = resolve(name, **select)
+                else:
+                    # Mechanism defined as string
+                    name = mechanism
+                    variant = "0"
+                    mod_name = resolve(mechanism)
+            except glia.exceptions.NoMatchesError as e:
+                e = MechanismNotFoundError("Could not find '{}.{}' in the glia library".format(name, variant), name, variant)
+                raise e from None
+            # Map the mechanism to the mod name
+            resolved[mechanism] = mod_name
+            if mod_name not in self.mechanisms:
+                self.mechanisms.append(mod_name)
+                self.mechanism_names.append(name)
+                inserted.append(mod_name)
+        return inserted
+
+    def _compile_attributes(self, attributes, resolved):
+        compiled = []
+        for attribute, value in attributes.items():
+            if isinstance(attribute, tuple):
+                # `attribute` is an attribute of a specific mechanism and defined
+                # as `(attribute, mechanism)`. This makes use of the fact that
+                # NEURON provides shorthands to a mechanism's attribute as
+                # `attribute_mechanism` instead of having to iterate over all
+                # the segments and setting `mechanism.attribute` for each
+                mechanism = attribute[1]
+                # Check if we can unambiguously find a match for the specified mech
+                mod = _try_mech_presence(mechanism, resolved)
+                if not mod:
+                    raise MechanismNotPresentError("The attribute " + repr(attribute) + " specifies a mechanism '{}' that was not inserted in this section.".format(mechanism), mechanism) from None
+                attribute_name = attribute[0] + "_" + mod
+            else:
+                # `attribute` is an attribute of the section and is defined as string
+                attribute_name = attribute
+            compiled.append((attribute, attribute_name, value))
+        return compiled
+
+    def apply(self, section, segment_parameters=None):
+        """
+            Insert the mechanisms, set the attributes and make the synapse types
+            available on the given section. Attributes with a
+            :class:`~arborize.geometry.SegmentParameter` value are appended to
+            ``segment_parameters`` instead, to be set for all sections of the cell at once.
+        """
+        timer = profiling.cell
+        if timer:
+            timer.lap("templates")
+        for mechanisms, attributes in self.steps:
+            self._insert([section], mechanisms)
+            if timer:
+                timer.lap("mechanisms")
+            self._set_attributes([section], attributes, segment_parameters)
+            if timer:
+                timer.lap("attributes")
+        self.apply_synapse_types(section)
+
+    def apply_many(self, sections, segment_parameters):
+        """
+            Insert the mechanisms and set the attributes of many sections, one mechanism
+            and one attribute at a time, in the same label order as :meth:`apply`.
+        """
+        for mechanisms, attributes in self.steps:
+            self._insert(sections, mechanisms)
+            self._set_attributes(sections, attributes, segment_parameters)
+
+    def _insert(self, sections, mechanisms):
+        profiling.count("insert", len(mechanisms) * len(sections))
+        for mod_name in mechanisms:
+            for section in sections:
+                # Use Glia to insert the resolved mod.
+                g.insert(section, mod_name)
+
+    def _set_attributes(self, sections, attributes, segment_parameters):
+        for attribute, attribute_name, value in attributes:
+            if isinstance(value, SegmentParameter):
+                if segment_parameters is None:
+                    raise SectionAttributeError("Segment parameter '{}' can only be set while building a cell.".format(attribute_name), attribute, sections[0].labels)
+                segment_parameters.extend((section, attribute, attribute_name, value) for section in sections)
+                continue
+            profiling.count("setattr", len(sections))
+            for section in sections:
+                # Check whether the value is callable, if so, pass it the section diameter
+                # and update the local variable to the return value. This allows parameters to
+                # depend on the diameter of the section.
+                v = value(section.diam) if callable(value) else value
+                # Use setattr to set the obtained attribute information. __dict__
+                # does not work as NEURON's Python interface is incomplete.
+                try:
+                    setattr(section.__neuron__(), attribute_name, v)
+                except AttributeError as e:
+                    mechanism_notice = ""
+                    if isinstance(attribute, tuple):
+                        mechanism_notice = " specified for '{}'".format(attribute[1])
+                    e = SectionAttributeError("The attribute '{}'{} is not found on a section with labels {}.".format(
+                        attribute_name,
+                        mechanism_notice,
+                        ", ".join("'{}'".format(l) for l in section.labels)
+                    ), attribute, section.labels)
+                    errr.wrap(SectionAttributeError, e, prepend="No mechanisms were inserted! ")
+
+    def attribute_value(self, attribute_name, diam, default):
+        """
+            Return the value that the template sets for a section attribute on sections
+            with diameter ``diam``, or ``default`` if it isn't set.
+        """
+        value = default
+        for _, attributes in self.steps:
+            for _, name, v in attributes:
+                if name == attribute_name and not isinstance(v, SegmentParameter):
+                    value = v(diam) if callable(v) else v
+        return value
+
+    def apply_synapse_types(self, section):
+        """
+            Make the synapse types of this template available on the given section.
+        """
+        if self.synapses is not None:
+            # Sections with the same labels share the synapse types of their template.
+            existing = getattr(section, "available_synapse_types", None)
+            section.available_synapse_types = tuple(existing) + self.synapses if existing else self.synapses
+
+
+class _Prototype:
+    """
+        Geometry, labels and ``nseg`` of the first cell of a model class and morphology,
+        from which the sections of later cells are created in bulk.
+    """
+    def __init__(self, cell, translated):
+        morphology = Morphology.from_sections(cell.sections, _section_types(cell))
+        self.translated = translated
+        if translated:
+            # Store the geometry relative to the cell's position.
+            morphology = morphology.transform(translation=-cell.position)
+        self.morphology = morphology
+        self.labels = [tuple(section.labels) for section in cell.sections]
+        # With a discretization policy the nseg is set after the attributes instead.
+        self.nseg = [section.nseg for section in cell.sections] if cell.__class__.discretization is None else None
+
+    def instantiate(self, cell):
+        morphology = self.morphology
+        if self.translated:
+            morphology = morphology.transform(translation=cell.position)
+        morphology.instantiate(cell)
+        cell._wrap_sections()
+        cell._collect_sections()
+        for section, labels in zip(cell.sections, self.labels):
+            section.labels = LabelSet(labels)
+        cell._index_labels()
+
+
+def _translation(builder):
+    # Whether a builder ends by translating the morphology to the position of the model,
+    # or None if a translation is followed by other builders.
+    parts = getattr(builder, "builder_pipe", None)
+    if parts is None:
+        return getattr(builder, "translate", False) is True
+    translated = [_translation(part) for part in parts]
+    if None in translated or any(translated[:-1]):
+        return None
+    return bool(translated) and translated[-1]
+
+
+# Model classes with deferred cells, and the handler that materializes them at the start
+# of finitialize.
+_deferred_models = set()
+_materialize_handler = None
+
+
+def _defer(cell):
+    global _materialize_handler
+    model = cell.__class__
+    model._arbz_deferred.append(weakref.ref(cell))
+    _deferred_models.add(model)
+    if _materialize_handler is None:
+        # Type 3 handlers run first in finitialize, when the model may still change.
+        _materialize_handler = p.FInitializeHandler(3, materialize)
+
+
+def materialize():
+    """
+        Materialize the deferred cells of all model classes, see
+        :meth:`.NeuronModel.materialize`.
+    """
+    for model in list(_deferred_models):
+        model.materialize()
+
+
+def _unpack_synapse_definition(synapse_definition):
+    # Return the point process, variant, attributes and source of a synapse definition
+    synapse_attributes = synapse_definition["attributes"] if "attributes" in synapse_definition else {}
+    synapse_point_process = synapse_definition["point_process"]
+    synapse_variant = None
+    if isinstance(synapse_point_process, tuple):
+        synapse_variant = synapse_point_process[1]
+        synapse_point_process = synapse_point_process[0]
+    source = synapse_definition.get("source", None)
+    return synapse_point_process, synapse_variant, synapse_attributes, source
+
+
+def _has_sections(model):
+    return any(getattr(model, name, None) for name in ("soma", "dend", "dendrites", "axon", "apic"))
+
+
+# Axial resistivity (Ωcm) and membrane capacitance (µF/cm²) of new NEURON sections.
+_DEFAULT_RA = 35.4
+_DEFAULT_CM = 1.0
+# Lists of the model that the ``from`` of label definitions can refer to, and the
+# section type of their sections.
+_CATEGORIES = {"soma": 0, "dendrites": 1, "axon": 2, "apic": 3}
+
+
+def _morphology_labels(morphology, model):
+    # The labels that `NeuronModel._apply_labels` gives the sections of the morphology,
+    # evaluated on its arrays.
+    types = np.asarray(morphology.types)
+    names = {v: k for k, v in _CATEGORIES.items()}
+    labels = [[names[t]] for t in types.tolist()]
+    properties = None
+    for label, category in (getattr(model, "labels", None) or {}).items():
+        if category["from"] not in _CATEGORIES:
+            continue
+        targets = np.flatnonzero(types == _CATEGORIES[category["from"]])
+        if "id" in category:
+            selected = [t for id, t in enumerate(targets) if category["id"](id)]
+        else:
+            if properties is None:
+                properties = SectionProperties.from_morphology(morphology)
+            if "diam" in category:
+                selected = [t for t in targets if category["diam"](properties.diam[t])]
+            elif "where" in category:
+                mask = np.asarray(category["where"](properties.subset(targets)), dtype=bool)
+                selected = targets[mask]
+            else:
+                continue
+        for t in selected:
+            labels[t].append(label)
+    return [tuple(l) for l in labels]
+
+
+def _morphology_nseg(model, L, diam, labels):
+    # The nseg that cells of the model class give sections with the given lengths,
+    # diameters and labels: the default rule, or the `discretization` policy evaluated
+    # with the Ra and cm that the section templates set.
+    L = np.asarray(L, dtype=float)
+    policy = getattr(model, "discretization", None)
+    if policy is None:
+        return 1 + 2 * (L // 40).astype(int)
+    state = resolution.state()
+    templates = [model._get_section_template(l, state) for l in labels]
+    return discretize(
+        L,
+        diam,
+        [t.attribute_value("Ra", d, _DEFAULT_RA) for t, d in zip(templates, diam)],
+        [t.attribute_value("cm", d, _DEFAULT_CM) for t, d in zip(templates, diam)],
+        **policy
+    )
+
+
+def _section_types(cell):
+    # Index into `SECTION_TYPES` of each of the cell's sections.
+    return (
+        [0] * len(cell.soma) + [1] * len(cell.dendrites) + [2] * len(cell.axon)
+        + [3] * len(cell.apic)
+    )
+
+
+def _fold_pipeline(builders, model):
+    # Return the array morphology produced by an array morphology followed by only
+    # transformations, or None if a builder has to act on created sections.
+    if not builders or _has_sections(model) or not hasattr(builders[0], "get_morphology"):
+        return None
+    morphology = builders[0].get_morphology(model)
+    for builder in builders[1:]:
+        if morphology is None or not hasattr(builder, "transform_morphology"):
+            return None
+        morphology = builder.transform_morphology(morphology, model)
+    return morphology
+
+
+def _run_pipeline(builders, model, *args, **kwargs):
+    # Apply all builders in the pipeline sequence in order. Transformations that follow
+    # an array morphology on an empty model are applied to the arrays, before any
+    # sections are created.
+    morphology = None
+    for builder in builders:
+        if morphology is not None:
+            if hasattr(builder, "transform_morphology"):
+                morphology = builder.transform_morphology(morphology, model)
+                continue
+            morphology.instantiate(model, *args, **kwargs)
+            morphology = None
+        if hasattr(builder, "get_morphology") and not _has_sections(model):
+            morphology = builder.get_morphology(model)
+        if morphology is None:
+            builder.instantiate(model, *args, **kwargs)
+    if morphology is not None:
+        morphology.instantiate(model, *args, **kwargs)
+
+
 def _try_mech_presence(mech, resolved):
     # Look for a full match, this also covers the
     if mech in resolved:
@@ -442,21 +1246,24 @@ def _try_mech_presence(mech, resolved):
         raise SectionAttributeError(f"Section attributes were specified for `{mech}` but this could apply to: " + ", ".join(specifics))
 
 
-def get_section_receivers(section, types=None):
+def get_section_receivers(section, types=None, gids=None):
     """
-        Collect a dictionary of the section's receiver descriptions matching the given
-        types.
+        Collect the section's receivers matching the given types. Receivers are stored
+        in a table per cell and returned as read-only :class:`~arborize.tables.Receiver`
+        mappings.
 
         :param section: Section to inspect.
         :type section: :class:`Section <patch.objects.Section>`
-        :param types: List of names of the synapse types to look for. Collects all types if omitted.
-        :type types: list
+        :param types: Names of the synapse types to look for. Collects all types if omitted.
+        :type types: str or list
+        :param gids: GIDs to look for. Collects all GIDs if omitted.
+        :type gids: int or array-like of int
     """
-    if not hasattr(section, "_receivers"):
-        return {}
-    if types is None:
-        return section._receivers
-    return [v for v in section._receivers if v["type"] in types]
+    cell, table = _section_table(section, "_receiver_table")
+    if table is None:
+        return []
+    rows = table.select(section=section._cell_index, type=cell._synapse_type_ids(types), gid=gids)
+    return [Receiver(cell, row) for row in rows.tolist()]
 
 def get_section_synapses(section, types=None):
     """
@@ -465,47 +1272,99 @@ def get_section_synapses(section, types=None):
         :param section: Section to inspect.
         :type section: :class:`Section <patch.objects.Section>`
         :param types: Synapse types to look for.
-        :type types: str
+        :type types: str or list
     """
-    if not hasattr(section, "_synapses"):
+    cell, table = _section_table(section, "_synapse_table")
+    if table is None:
         return []
-    if types is None:
-        return section._synapses
-    return [v for v in section._synapses if v._type in types]
-
-@contextmanager
-def _suppress_stdout():
-    with open(os.devnull, "w") as devnull:
-        old_stdout = sys.stdout
-        sys.stdout = devnull
-        try:
-            yield
-        finally:
-            sys.stdout = old_stdout
+    rows = table.select(section=section._cell_index, type=cell._synapse_type_ids(types))
+    synapses = table["synapse"]
+    return [synapses[row] for row in rows.tolist()]
 
 
-def _import3d_load(morphology):
-    if not os.path.isfile(morphology):
-        raise FileNotFoundError(f"'{morphology}' can't be found. Provide a correct absolute path in the `morphologies` array or add a `morphology_directory` class attribute to your NeuronModel.")
-    loader = p.Import3d_Neurolucida3()
-    with _suppress_stdout():
-        loader.input(morphology)
-    loaded_morphology = p.Import3d_GUI(loader, 0)
-    return loaded_morphology
-    raise FileNotFoundError("Can't find '{}', use arborize.add_directory to add a morphology directory.".format(morphology))
+def get_synapses(cells, types=None, labels=None):
+    """
+        Collect the synapses of the given types on the sections with any of the given
+        labels, of all the given cells.
+
+        :param cells: Cells to inspect.
+        :type cells: iterable of :class:`.NeuronModel`
+        :param types: Synapse types to look for. Collects all types if omitted.
+        :type types: str or list
+        :param labels: Section labels to look for. Collects from all sections if omitted.
+        :type labels: str or list
+    """
+    synapses = []
+    for cell, table, rows in _select_rows(cells, "_synapse_table", types, labels):
+        column = table["synapse"]
+        synapses.extend(column[row] for row in rows)
+    return synapses
+
+
+def get_receivers(cells, types=None, labels=None, gids=None):
+    """
+        Collect the receivers of the given types and GIDs on the sections with any of
+        the given labels, of all the given cells.
+
+        :param cells: Cells to inspect.
+        :type cells: iterable of :class:`.NeuronModel`
+        :param types: Synapse types to look for. Collects all types if omitted.
+        :type types: str or list
+        :param labels: Section labels to look for. Collects from all sections if omitted.
+        :type labels: str or list
+        :param gids: GIDs to look for. Collects all GIDs if omitted.
+        :type gids: int or array-like of int
+        :returns: Read-only :class:`~arborize.tables.Receiver` mappings.
+    """
+    receivers = []
+    for cell, table, rows in _select_rows(cells, "_receiver_table", types, labels, gids):
+        receivers.extend(Receiver(cell, row) for row in rows)
+    return receivers
+
+
+def _select_rows(cells, name, types, labels, gids=None):
+    # Yield each cell that has the given table, with its rows that match the criteria.
+    labels = _as_list(labels)
+    for cell in cells:
+        table = cell.__dict__.get(name)
+        if not table:
+            continue
+        sections = None
+        if labels is not None:
+            index = cell._label_index
+            sections = [i for label in labels for i in index.get(label, ())]
+        rows = table.select(type=cell._synapse_type_ids(types), section=sections, gid=gids)
+        yield cell, table, rows.tolist()
+
+
+def _as_list(values):
+    # A single name selects that name, not each of its characters.
+    if values is None or isinstance(values, list):
+        return values
+    if isinstance(values, str):
+        return [values]
+    return list(values)
+
+
+def _section_table(section, name):
+    # Return the cell of an arborize section and one of its tables, if it has it.
+    if "_cell_index" not in section.__dict__:
+        return None, None
+    cell = section.cell
+    return cell, cell.__dict__.get(name)
 
 def import3d(file, model):
     """
         Perform NEURON's Import3D and import ``file`` 3D data into the model.
     """
-    loaded_morphology = NeuronModel._import3d_load(file)
+    loaded_morphology = _import3d_load(file)
     loaded_morphology.instantiate(model)
 
 
 def make_builder(blueprint, path=None):
     """
-        Turn a blueprint (morphology string, builder function or tuple of the former)
-        into a Builder.
+        Turn a blueprint (morphology string, builder function, Builder or tuple of the
+        former) into a Builder.
     """
     if type(blueprint) is str:
         if not os.path.isabs(blueprint):
@@ -513,8 +1372,11 @@ def make_builder(blueprint, path=None):
                 raise MorphologyBuilderError("Morphology filestrings have to be absolute paths or a `path` keyword argument must be provided.")
             else:
                 blueprint = os.path.join(path, blueprint)
-        # Use Import3D as builder
-        return _import3d_load(blueprint)
+        # Use the Import3D parsed and cached array morphology as builder
+        return load_morphology(blueprint)
+    if hasattr(blueprint, "instantiate"):
+        # Builder objects can be used as is.
+        return blueprint
     if callable(blueprint):
         # If a function is given as morphology, treat it as a builder function
         return Builder(blueprint)
@@ -527,4 +1389,46 @@ def make_builder(blueprint, path=None):
     else:
         raise MorphologyBuilderError("Invalid blueprint data: provide a builder function or a path string to a morphology file.")
 
-__all__ = ["NeuronModel", "get_section_synapses", "get_section_receivers"]
+class _LazyBuilders:
+    # Builders of the morphologies of a model, made on first use. The first use starts
+    # preprocessing all morphology files in the background.
+    def __init__(self, model, path):
+        self._model = model
+        self._path = path
+        self._builders = [None] * len(model.morphologies)
+        self._started = False
+
+    def __len__(self):
+        return len(self._builders)
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, index):
+        builder = self._builders[index]
+        if builder is None:
+            if not self._started:
+                self._started = True
+                for blueprint in self._model.morphologies:
+                    preprocess_morphologies(_blueprint_files(blueprint, self._path), wait=False)
+            blueprint = self._model.morphologies[index]
+            # Waits for the files of this morphology, and raises the error of files that
+            # failed to load. Failed files are submitted again on the next attempt.
+            preprocess_morphologies(_blueprint_files(blueprint, self._path))
+            builder = self._builders[index] = self._model.make_builder(blueprint, path=self._path)
+        return builder
+
+
+def _blueprint_files(blueprint, path):
+    # Absolute paths of the morphology files that a blueprint loads with Import3D.
+    if type(blueprint) is str:
+        return [blueprint if os.path.isabs(blueprint) or path is None else os.path.join(path, blueprint)]
+    if not hasattr(blueprint, "instantiate") and not callable(blueprint) and hasattr(type(blueprint), "__iter__"):
+        return [file for part in blueprint for file in _blueprint_files(part, path)]
+    return []
+
+
+__all__ = [
+    "NeuronModel", "LabelSet", "get_section_synapses", "get_section_receivers",
+    "get_synapses", "get_receivers", "materialize",
+]
@@ -14,7 +14,9 @@ _make_tree(globals(),
                 LabelNotDefinedError=_e(),
                 SectionAttributeError=_e(),
             ),
-            MorphologyBuilderError=_e(),
+            MorphologyBuilderError=_e(
+                MorphologyValidationError=_e("report"),
+            ),
         ),
     ),
 )
@@ -0,0 +1,216 @@
+import os
+import numpy as np
+
+if not os.getenv('READTHEDOCS'):
+    from patch import p
+
+
+class SectionProperties:
+    """
+        Geometric properties of a list of sections, as arrays with one element per
+        section:
+
+        * ``ids``: Index of the section in the list.
+        * ``diam``: Diameter.
+        * ``L``: Length.
+        * ``distance``: Path distance from the middle of the soma to the middle of the
+          section.
+        * ``branch_order``: 0 for the soma, 1 for sections attached to the soma, and
+          increasing by 1 for every next section towards the tips.
+    """
+    def __init__(self, diam, L, distance, branch_order):
+        self.ids = np.arange(len(diam))
+        self.diam = diam
+        self.L = L
+        self.distance = distance
+        self.branch_order = branch_order
+
+    def __len__(self):
+        return len(self.ids)
+
+    def subset(self, indices):
+        """
+            Return the properties of the sections at the given indices, renumbering
+            their ``ids``.
+        """
+        return SectionProperties(
+            self.diam[indices], self.L[indices], self.distance[indices], self.branch_order[indices]
+        )
+
+    @classmethod
+    def from_sections(cls, sections, root=None):
+        """
+            Read the properties of a list of sections.
+
+            :param sections: Sections to read.
+            :param root: Section to measure path distances and branch orders from.
+              Defaults to the first section.
+        """
+        nrn_sections = [s.__neuron__() for s in sections]
+        n = len(nrn_sections)
+        if root is None and n:
+            root = sections[0]
+        diam = np.fromiter((s.diam for s in nrn_sections), dtype=float, count=n)
+        L = np.fromiter((s.L for s in nrn_sections), dtype=float, count=n)
+        distance = np.zeros(n)
+        branch_order = np.zeros(n, dtype=int)
+        if n:
+            origin = root.__neuron__()(0.5)
+            distance[:] = [p.distance(origin, s(0.5)) for s in nrn_sections]
+            index = {s: i for i, s in enumerate(nrn_sections)}
+            root = root.__neuron__()
+            # Sections are visited parents first, so the order of the parent is known.
+            for s in root.wholetree():
+                if s in index and s != root:
+                    parent = s.parentseg()
+                    parent_order = branch_order[index[parent.sec]] if parent.sec in index else 0
+                    branch_order[index[s]] = parent_order + 1
+        return cls(diam, L, distance, branch_order)
+
+    @classmethod
+    def from_morphology(cls, morphology):
+        """
+            Compute the properties of the sections of a
+            :class:`~arborize.morphology.Morphology` from its arrays, without creating
+            sections. The diameter of a section is the length weighted mean of its
+            diameters, and distances are measured from the middle of the first section.
+        """
+        n = len(morphology)
+        points = np.asarray(morphology.points, dtype=float)
+        diameters = np.asarray(morphology.diameters, dtype=float)
+        counts = np.diff(morphology.offsets)
+        parents = np.asarray(morphology.parents)
+        section_of = np.repeat(np.arange(n), counts)
+        same = section_of[1:] == section_of[:-1]
+        lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)[same]
+        owner = section_of[1:][same]
+        L = np.bincount(owner, weights=lengths, minlength=n)
+        mean = (diameters[1:][same] + diameters[:-1][same]) / 2
+        diam = np.bincount(owner, weights=lengths * mean, minlength=n)
+        # Sections without length get the mean of their diameters.
+        point_diam = np.bincount(section_of, weights=diameters, minlength=n) / np.maximum(counts, 1)
+        diam = np.where(L > 0, diam / np.where(L > 0, L, 1), point_diam)
+        # Distance from the 0 end of each section to the middle of the first section,
+        # and the number of sections to it, summed up the tree by pointer jumping.
+        has_parent = parents >= 0
+        parent = np.where(has_parent, parents, 0)
+        x = np.asarray(morphology.parent_x, dtype=float)
+        step = np.where(parent == 0, np.abs(x - 0.5), x) * L[parent]
+        step = np.where(has_parent, step, 0.0)
+        order = has_parent.astype(int)
+        up = np.where(has_parent, parents, np.arange(n))
+        for _ in range(max(n, 1).bit_length()):
+            step = step + np.where(up != np.arange(n), step[up], 0)
+            order = order + np.where(up != np.arange(n), order[up], 0)
+            up = up[up]
+        distance = np.where(np.arange(n) == 0, 0.0, step + L / 2)
+        return cls(diam, L, distance, order)
+
+
+class SegmentProperties:
+    """
+        Properties of the segments of a list of sections, as arrays with one element per
+        segment:
+
+        * ``section``: Index of the segment's section in the list.
+        * ``x``: Position of the segment along its section, between 0 and 1.
+        * ``diam``: Diameter.
+        * ``distance``: Path distance from the middle of the soma.
+    """
+    def __init__(self, section, x, diam, distance):
+        self.section = section
+        self.x = x
+        self.diam = diam
+        self.distance = distance
+
+    def __len__(self):
+        return len(self.section)
+
+    def subset(self, mask):
+        """
+            Return the properties of the segments selected by a mask or index array.
+        """
+        return SegmentProperties(self.section[mask], self.x[mask], self.diam[mask], self.distance[mask])
+
+    @classmethod
+    def from_sections(cls, sections, root=None):
+        """
+            Read the properties of the segments of a list of sections.
+
+            :param sections: Sections to read.
+            :param root: Section to measure path distances from. Defaults to the first
+              section.
+        """
+        nrn_sections = [s.__neuron__() for s in sections]
+        if root is None and sections:
+            root = sections[0]
+        section, x, diam, distance = [], [], [], []
+        if sections:
+            origin = root.__neuron__()(0.5)
+            for i, s in enumerate(nrn_sections):
+                for seg in s:
+                    section.append(i)
+                    x.append(seg.x)
+                    diam.append(seg.diam)
+                    distance.append(p.distance(origin, seg))
+        return cls(
+            np.array(section, dtype=int), np.array(x, dtype=float),
+            np.array(diam, dtype=float), np.array(distance, dtype=float),
+        )
+
+
+class SegmentParameter:
+    """
+        Value of a section attribute that varies per segment. The function receives the
+        :class:`.SegmentProperties` of all segments of all sections the attribute
+        applies to, and returns an array with a value for each segment, or a scalar:
+
+        .. code-block:: python
+
+            section_types = {
+                "dendrites": {
+                    "mechanisms": ["Kv1_1"],
+                    "attributes": {
+                        ("gbar", "Kv1_1"): SegmentParameter(
+                            lambda seg: 0.01 * np.exp(-seg.distance / 100)
+                        ),
+                    },
+                },
+            }
+
+        Segment parameters are set after all section wide attributes of the cell, with a
+        single section wide assignment on sections where the value is uniform.
+    """
+    def __init__(self, function):
+        self.function = function
+
+    def evaluate(self, properties):
+        return np.broadcast_to(self.function(properties), (len(properties),))
+
+
+def discretize(L, diam, Ra, cm, length=40, d_lambda=None, frequency=100, max_nseg=None):
+    """
+        Return the odd number of segments for each section, either with a fixed maximum
+        segment ``length``, or with the d_lambda rule: segments no longer than a
+        fraction ``d_lambda`` of the AC length constant at ``frequency``.
+
+        :param L: Section lengths (µm).
+        :param diam: Section diameters (µm).
+        :param Ra: Axial resistivities (Ωcm).
+        :param cm: Specific membrane capacitances (µF/cm²).
+        :param length: Maximum segment length (µm), if ``d_lambda`` is not given.
+        :param d_lambda: Maximum segment length as a fraction of the length constant.
+        :param frequency: Frequency (Hz) of the length constant.
+        :param max_nseg: Maximum number of segments per section.
+        :rtype: :class:`numpy.ndarray` of int
+    """
+    L = np.asarray(L, dtype=float)
+    if d_lambda is None:
+        nseg = 1 + 2 * (L // length).astype(int)
+    else:
+        lambda_f = 1e5 * np.sqrt(np.asarray(diam) / (4 * np.pi * frequency * np.asarray(Ra) * np.asarray(cm)))
+        nseg = ((L / (d_lambda * lambda_f) + 0.9) / 2).astype(int) * 2 + 1
+    if max_nseg is not None:
+        # Round the cap down to an odd number, so that there's a node in the middle.
+        nseg = np.minimum(nseg, max_nseg - (1 - max_nseg % 2))
+    return nseg
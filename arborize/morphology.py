@@ -0,0 +1,389 @@
+import os, sys, hashlib, functools, shutil, tempfile, atexit
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+
+if not os.getenv('READTHEDOCS'):
+    from patch import p
+
+#: Categories that the sections of a morphology are divided into, in the order that
+#: the ``types`` array of a :class:`.Morphology` refers to them. They are named after
+#: the section lists that Import3D creates; ``apic`` holds the apical dendrites.
+SECTION_TYPES = ("soma", "dend", "axon", "apic")
+# Bump this when the layout of the cached arrays changes, invalidating old caches.
+_CACHE_VERSION = "2"
+_ARRAYS = ("points", "diameters", "offsets", "types", "parents", "parent_x", "child_x")
+# Sections with at most this many points get them one by one, which is faster than
+# filling the pt3d vectors.
+_SCALAR_POINTS = 16
+
+#: Directory where parsed morphologies are cached. The disk cache is disabled by
+#: default; set the ``ARBORIZE_CACHE_DIR`` environment variable, or assign a directory
+#: to this variable, to enable it.
+cache_directory = os.getenv("ARBORIZE_CACHE_DIR", "")
+# Process pool that preprocesses morphology files into the disk cache, and the pending
+# preprocessing job of each file.
+_pool = None
+_pending = {}
+# Default number of worker processes of the pool.
+_PROCESSES = 4
+
+
+class Morphology:
+    """
+        Array representation of a morphology's point/section tree. Morphologies are
+        builders: their ``instantiate`` method creates all sections on the model in bulk.
+
+        The points of section ``i`` are ``points[offsets[i]:offsets[i + 1]]``. The
+        ``types`` array indexes :data:`.SECTION_TYPES`, ``parents`` holds the index of
+        the parent section (or -1) and each section's 0 or 1 end (``child_x``) is
+        connected to its parent at ``parent_x``.
+    """
+    def __init__(self, points, diameters, offsets, types, parents, parent_x, child_x):
+        self.points = points
+        self.diameters = diameters
+        self.offsets = offsets
+        self.types = types
+        self.parents = parents
+        self.parent_x = parent_x
+        self.child_x = child_x
+
+    def __len__(self):
+        return len(self.types)
+
+    def section_points(self, i):
+        """
+            Return the points and diameters of section ``i``.
+        """
+        s = slice(self.offsets[i], self.offsets[i + 1])
+        return self.points[s], self.diameters[s]
+
+    def get_morphology(self, model):
+        return self
+
+    def transform(self, matrix=None, translation=None, scale=None):
+        """
+            Return a copy of this morphology with its points scaled, multiplied by
+            ``matrix`` and translated, in that order. Diameters and topology are shared
+            with this morphology.
+
+            :param matrix: 3x3 transformation matrix, such as a rotation matrix.
+            :param translation: Vector to add to all points.
+            :param scale: Scalar or per axis scale factors of the coordinates.
+        """
+        points = self.points
+        if scale is not None:
+            points = points * scale
+        if matrix is not None:
+            points = points @ np.asarray(matrix).T
+        if translation is not None:
+            points = points + translation
+        return Morphology(
+            np.asarray(points), self.diameters, self.offsets, self.types,
+            self.parents, self.parent_x, self.child_x,
+        )
+
+    def instantiate(self, model, *args, **kwargs):
+        """
+            Create the sections of this morphology on the model. Sections are appended to
+            the ``soma``, ``dend``, ``axon`` and ``apic`` lists of the model, like Import3D
+            would.
+        """
+        sections = []
+        by_type = {name: [] for name in SECTION_TYPES}
+        # Read the (memory mapped) arrays once and reuse the same pt3d vectors.
+        points, diameters = np.asarray(self.points), np.asarray(self.diameters)
+        rows = np.column_stack((points, diameters)).tolist()
+        offsets = self.offsets.tolist()
+        vectors = _pt3d_vectors()
+        for i, type in enumerate(self.types.tolist()):
+            name = SECTION_TYPES[type]
+            section = p.Section(name="{}[{}]".format(name, len(by_type[name])), cell=model)
+            by_type[name].append(section)
+            start, end = offsets[i], offsets[i + 1]
+            if end - start > _SCALAR_POINTS:
+                _pt3dadd(section, points[start:end], diameters[start:end], vectors)
+            elif end > start:
+                pt3dadd = section.__neuron__().pt3dadd
+                for x, y, z, d in rows[start:end]:
+                    pt3dadd(x, y, z, d)
+            sections.append(section)
+        for section, parent, parent_x, child_x in zip(
+            sections, self.parents.tolist(), self.parent_x.tolist(), self.child_x.tolist()
+        ):
+            if parent >= 0:
+                section.connect(sections[parent], parent_x, child_x)
+        for name, created in by_type.items():
+            if getattr(model, name, None) is None:
+                setattr(model, name, [])
+            getattr(model, name).extend(created)
+        return sections
+
+    @classmethod
+    def from_sections(cls, sections, types):
+        """
+            Read the 3D points and topology of NEURON sections into a Morphology.
+
+            :param sections: Sections to read. Parents outside of this list are ignored.
+            :param types: Index into :data:`.SECTION_TYPES` for each section.
+        """
+        sections = [s.__neuron__() if hasattr(s, "__neuron__") else s for s in sections]
+        index = {s: i for i, s in enumerate(sections)}
+        n3d = np.fromiter((s.n3d() for s in sections), dtype=int, count=len(sections))
+        offsets = np.zeros(len(sections) + 1, dtype=np.int64)
+        np.cumsum(n3d, out=offsets[1:])
+        points = np.empty((offsets[-1], 3))
+        diameters = np.empty(offsets[-1])
+        parents = np.full(len(sections), -1, dtype=np.int64)
+        parent_x = np.ones(len(sections))
+        child_x = np.zeros(len(sections))
+        for i, s in enumerate(sections):
+            points[offsets[i]:offsets[i + 1]], diameters[offsets[i]:offsets[i + 1]] = _read_pt3d(s)
+            parent_seg = s.parentseg()
+            if parent_seg is not None and parent_seg.sec in index:
+                parents[i] = index[parent_seg.sec]
+                parent_x[i] = parent_seg.x
+                child_x[i] = s.orientation()
+        return cls(points, diameters, offsets, np.asarray(types, dtype=np.int8), parents, parent_x, child_x)
+
+    @classmethod
+    def from_import3d(cls, loaded_morphology):
+        """
+            Convert an ``Import3d_GUI`` object into a Morphology by instantiating it
+            once on a temporary holder and reading back the created sections. Sections
+            of lists other than :data:`.SECTION_TYPES`, such as the ``dend_5`` list of a
+            custom SWC type, are read as dendrites.
+        """
+        holder = _SectionHolder()
+        loaded_morphology.instantiate(holder)
+        # Import3D also creates an `all` list with every section.
+        lists = [name for name in vars(holder) if name != "all"]
+        lists.sort(key=lambda name: SECTION_TYPES.index(name) if name in SECTION_TYPES else len(SECTION_TYPES))
+        sections, types = [], []
+        for name in lists:
+            created = getattr(holder, name) or []
+            type = SECTION_TYPES.index(name) if name in SECTION_TYPES else SECTION_TYPES.index("dend")
+            sections.extend(created)
+            types.extend([type] * len(created))
+        return cls.from_sections(sections, types)
+
+    def save(self, directory):
+        """
+            Save the arrays of this morphology as ``.npy`` files in a directory.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, name + ".npy"), getattr(self, name))
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """
+            Load a morphology saved with :meth:`.save`. The arrays are memory mapped by
+            default.
+        """
+        return cls(*(np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode) for name in _ARRAYS))
+
+
+class _SectionHolder:
+    # Plain object for Import3D to create its section lists on.
+    pass
+
+
+def _pt3d_vectors():
+    return [p.Vector().__neuron__() for _ in range(4)]
+
+
+def _pt3dadd(section, points, diameters, vectors=None):
+    # Add all points to the section with one call, through the x, y, z & d vectors.
+    if vectors is None:
+        vectors = _pt3d_vectors()
+    # Filling the vectors from lists is faster than from array views.
+    for vector, values in zip(vectors, np.column_stack((points, diameters)).T.tolist()):
+        vector.from_python(values)
+    p.pt3dadd(*vectors, sec=section.__neuron__() if hasattr(section, "__neuron__") else section)
+
+
+def _read_pt3d(section):
+    # Return the 3D points and diameters of a section as arrays.
+    section = section.__neuron__() if hasattr(section, "__neuron__") else section
+    n = section.n3d()
+    points = np.empty((n, 3))
+    diameters = np.empty(n)
+    for i in range(n):
+        points[i] = (section.x3d(i), section.y3d(i), section.z3d(i))
+        diameters[i] = section.diam3d(i)
+    return points, diameters
+
+
+def _set_pt3d(section, points, diameters):
+    # Replace the 3D points of a section in bulk.
+    section = section.__neuron__() if hasattr(section, "__neuron__") else section
+    section.pt3dclear()
+    _pt3dadd(section, points, diameters)
+
+
+@contextmanager
+def _suppress_stdout():
+    with open(os.devnull, "w") as devnull:
+        old_stdout = sys.stdout
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = old_stdout
+
+
+def _check_file(morphology):
+    if not os.path.isfile(morphology):
+        raise FileNotFoundError(f"'{morphology}' can't be found. Provide a correct absolute path in the `morphologies` array or add a `morphology_directory` class attribute to your NeuronModel.")
+
+
+def _import3d_load(morphology):
+    _check_file(morphology)
+    loader = p.Import3d_Neurolucida3()
+    with _suppress_stdout():
+        loader.input(morphology)
+    loaded_morphology = p.Import3d_GUI(loader, 0)
+    return loaded_morphology
+
+
+def _file_digest(file):
+    h = hashlib.sha1(_CACHE_VERSION.encode())
+    with open(file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _geometry_digest(morphology):
+    # Digest of the shape and topology of a morphology, independent of its position,
+    # and the first point it is relative to. Rounding keeps translated copies equal.
+    points = np.asarray(morphology.points, dtype=float)
+    origin = points[0].copy() if len(points) else np.zeros(3)
+    # Adding 0 turns -0.0 into 0.0, which has other bytes.
+    h = hashlib.sha1((np.round(points - origin, 6) + 0.0).tobytes())
+    for name in _ARRAYS[1:]:
+        h.update(np.ascontiguousarray(getattr(morphology, name)).tobytes())
+    return h.hexdigest(), origin
+
+
+def _cache_put(cache, key, value, size=64):
+    # Store a value in a dictionary, dropping the oldest entries beyond `size`.
+    while len(cache) >= size:
+        del cache[next(iter(cache))]
+    cache[key] = value
+    return value
+
+
+def load_morphology(file):
+    """
+        Load a morphology file into a :class:`.Morphology`. Files are identified by the
+        hash of their content: every file is parsed by Import3D only once per process,
+        and once across processes if the :data:`.cache_directory` is enabled, after which
+        the arrays are memory mapped from the disk cache.
+    """
+    _check_file(file)
+    return _load_digest(_file_digest(file), file)
+
+
+@functools.lru_cache(maxsize=128)
+def _load_digest(digest, file):
+    if not cache_directory:
+        return Morphology.from_import3d(_import3d_load(file))
+    target = os.path.join(cache_directory, digest)
+    if not os.path.isdir(target):
+        morphology = Morphology.from_import3d(_import3d_load(file))
+        # Write to a temporary directory and move it in place, so that other processes
+        # never read a partially written cache entry.
+        os.makedirs(cache_directory, exist_ok=True)
+        tmp = tempfile.mkdtemp(dir=cache_directory)
+        morphology.save(tmp)
+        try:
+            os.replace(tmp, target)
+        except OSError:
+            # Another process beat us to it.
+            shutil.rmtree(tmp, ignore_errors=True)
+    return Morphology.load(target)
+
+
+def clear_cache(disk=False):
+    """
+        Clear the in-memory morphology cache, and optionally the disk cache.
+    """
+    _load_digest.cache_clear()
+    if disk and cache_directory:
+        _pending.clear()
+        shutil.rmtree(cache_directory, ignore_errors=True)
+
+
+def preprocess_morphologies(files, wait=True, processes=None):
+    """
+        Parse morphology files with Import3D in a pool of worker processes and store
+        them in the :data:`.cache_directory`, from which :func:`.load_morphology` then
+        memory maps them. Files that fail to load raise their error when their job's
+        result is retrieved. If the disk cache is disabled or ``processes`` is 0, the
+        files are loaded in this process instead, when ``wait`` is set.
+
+        No worker processes are started when NEURON runs on more than one MPI rank:
+        every rank would start its own pool on the same node, and forking after MPI is
+        initialized is unsafe. The ranks then load the files themselves and share them
+        through the disk cache, so that a file is parsed by every rank that loads it
+        before it is cached. Preprocess the files before the MPI run, or on one rank
+        followed by a barrier, to parse them once.
+
+        :param files: Absolute paths of the morphology files.
+        :param wait: Wait for all files to be processed.
+        :type wait: bool
+        :param processes: Number of worker processes, at most 4 by default. Only used
+          when the pool is first created. The pool is created on the first call, and
+          shut down when the interpreter exits.
+        :returns: A :class:`concurrent.futures.Future` per file, or ``None`` for files
+          that were loaded in this process.
+        :rtype: list
+    """
+    global _pool
+    files = list(files)
+    if not cache_directory or (_pool is None and (processes == 0 or _mpi_ranks() > 1)):
+        if wait:
+            for file in files:
+                load_morphology(file)
+        return [None] * len(files)
+    if _pool is None:
+        _pool = ProcessPoolExecutor(processes or min(_PROCESSES, os.cpu_count() or 1))
+        atexit.register(_shutdown_pool)
+    futures = []
+    for file in files:
+        future = _pending.get(file)
+        if future is None:
+            future = _pending[file] = _pool.submit(_preprocess, file)
+            future.add_done_callback(functools.partial(_forget_failed, file))
+        futures.append(future)
+    if wait:
+        for future in futures:
+            future.result()
+    return futures
+
+
+def _mpi_ranks():
+    # Number of MPI ranks that NEURON runs on.
+    return int(p.parallel.__neuron__().nhost())
+
+
+def _forget_failed(file, future):
+    # Let failed files be submitted again, instead of raising the same error forever.
+    if future.cancelled() or future.exception() is not None:
+        if _pending.get(file) is future:
+            del _pending[file]
+
+
+def _shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _pending.clear()
+
+
+def _preprocess(file):
+    # Runs in the worker processes: fill the disk cache, without sending the arrays back.
+    load_morphology(file)
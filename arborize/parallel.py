@@ -0,0 +1,139 @@
+import os, time, heapq
+import numpy as np
+from .connectivity import _synapse_spec, _broadcast
+from .tables import RECEIVER_COLUMNS, TRANSMITTER_COLUMNS
+
+if not os.getenv('READTHEDOCS'):
+    from patch import p
+    from .synapse import Synapse
+
+
+def register_transmitters(cells, gids, sections=None, source_var=False):
+    """
+        Register a spike transmitter for each cell with its gid on this rank, like
+        :meth:`~arborize.core.NeuronModel.create_transmitter` does for a single cell.
+
+        :param cells: Cells to register transmitters on.
+        :type cells: sequence of :class:`~arborize.core.NeuronModel`
+        :param gids: GID of each transmitter.
+        :type gids: array-like of int
+        :param sections: Index in ``cell.sections`` of the section of each transmitter,
+          or a single index for all cells. Defaults to the first section, the soma.
+        :type sections: int or array-like of int
+        :param source_var: Also register the section's potential as a source variable.
+        :type source_var: bool
+        :returns: Number of transmitters registered on this rank and the time it took.
+        :rtype: dict
+    """
+    start = time.perf_counter()
+    n = len(cells)
+    gids = np.asarray(gids, dtype=np.int64)
+    if len(gids) != n:
+        raise ValueError("All transmitter arrays must have the same length.")
+    gids = gids.tolist()
+    sections = _broadcast(0 if sections is None else sections, n, int)
+    pc = p.parallel.__neuron__()
+    rank = int(pc.id())
+    count = 0
+    for cell, gid, index in zip(cells, gids, sections):
+        table = cell._get_table("_transmitter_table", TRANSMITTER_COLUMNS)
+        rows = table.rows("section", index)
+        section = cell.sections[index].__neuron__()
+        if len(rows):
+            row = int(rows[0])
+        else:
+            connector = p.NetCon(section(0.5)._ref_v, None, sec=section).__neuron__()
+            pc.set_gid2node(gid, rank)
+            # Also marks the gid as an output cell.
+            pc.cell(gid, connector)
+            row = table.append(index, gid, connector, None)
+            count += 1
+        if source_var and table.get("source", row) is None:
+            pc.source_var(section(0.5)._ref_v, gid, sec=section)
+            table.set("source", row, section(0.5)._ref_v)
+    return {"rank": rank, "transmitters": count, "time": time.perf_counter() - start}
+
+
+def register_receivers(cells, sections, gids, synapse_types=None):
+    """
+        Create a synapse for each receiver and connect it to the spikes of a gid, like
+        :meth:`~arborize.core.NeuronModel.create_receiver` does for a single receiver.
+        The synapse types are validated and resolved once per model class, section
+        labels and synapse type.
+
+        :param cells: Cell of each receiver.
+        :type cells: sequence of :class:`~arborize.core.NeuronModel`
+        :param sections: Index in ``cell.sections`` of the section of each receiver.
+        :type sections: array-like of int
+        :param gids: GID that each receiver listens to.
+        :type gids: array-like of int
+        :param synapse_types: Synapse type of each receiver, or a single type for all
+          receivers. Can be omitted if each section has only 1 type.
+        :type synapse_types: str or array-like of str
+        :returns: Number of receivers registered on this rank and the time it took.
+        :rtype: dict
+    """
+    start = time.perf_counter()
+    n = len(cells)
+    if not (len(sections) == len(gids) == n):
+        raise ValueError("All receiver arrays must have the same length.")
+    sections = np.asarray(sections, dtype=int).tolist()
+    gids = np.asarray(gids, dtype=np.int64).tolist()
+    synapse_types = _broadcast(synapse_types, n, object)
+    pc = p.parallel.__neuron__()
+    specs = {}
+    for cell, index, gid, synapse_type in zip(cells, sections, gids, synapse_types):
+        section = cell.sections[index]
+        key = (cell.__class__, tuple(section.labels), synapse_type)
+        try:
+            spec = specs[key]
+        except KeyError:
+            spec = specs[key] = _synapse_spec(cell, section, synapse_type)
+        synapse_type, point_process, attributes, source, mod_name = spec
+        synapse = Synapse(cell, section, point_process, attributes, type=synapse_type, source=source, mod_name=mod_name)
+        synapse_row = cell._add_synapse(section, synapse)
+        if source is not None:
+            pc.target_var(getattr(synapse.__neuron__(), "_ref_" + source), gid)
+            connector = None
+        else:
+            connector = pc.gid_connect(gid, synapse.__neuron__())
+            connector.threshold = -20.0
+        table = cell._get_table("_receiver_table", RECEIVER_COLUMNS)
+        table.append(index, cell._synapse_type_id(synapse_type), gid, synapse_row, connector)
+    return {"rank": int(pc.id()), "receivers": n, "time": time.perf_counter() - start}
+
+
+def gather_reports(report):
+    """
+        Collect the registration report of every rank, on every rank.
+
+        :param report: Report of this rank, as returned by :func:`.register_transmitters`
+          or :func:`.register_receivers`.
+        :returns: Report of each rank, ordered by rank.
+        :rtype: list of dict
+    """
+    return list(p.parallel.__neuron__().py_allgather(report))
+
+
+def partition(costs, ranks):
+    """
+        Assign items, such as the gids of cells, to ranks so that the total cost per rank
+        is balanced, using the greedy longest processing time rule: items are assigned in
+        order of decreasing cost to the rank with the lowest total cost so far.
+
+        :param costs: Cost of each item, such as :meth:`~arborize.core.NeuronModel.estimate_cost`.
+        :type costs: array-like of float
+        :param ranks: Number of ranks.
+        :type ranks: int
+        :returns: Rank of each item. The total cost per rank is
+          ``np.bincount(assignment, weights=costs, minlength=ranks)``.
+        :rtype: :class:`numpy.ndarray` of int
+    """
+    costs = np.asarray(costs, dtype=float)
+    assignment = np.empty(len(costs), dtype=int)
+    loads = [(0.0, rank) for rank in range(ranks)]
+    for item in np.argsort(-costs, kind="stable").tolist():
+        load, rank = loads[0]
+        assignment[item] = rank
+        heapq.heapreplace(loads, (load + costs[item], rank))
+    return assignment
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class Population:
+    """
+        Cells of a :class:`~arborize.core.NeuronModel` class created together by
+        :meth:`~arborize.core.NeuronModel.create_population`. The positions, morphology
+        indices and rotations of the cells are stored as arrays, the cells are
+        accessible by indexing or iterating over the population.
+    """
+    def __init__(self, model, cells, positions, morphologies, rotations=None, build_time=0.0):
+        self.model = model
+        self.cells = cells
+        self.positions = positions
+        self.morphologies = morphologies
+        self.rotations = rotations
+        self.build_time = build_time
+
+    def __len__(self):
+        return len(self.cells)
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def __getitem__(self, index):
+        return self.cells[index]
+
+    def __repr__(self):
+        return "<{} of {} {} cells, built at {:.1f} cells/s>".format(
+            self.__class__.__name__, len(self), self.model.__name__, self.throughput
+        )
+
+    @property
+    def throughput(self):
+        """
+            Number of cells built per second.
+        """
+        return len(self) / self.build_time if self.build_time else float("inf")
+
+    @property
+    def compartment_count(self):
+        """
+            Total number of segments of all cells in the population.
+        """
+        return sum(cell.compartment_count for cell in self.cells)
+
+    @property
+    def sections(self):
+        """
+            All sections of all cells in the population.
+        """
+        return [s for cell in self.cells for s in cell.sections]
+
+    def record_soma(self, dt=None, tstop=None):
+        """
+            Record the soma potential of all cells.
+
+            :param dt: Sampling interval (ms). Records every time step if omitted.
+            :param tstop: Duration (ms) of the simulation, to preallocate the recordings.
+            :rtype: :class:`~arborize.recording.PopulationRecorder`
+        """
+        from .recording import PopulationRecorder
+
+        return PopulationRecorder.soma(self.cells, dt=dt, tstop=tstop)
+
+
+def _population_arrays(model, positions, morphologies, rotations):
+    # Validate and broadcast the population arguments into arrays of equal length.
+    positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+    n = len(positions)
+    morphologies = np.broadcast_to(np.asarray(0 if morphologies is None else morphologies, dtype=int), (n,))
+    n_morphologies = len(model.imported_morphologies)
+    if n and (morphologies.min() < 0 or morphologies.max() >= n_morphologies):
+        raise IndexError("Morphology indices must be between 0 and {} for {}.".format(n_morphologies - 1, model.__name__))
+    if rotations is not None:
+        rotations = np.broadcast_to(np.asarray(rotations, dtype=float), (n, 3, 3))
+    return positions, morphologies, rotations
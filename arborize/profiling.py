@@ -0,0 +1,152 @@
+import os, time, json, atexit
+from contextlib import contextmanager
+
+#: The :class:`.BuildProfile` that cells are currently recorded into, or ``None`` if
+#: profiling is disabled. Set the ``ARBORIZE_PROFILE`` environment variable to profile
+#: the whole process; if its value is a path other than ``1``, the profile is exported
+#: to it as JSON at exit.
+active = None
+# Timer of the cell under construction, if profiling is enabled.
+cell = None
+
+
+class BuildProfile:
+    """
+        Aggregated build statistics per model class: the number of cells built, the
+        wall time spent in each build phase and the number of resolve, insert and
+        setattr calls. Operations outside of cell construction, such as creating
+        synapses afterwards, are counted in ``counts``.
+    """
+    def __init__(self):
+        self.classes = {}
+        self.counts = {}
+
+    def __repr__(self):
+        cells = sum(c["cells"] for c in self.classes.values())
+        return "<{} of {} cells of {} classes>".format(self.__class__.__name__, cells, len(self.classes))
+
+    def _record(self, timer):
+        stats = self.classes.get(timer.model)
+        if stats is None:
+            stats = self.classes[timer.model] = {"cells": 0, "time": 0.0, "phases": {}, "counts": {}}
+        stats["cells"] += 1
+        stats["time"] += timer.end - timer.start
+        _add(stats["phases"], timer.phases)
+        _add(stats["counts"], timer.counts)
+
+    def to_dict(self):
+        """
+            Return the profile as a JSON serializable dictionary.
+        """
+        return {
+            "classes": {
+                model.__name__: {
+                    "cells": stats["cells"],
+                    "time": stats["time"],
+                    "cells_per_second": stats["cells"] / stats["time"] if stats["time"] else None,
+                    "phases": dict(stats["phases"]),
+                    "counts": dict(stats["counts"]),
+                }
+                for model, stats in self.classes.items()
+            },
+            "counts": dict(self.counts),
+        }
+
+    def to_json(self, file=None, **kwargs):
+        """
+            Export the profile as JSON. Returns the JSON string, or writes it to
+            ``file`` if given.
+        """
+        data = json.dumps(self.to_dict(), **kwargs)
+        if file is not None:
+            with open(file, "w") as f:
+                f.write(data)
+        return data
+
+
+class _CellTimer:
+    __slots__ = ("model", "phases", "counts", "start", "end", "_last", "_previous")
+
+    def __init__(self, model, previous):
+        self.model = model
+        self.phases = {}
+        self.counts = {}
+        self._previous = previous
+        self.start = self._last = time.perf_counter()
+
+    def lap(self, phase):
+        # Add the time since the previous lap to the given phase.
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def finish(self):
+        global cell
+        self.end = self._last
+        cell = self._previous
+        if active is not None:
+            active._record(self)
+
+
+def start(model):
+    """
+        Start timing the construction of a cell of the given model class. Returns
+        ``None`` if profiling is disabled.
+    """
+    global cell
+    if active is None:
+        return None
+    cell = _CellTimer(model, cell)
+    return cell
+
+
+def count(name, n=1):
+    """
+        Count ``n`` calls of ``name`` towards the cell under construction, or towards the
+        profile if no cell is being built.
+    """
+    if active is None:
+        return
+    counts = cell.counts if cell is not None else active.counts
+    counts[name] = counts.get(name, 0) + n
+
+
+@contextmanager
+def profile():
+    """
+        Profile the cells built in this context:
+
+        .. code-block:: python
+
+            with arborize.profiling.profile() as prof:
+                MyCell.create_population(positions)
+            prof.to_json("build_profile.json", indent=2)
+
+        :rtype: :class:`.BuildProfile`
+    """
+    global active, cell
+    previous = active, cell
+    active, cell = BuildProfile(), None
+    try:
+        yield active
+    finally:
+        active, cell = previous
+
+
+def _add(totals, values):
+    for key, value in values.items():
+        totals[key] = totals.get(key, 0) + value
+
+
+def _init_from_env():
+    global active
+    setting = os.getenv("ARBORIZE_PROFILE")
+    if not setting:
+        return
+    active = BuildProfile()
+    if setting != "1":
+        profile = active
+        atexit.register(lambda: profile.to_json(setting, indent=2))
+
+
+_init_from_env()
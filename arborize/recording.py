@@ -0,0 +1,241 @@
+import os, json
+import numpy as np
+
+if not os.getenv('READTHEDOCS'):
+    from patch import p
+
+
+class PopulationRecorder:
+    """
+        Record a variable of many targets at once, such as the soma potential of all
+        cells of a population or the current of many synapses. The traces are recorded
+        into bare NEURON vectors of which the buffers are preallocated if the duration of
+        the simulation is known, and are read out together as a single
+        ``(n_targets, n_timesteps)`` array.
+
+        :param pointers: NEURON pointers (``_ref_`` attributes) of the recorded variables.
+        :param dt: Sampling interval (ms). Records every time step if omitted.
+        :type dt: float
+        :param tstop: Duration (ms) of the simulation, used to preallocate the buffers.
+        :type tstop: float
+    """
+    def __init__(self, pointers, dt=None, tstop=None):
+        self.dt = dt
+        self._vectors = []
+        capacity = 0
+        if tstop is not None:
+            capacity = int(tstop / (dt or p.dt)) + 2
+        self._time = self._record(p._ref_t, capacity)
+        for pointer in pointers:
+            self._vectors.append(self._record(pointer, capacity))
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def _record(self, pointer, capacity):
+        vector = p.Vector().__neuron__()
+        if capacity:
+            vector.buffer_size(capacity)
+        if self.dt is None:
+            vector.record(pointer)
+        else:
+            vector.record(pointer, self.dt)
+        return vector
+
+    @classmethod
+    def soma(cls, cells, x=0.5, **kwargs):
+        """
+            Record the membrane potential of the first soma section of each cell.
+        """
+        return cls((cell.soma[0].__neuron__()(x)._ref_v for cell in cells), **kwargs)
+
+    @classmethod
+    def synapses(cls, synapses, variable="i", **kwargs):
+        """
+            Record a variable, the current by default, of each synapse.
+        """
+        return cls((getattr(synapse.__neuron__(), "_ref_" + variable) for synapse in synapses), **kwargs)
+
+    @property
+    def time(self):
+        """
+            Time (ms) of each sample.
+        """
+        return self._time.as_numpy().copy()
+
+    def to_array(self, file=None, dtype=float):
+        """
+            Copy the recorded traces into a ``(n_targets, n_timesteps)`` array.
+
+            :param file: Path of a ``.npy`` file to write the traces to. The returned array
+              is then memory mapped onto this file.
+            :param dtype: Data type of the array.
+        """
+        shape = (len(self._vectors), int(self._time.size()))
+        if file is None:
+            traces = np.empty(shape, dtype=dtype)
+        else:
+            traces = np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=shape)
+        n = shape[1]
+        for row, vector in zip(traces, self._vectors):
+            row[:] = vector.as_numpy()[:n]
+        if file is not None:
+            traces.flush()
+        return traces
+
+    def clear(self):
+        """
+            Discard the recorded samples, keeping the recordings and their buffers.
+        """
+        self._time.resize(0)
+        for vector in self._vectors:
+            vector.resize(0)
+
+
+class StreamingRecorder(PopulationRecorder):
+    """
+        Population recorder that periodically flushes its traces to chunk files in a
+        directory, and then clears its vectors, so that memory use is bounded by the
+        flush interval instead of the duration of the simulation. Each chunk is a raw
+        binary ``(1 + n_targets, n_samples)`` array of which the first row holds the
+        time, and ``index.json`` describes all chunks. Read the recording with
+        :class:`.StreamReader`.
+
+        :param directory: Directory to write the chunks and index to.
+        :param pointers: NEURON pointers of the recorded variables.
+        :param dtype: Data type of the stored samples.
+        :param dt: Sampling interval (ms). Records every time step if omitted.
+        :param interval: Duration (ms) of the chunks, used to preallocate the buffers.
+    """
+    def __init__(self, directory, pointers, dtype="float64", dt=None, interval=None):
+        super().__init__(pointers, dt=dt, tstop=interval)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.interval = interval
+        self._index = {"targets": len(self), "dtype": np.dtype(dtype).str, "dt": dt, "chunks": []}
+        self._write_index()
+
+    @classmethod
+    def soma(cls, directory, cells, x=0.5, **kwargs):
+        """
+            Stream the membrane potential of the first soma section of each cell.
+        """
+        return cls(directory, (cell.soma[0].__neuron__()(x)._ref_v for cell in cells), **kwargs)
+
+    @classmethod
+    def synapses(cls, directory, synapses, variable="i", **kwargs):
+        """
+            Stream a variable, the current by default, of each synapse.
+        """
+        return cls(directory, (getattr(synapse.__neuron__(), "_ref_" + variable) for synapse in synapses), **kwargs)
+
+    def flush(self):
+        """
+            Write the samples recorded since the last flush to a new chunk and clear the
+            vectors.
+        """
+        n = int(self._time.size())
+        if not n:
+            return
+        chunks = self._index["chunks"]
+        chunk = np.empty((len(self) + 1, n), dtype=self._index["dtype"])
+        chunk[0] = self._time.as_numpy()[:n]
+        for row, vector in zip(chunk[1:], self._vectors):
+            row[:] = vector.as_numpy()[:n]
+        file = "chunk_{:06d}.bin".format(len(chunks))
+        chunk.tofile(os.path.join(self.directory, file))
+        chunks.append({
+            "file": file,
+            "offset": chunks[-1]["offset"] + chunks[-1]["samples"] if chunks else 0,
+            "samples": n,
+            "start": float(chunk[0, 0]),
+            "stop": float(chunk[0, -1]),
+        })
+        self._write_index()
+        self.clear()
+
+    def run(self, tstop, interval=None):
+        """
+            Continue the simulation until ``tstop``, flushing every ``interval`` ms and
+            at the end.
+        """
+        interval = interval or self.interval
+        if interval is None:
+            raise ValueError("A flush interval is required to stream a run.")
+        t = p.t
+        while t < tstop:
+            t = min(t + interval, tstop)
+            p.continuerun(t)
+            self.flush()
+
+    def _write_index(self):
+        # Replace the index at once, so that readers never see a partial index.
+        file = os.path.join(self.directory, "index.json")
+        with open(file + ".tmp", "w") as f:
+            json.dump(self._index, f)
+        os.replace(file + ".tmp", file)
+
+
+class StreamReader:
+    """
+        Read a recording written by a :class:`.StreamingRecorder`. Only the chunks that
+        overlap with the requested time window are read, through memory maps.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "index.json")) as f:
+            self._index = json.load(f)
+        self.dtype = np.dtype(self._index["dtype"])
+        self.chunks = self._index["chunks"]
+
+    def __len__(self):
+        return self._index["targets"]
+
+    @property
+    def samples(self):
+        """
+            Total number of recorded samples.
+        """
+        return sum(chunk["samples"] for chunk in self.chunks)
+
+    def _chunk(self, chunk):
+        return np.memmap(
+            os.path.join(self.directory, chunk["file"]), dtype=self.dtype, mode="r",
+            shape=(len(self) + 1, chunk["samples"]),
+        )
+
+    def time(self, start=None, stop=None):
+        """
+            Return the time of the samples between ``start`` and ``stop`` (ms).
+        """
+        return self.read(start=start, stop=stop, time=True)
+
+    def read(self, targets=None, start=None, stop=None, time=False):
+        """
+            Read the samples between ``start`` and ``stop`` (ms, inclusive) of some
+            targets.
+
+            :param targets: Indices of the targets to read, all targets if omitted.
+            :type targets: int, slice or array-like of int
+            :param start: Start of the time window, the start of the recording if omitted.
+            :param stop: End of the time window, the end of the recording if omitted.
+            :param time: Return the time of the samples instead.
+            :returns: ``(n_targets, n_samples)`` array, or ``(n_samples,)`` for a single
+              target index or for the time.
+        """
+        if targets is None:
+            targets = slice(None)
+        # Map the target indices onto chunk rows, skipping the time row.
+        rows = 0 if time else np.arange(1, len(self) + 1)[targets]
+        parts = []
+        for chunk in self.chunks:
+            if (start is not None and chunk["stop"] < start) or (stop is not None and chunk["start"] > stop):
+                continue
+            data = self._chunk(chunk)
+            t = data[0]
+            lo = 0 if start is None else np.searchsorted(t, start, side="left")
+            hi = len(t) if stop is None else np.searchsorted(t, stop, side="right")
+            parts.append(np.array(data[rows, lo:hi]))
+        if not parts:
+            return np.empty((len(self) + 1, 0), dtype=self.dtype)[rows]
+        return np.concatenate(parts, axis=-1)
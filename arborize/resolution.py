@@ -0,0 +1,111 @@
+import os
+from . import profiling
+
+if not os.getenv('READTHEDOCS'):
+    import glia as g
+
+_resolved = {}
+# Glia resolver and asset index that the memoized names were resolved with.
+_source = None
+# Incremented whenever the memo is cleared, see `state`.
+_generation = 0
+#: Number of resolutions answered from the cache (``hits``) and by glia (``misses``).
+stats = {"hits": 0, "misses": 0}
+
+
+def resolve(name, variant=None, pkg=None, context=None):
+    """
+        Resolve an asset name into the fully qualified glia name of its mod file. The
+        result is memoized per name, variant, package, context package and the glia
+        preferences that apply to the asset, so that ``g.select`` and ``g.context``
+        preferences are respected. The memo is cleared when glia rebuilds its asset
+        index, after packages are installed or reloaded. Errors are not memoized.
+
+        :param name: Unresolved asset name.
+        :type name: str
+        :param variant: Name of the variant to select.
+        :type variant: str
+        :param pkg: Name of the package to select.
+        :type pkg: str
+        :param context: Package preference of the glia context to resolve the asset in.
+        :type context: str
+    """
+    source, selection = _glia_state(name)
+    _check_source(source)
+    key = (name, variant, pkg, context, selection)
+    profiling.count("resolve")
+    try:
+        mod_name = _resolved[key]
+    except KeyError:
+        stats["misses"] += 1
+        profiling.count("g.resolve")
+        with g.context(pkg=context):
+            mod_name = g.resolve(name, variant=variant, pkg=pkg)
+        _resolved[key] = mod_name
+    else:
+        stats["hits"] += 1
+    return mod_name
+
+
+def state():
+    """
+        Return a hashable token of the glia state that resolved names depend on: the
+        ``g.select`` and ``g.context`` preferences in effect and the version of the glia
+        asset index. Results that store resolved names, such as the compiled section
+        templates of a model, remain valid for as long as the token is unchanged.
+    """
+    resolver = _resolver()
+    if resolver is None:
+        _check_source(())
+        return (_generation, None)
+    _check_source((resolver, resolver.index))
+    preferences = resolver._preferences()
+    return (_generation, tuple(sorted((key, _freeze(value)) for key, value in preferences.items())))
+
+
+def _resolver():
+    resolver = getattr(getattr(g, "_manager", None), "resolver", None)
+    if resolver is None or not hasattr(resolver, "_preferences"):
+        return None
+    return resolver
+
+
+def _glia_state(name):
+    # The resolver and asset index of glia, which are replaced when glia reloads its
+    # packages, and the preferences that select a package or variant of `name`.
+    resolver = _resolver()
+    if resolver is None:
+        return (), None
+    preferences = resolver._preferences()
+    selection = tuple(_freeze(preferences.get(key)) for key in (name, "__pkg", "__variant"))
+    return (resolver, resolver.index), selection
+
+
+def _check_source(source):
+    # Clear the memo when glia replaced its resolver or asset index.
+    global _source, _generation
+    if _source is None or any(a is not b for a, b in zip(source, _source)):
+        _resolved.clear()
+        _source = source
+        _generation += 1
+
+
+def _freeze(preference):
+    # Hashable form of a preference dictionary.
+    if isinstance(preference, dict):
+        return tuple(sorted(preference.items()))
+    return preference
+
+
+def invalidate():
+    """
+        Forget all resolved assets. Preferences and reloaded packages are detected
+        automatically, call this if the assets of glia change in any other way, such as
+        mod files that are renamed and recompiled during a run. The section templates
+        of models are recompiled with the new resolutions.
+    """
+    global _source, _generation
+    _resolved.clear()
+    _source = None
+    _generation += 1
+    stats["hits"] = stats["misses"] = 0
@@ -0,0 +1,391 @@
+import os, json, time
+import numpy as np
+from .morphology import Morphology
+from .population import Population
+from .tables import RECEIVER_COLUMNS
+from .connectivity import _synapse_spec
+
+if not os.getenv('READTHEDOCS'):
+    from patch import p
+    from .synapse import Synapse
+    from .core import LabelSet, _section_types
+    from .parallel import register_transmitters
+
+# Bump this when the layout of snapshots changes.
+_SNAPSHOT_VERSION = 1
+_GEOMETRY = ("points", "diameters", "offsets", "types", "parents", "parent_x", "child_x")
+
+
+def save_snapshot(cells, directory, netcons=None):
+    """
+        Save the built state of cells to a directory of ``.npy`` arrays and a
+        ``snapshot.json`` file: their geometry, ``nseg``, labels, inserted mechanisms and
+        the values of their parameters per segment, synapses with their parameters,
+        receivers, transmitters and, optionally, NetCons between them. Restore them
+        with :func:`.load_snapshot`.
+
+        :param cells: Cells of a single model class, or a population.
+        :type cells: iterable of :class:`~arborize.core.NeuronModel` or :class:`~arborize.population.Population`
+        :param directory: Directory to save the snapshot to.
+        :param netcons: NetCons between sections and synapses of the cells to save, such
+          as those returned by :func:`~arborize.connectivity.connect_bulk`.
+    """
+    cells = list(cells)
+    models = {type(cell) for cell in cells}
+    if len(models) > 1:
+        raise ValueError("A snapshot can only contain cells of a single model class.")
+    writer = _SnapshotWriter()
+    for cell in cells:
+        writer.add_cell(cell)
+    if netcons:
+        writer.add_netcons(cells, netcons)
+    writer.save(directory, models.pop().__name__ if models else None)
+
+
+def load_snapshot(directory, model):
+    """
+        Recreate the cells of a snapshot made by :func:`.save_snapshot`. The cells are
+        created without reading morphology files, applying label rules, resolving or
+        evaluating section attributes, and their ``boot`` method is not called.
+
+        :param directory: Directory of the snapshot.
+        :param model: Model class of the saved cells.
+        :type model: :class:`~arborize.core.NeuronModel` subclass
+        :returns: The restored cells and NetCons.
+        :rtype: tuple of a :class:`~arborize.population.Population` and a list
+    """
+    with open(os.path.join(directory, "snapshot.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != _SNAPSHOT_VERSION:
+        raise ValueError("Unsupported snapshot version {}.".format(meta["version"]))
+    if meta["model"] != model.__name__:
+        raise ValueError("Snapshot of '{}' cells can't be restored as '{}'.".format(meta["model"], model.__name__))
+    a = {
+        name[:-4]: np.load(os.path.join(directory, name))
+        for name in os.listdir(directory) if name.endswith(".npy")
+    }
+    start = time.perf_counter()
+    cells = _restore_cells(model, meta, a)
+    synapses = _restore_synapses(cells, meta, a)
+    _restore_parallel(cells, synapses, a)
+    netcons = _restore_netcons(cells, synapses, a)
+    build_time = time.perf_counter() - start
+    return Population(model, cells, a["positions"], a["morphologies"], build_time=build_time), netcons
+
+
+class _SnapshotWriter:
+    def __init__(self):
+        self.names = {"labels": [], "mechanisms": [], "parameters": [], "synapse_types": [], "synapse_parameters": []}
+        self._ids = {key: {} for key in self.names}
+        self.cells = []
+        self.geometry = []
+        self.sections = []
+        self.parameters = []
+        self.synapses = []
+        self.synapse_parameters = []
+        self.receivers = []
+        self.transmitters = []
+        self.netcons = []
+        self._n_sections = 0
+        self._n_synapses = 0
+
+    def _id(self, kind, value):
+        ids = self._ids[kind]
+        id = ids.get(value)
+        if id is None:
+            id = ids[value] = len(self.names[kind])
+            self.names[kind].append(value)
+        return id
+
+    def add_cell(self, cell):
+        morphology = Morphology.from_sections(cell.sections, _section_types(cell))
+        self.geometry.append(morphology)
+        self.cells.append((np.asarray(cell.position, dtype=float), cell._morphology))
+        first = self._n_sections
+        for i, section in enumerate(cell.sections):
+            nrn_section = section.__neuron__()
+            mechanisms = tuple(sorted(m.name() for m in nrn_section(0.5) if not m.is_ion()))
+            ions = tuple(sorted(m.name() for m in nrn_section(0.5) if m.is_ion()))
+            self.sections.append((
+                nrn_section.nseg, nrn_section.L, nrn_section.diam,
+                self._id("labels", tuple(section.labels)), self._id("mechanisms", mechanisms),
+            ))
+            self._add_parameter(first + i, -1, "Ra", nrn_section.Ra)
+            names = ["cm"]
+            for mechanism in mechanisms:
+                names.extend(_parameter_names(mechanism))
+            for ion in ions:
+                names.extend(_ion_names(ion))
+            segments = list(nrn_section)
+            for name in names:
+                values = [getattr(seg, name) for seg in segments]
+                if all(v == values[0] for v in values):
+                    # Store values that are uniform along the section once.
+                    self._add_parameter(first + i, -1, name, values[0])
+                else:
+                    for j, v in enumerate(values):
+                        self._add_parameter(first + i, j, name, v)
+        self._n_sections += len(cell.sections)
+        cell_index = len(self.cells) - 1
+        table = cell.__dict__.get("_synapse_table")
+        first_synapse = self._n_synapses
+        if table:
+            for section, synapse in zip(table["section"].tolist(), table["synapse"]):
+                self.synapses.append((cell_index, section, self._id("synapse_types", synapse._type)))
+                pp = synapse.__neuron__()
+                for name in _parameter_names(synapse._point_process_glia_name, point_process=True):
+                    self.synapse_parameters.append((self._n_synapses, self._id("synapse_parameters", name), getattr(pp, name)))
+                self._n_synapses += 1
+        table = cell.__dict__.get("_receiver_table")
+        if table:
+            for row in range(len(table)):
+                connector = table.get("receiver", row)
+                weight, delay = (connector.weight[0], connector.delay) if connector is not None else (0.0, 0.0)
+                self.receivers.append((
+                    cell_index, table.get("section", row), table.get("gid", row),
+                    first_synapse + table.get("synapse", row), weight, delay,
+                ))
+        table = cell.__dict__.get("_transmitter_table")
+        if table:
+            for row in range(len(table)):
+                self.transmitters.append((
+                    cell_index, table.get("section", row), table.get("gid", row),
+                    table.get("source", row) is not None,
+                ))
+
+    def _add_parameter(self, section, segment, name, value):
+        self.parameters.append((section, segment, self._id("parameters", name), value))
+
+    def add_netcons(self, cells, netcons):
+        sections = {}
+        synapses = {}
+        first = 0
+        for cell_index, cell in enumerate(cells):
+            for i, section in enumerate(cell.sections):
+                sections[section.__neuron__()] = (cell_index, i)
+            table = cell.__dict__.get("_synapse_table")
+            if table:
+                for row, synapse in enumerate(table["synapse"]):
+                    synapses[synapse.__neuron__()] = first + row
+                first += len(table)
+        for netcon in netcons:
+            nrn_netcon = netcon.__neuron__() if hasattr(netcon, "__neuron__") else netcon
+            pre = nrn_netcon.preseg()
+            target = nrn_netcon.syn()
+            if pre is None or pre.sec not in sections or target not in synapses:
+                raise ValueError("Only NetCons between sections and synapses of the saved cells can be saved.")
+            cell_index, section = sections[pre.sec]
+            self.netcons.append((
+                cell_index, section, pre.x, synapses[target],
+                nrn_netcon.weight[0], nrn_netcon.delay, nrn_netcon.threshold,
+            ))
+
+    def save(self, directory, model_name):
+        os.makedirs(directory, exist_ok=True)
+        arrays = {}
+        # Concatenate the geometry of all cells, with offsets into the section arrays.
+        section_offsets = np.zeros(len(self.geometry) + 1, dtype=np.int64)
+        np.cumsum([len(m) for m in self.geometry], out=section_offsets[1:])
+        arrays["cell_sections"] = section_offsets
+        point_offsets = np.cumsum([0] + [m.offsets[-1] for m in self.geometry[:-1]], dtype=np.int64)
+        for name in _GEOMETRY:
+            if name == "offsets":
+                parts = [m.offsets[:-1] + o for m, o in zip(self.geometry, point_offsets)]
+                total = point_offsets[-1] + self.geometry[-1].offsets[-1] if self.geometry else 0
+                arrays[name] = np.concatenate(parts + [[total]]).astype(np.int64)
+            else:
+                parts = [getattr(m, name) for m in self.geometry]
+                arrays[name] = np.concatenate(parts) if parts else np.empty(0)
+        arrays["positions"] = np.array([c[0] for c in self.cells], dtype=float).reshape(-1, 3)
+        arrays["morphologies"] = np.array([c[1] for c in self.cells], dtype=np.int64)
+        columns = {
+            "sections": (("nseg", np.int32), ("L", float), ("diam", float), ("labels", np.int32), ("mechanisms", np.int32)),
+            "parameters": (("section", np.int64), ("segment", np.int32), ("id", np.int32), ("value", float)),
+            "synapses": (("cell", np.int64), ("section", np.int32), ("type", np.int32)),
+            "synapse_parameters": (("synapse", np.int64), ("id", np.int32), ("value", float)),
+            "receivers": (("cell", np.int64), ("section", np.int32), ("gid", np.int64), ("synapse", np.int64), ("weight", float), ("delay", float)),
+            "transmitters": (("cell", np.int64), ("section", np.int32), ("gid", np.int64), ("source", bool)),
+            "netcons": (("cell", np.int64), ("section", np.int32), ("x", float), ("synapse", np.int64), ("weight", float), ("delay", float), ("threshold", float)),
+        }
+        for table, fields in columns.items():
+            rows = getattr(self, table)
+            for i, (field, dtype) in enumerate(fields):
+                arrays[table + "_" + field] = np.array([row[i] for row in rows], dtype=dtype)
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, name + ".npy"), array)
+        meta = {
+            "version": _SNAPSHOT_VERSION,
+            "model": model_name,
+            "labels": [list(labels) for labels in self.names["labels"]],
+            "mechanisms": [list(mechanisms) for mechanisms in self.names["mechanisms"]],
+            "parameters": self.names["parameters"],
+            "synapse_types": self.names["synapse_types"],
+            "synapse_parameters": self.names["synapse_parameters"],
+        }
+        with open(os.path.join(directory, "snapshot.json"), "w") as f:
+            json.dump(meta, f)
+
+
+def _restore_cells(model, meta, a):
+    cells = []
+    cell_sections = a["cell_sections"].tolist()
+    label_sets = [tuple(labels) for labels in meta["labels"]]
+    mechanism_sets = meta["mechanisms"]
+    nseg = a["sections_nseg"].tolist()
+    lengths = a["sections_L"].tolist()
+    diameters = a["sections_diam"].tolist()
+    section_labels = a["sections_labels"].tolist()
+    section_mechanisms = a["sections_mechanisms"].tolist()
+    sections = []
+    for i, (position, morphology) in enumerate(zip(a["positions"], a["morphologies"].tolist())):
+        start, end = cell_sections[i], cell_sections[i + 1]
+        cell = model.__new__(model)
+        cell.position = position.copy()
+        cell.dendrites = []
+        cell.axon = []
+        cell.soma = []
+        cell.apic = []
+        cell._morphology = morphology
+        _cell_geometry(a, start, end).instantiate(cell)
+        cell._wrap_sections()
+        cell._collect_sections()
+        for j, section in enumerate(cell.sections, start=start):
+            nrn_section = section.__neuron__()
+            if nrn_section.n3d() == 0:
+                nrn_section.L = lengths[j]
+                nrn_section.diam = diameters[j]
+            section.labels = LabelSet(label_sets[section_labels[j]])
+            section.cell = cell
+            nrn_section.nseg = nseg[j]
+            for mechanism in mechanism_sets[section_mechanisms[j]]:
+                nrn_section.insert(mechanism)
+            synapses = model._get_section_template(section.labels).synapses
+            if synapses is not None:
+                section.available_synapse_types = synapses
+            sections.append(nrn_section)
+        cell._index_labels()
+        cells.append(cell)
+    names = meta["parameters"]
+    for section, segment, id, value in zip(
+        a["parameters_section"].tolist(), a["parameters_segment"].tolist(),
+        a["parameters_id"].tolist(), a["parameters_value"].tolist(),
+    ):
+        nrn_section = sections[section]
+        if segment < 0:
+            setattr(nrn_section, names[id], value)
+        else:
+            setattr(nrn_section((segment + 0.5) / nrn_section.nseg), names[id], value)
+    return cells
+
+
+def _cell_geometry(a, start, end):
+    # Slice the morphology arrays of one cell out of the concatenated arrays.
+    offsets = a["offsets"][start:end + 1]
+    points = slice(offsets[0], offsets[-1])
+    return Morphology(
+        a["points"][points], a["diameters"][points], offsets - offsets[0], a["types"][start:end],
+        a["parents"][start:end], a["parent_x"][start:end], a["child_x"][start:end],
+    )
+
+
+def _restore_synapses(cells, meta, a):
+    types = meta["synapse_types"]
+    specs = {}
+    synapses = []
+    for cell_index, section_index, type in zip(
+        a["synapses_cell"].tolist(), a["synapses_section"].tolist(), a["synapses_type"].tolist(),
+    ):
+        cell = cells[cell_index]
+        section = cell.sections[section_index]
+        key = (tuple(section.labels), type)
+        try:
+            spec = specs[key]
+        except KeyError:
+            spec = specs[key] = _synapse_spec(cell, section, types[type])
+        synapse_type, point_process, attributes, source, mod_name = spec
+        synapse = Synapse(cell, section, point_process, attributes, type=synapse_type, source=source, mod_name=mod_name)
+        cell._add_synapse(section, synapse)
+        synapses.append(synapse)
+    names = meta["synapse_parameters"]
+    for synapse, id, value in zip(
+        a["synapse_parameters_synapse"].tolist(), a["synapse_parameters_id"].tolist(),
+        a["synapse_parameters_value"].tolist(),
+    ):
+        setattr(synapses[synapse].__neuron__(), names[id], value)
+    return synapses
+
+
+def _restore_parallel(cells, synapses, a):
+    pc = p.parallel.__neuron__()
+    # NEURON requires the output ports of a process to exist before its input ports.
+    source = a["transmitters_source"]
+    for selection, source_var in ((~source, False), (source, True)):
+        if selection.any():
+            register_transmitters(
+                [cells[i] for i in a["transmitters_cell"][selection].tolist()],
+                a["transmitters_gid"][selection], a["transmitters_section"][selection],
+                source_var=source_var,
+            )
+    # Synapses are saved cell by cell, find the index of the first synapse of each cell.
+    first_synapse = np.searchsorted(a["synapses_cell"], np.arange(len(cells))).tolist()
+    for cell_index, section, gid, synapse_index, weight, delay in zip(
+        a["receivers_cell"].tolist(), a["receivers_section"].tolist(), a["receivers_gid"].tolist(),
+        a["receivers_synapse"].tolist(), a["receivers_weight"].tolist(), a["receivers_delay"].tolist(),
+    ):
+        cell = cells[cell_index]
+        synapse = synapses[synapse_index]
+        if synapse.source is not None:
+            pc.target_var(getattr(synapse.__neuron__(), "_ref_" + synapse.source), gid)
+            connector = None
+        else:
+            connector = pc.gid_connect(gid, synapse.__neuron__())
+            connector.threshold = -20.0
+            connector.weight[0] = weight
+            connector.delay = delay
+        table = cell._get_table("_receiver_table", RECEIVER_COLUMNS)
+        row = synapse_index - first_synapse[cell_index]
+        table.append(section, cell._synapse_type_id(synapse._type), gid, row, connector)
+
+
+def _restore_netcons(cells, synapses, a):
+    netcons = []
+    for cell_index, section, x, synapse, weight, delay, threshold in zip(
+        a["netcons_cell"].tolist(), a["netcons_section"].tolist(), a["netcons_x"].tolist(),
+        a["netcons_synapse"].tolist(), a["netcons_weight"].tolist(), a["netcons_delay"].tolist(),
+        a["netcons_threshold"].tolist(),
+    ):
+        pre_section = cells[cell_index].sections[section]
+        netcon = p.NetCon(
+            pre_section(x, ephemeral=True), synapses[synapse]._point_process, sec=pre_section,
+            weight=weight, delay=delay,
+        )
+        netcon.threshold = threshold
+        netcons.append(netcon)
+    return netcons
+
+
+_parameter_cache = {}
+
+
+def _parameter_names(mechanism, point_process=False):
+    # Names of the PARAMETERs of a mechanism, as seen from a segment or point process.
+    key = (mechanism, point_process)
+    names = _parameter_cache.get(key)
+    if names is None:
+        standard = p.MechanismStandard(mechanism, 1)
+        names = []
+        for i in range(int(standard.count())):
+            name = p.ref("")
+            standard.name(name, i)
+            names.append(name[0])
+        if point_process:
+            # Point process parameters aren't suffixed with the mechanism name.
+            names = [n[:-len(mechanism) - 1] if n.endswith("_" + mechanism) else n for n in names]
+        _parameter_cache[key] = names
+    return names
+
+
+def _ion_names(ion):
+    # Reversal potential and concentrations of an ion mechanism such as `na_ion`.
+    name = ion[:-len("_ion")]
+    return ["e" + name, name + "i", name + "o"]
@@ -1,18 +1,26 @@
 import glia as g
 from patch import p
+from .resolution import resolve
+from . import profiling
 
 class Synapse:
+    __slots__ = (
+        "_cell", "_type", "_section", "_point_process_name", "source",
+        "_point_process_glia_name", "_point_process",
+    )
 
-    def __init__(self, cell, section, point_process_name, attributes = {}, variant=None, type=None, source=None):
+    def __init__(self, cell, section, point_process_name, attributes = {}, variant=None, type=None, source=None, mod_name=None):
         self._cell = cell
         self._type = type
         self._section = section
         self._point_process_name = point_process_name
         self.source = source
-        with g.context(pkg=cell.__class__.glia_package):
-            self._point_process_glia_name = g.resolve(point_process_name, variant=variant)
-            self._point_process = g.insert(section, point_process_name, variant=variant)
-        section.__ref__(self)
+        if mod_name is None:
+            mod_name = resolve(point_process_name, variant=variant, context=cell.__class__.glia_package)
+        self._point_process_glia_name = mod_name
+        # Insert the fully qualified glia name, which glia doesn't resolve again.
+        profiling.count("insert")
+        self._point_process = g.insert(section, mod_name)
         for key, value in attributes.items():
             setattr(self._point_process, key, value)
 
@@ -0,0 +1,246 @@
+import os, bisect
+from collections.abc import Mapping, Sequence
+import numpy as np
+
+if not os.getenv('READTHEDOCS'):
+    from patch import p
+    from patch.objects import NetCon
+
+#: Columns of the synapse table of a cell: index of the section in ``cell.sections``,
+#: synapse type id and the :class:`~arborize.synapse.Synapse`.
+SYNAPSE_COLUMNS = {"section": np.int32, "type": np.int16, "synapse": None}
+#: Columns of the receiver table of a cell: section index, synapse type id, gid, row of
+#: the synapse in the synapse table and the bare NEURON ``NetCon``, if any.
+RECEIVER_COLUMNS = {"section": np.int32, "type": np.int16, "gid": np.int64, "synapse": np.int64, "receiver": None}
+#: Columns of the transmitter table of a cell: section index, gid, the bare NEURON
+#: ``NetCon`` and the source variable pointer, if any.
+TRANSMITTER_COLUMNS = {"section": np.int32, "gid": np.int64, "connector": None, "source": None}
+
+
+class Table:
+    """
+        Append-only struct-of-arrays table. Columns with a NumPy dtype are stored in
+        arrays that grow by doubling, columns with a ``None`` dtype hold Python objects
+        in a list. ``table[name]`` returns a view of the filled part of a column.
+
+        Rows can be looked up by value through the index of a column, that maps each
+        value to its rows. An index is built on first use, and kept up to date as rows
+        are appended or changed.
+    """
+    __slots__ = ("_columns", "_size", "_indices")
+
+    def __init__(self, columns):
+        self._columns = {
+            name: [] if dtype is None else np.empty(4, dtype=dtype) for name, dtype in columns.items()
+        }
+        self._size = 0
+        self._indices = {}
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, name):
+        column = self._columns[name]
+        return column if isinstance(column, list) else column[:self._size]
+
+    def append(self, *values):
+        """
+            Append a row with a value for each column, in column order, and return its
+            row index.
+        """
+        row = self._size
+        for (name, column), value in zip(self._columns.items(), values):
+            if isinstance(column, list):
+                column.append(value)
+            else:
+                if row == len(column):
+                    grown = np.empty(2 * len(column), dtype=column.dtype)
+                    grown[:row] = column
+                    column = self._columns[name] = grown
+                column[row] = value
+            index = self._indices.get(name)
+            if index is not None:
+                index.setdefault(self._key(name, column[row]), []).append(row)
+        self._size += 1
+        return row
+
+    def get(self, name, row):
+        """
+            Return the value of a column in a row, as a Python object.
+        """
+        column = self._columns[name]
+        return column[row] if isinstance(column, list) else column[row].item()
+
+    def set(self, name, row, value):
+        column = self._columns[name]
+        index = self._indices.get(name)
+        if index is not None:
+            index[self._key(name, column[row])].remove(row)
+        column[row] = value
+        if index is not None:
+            bisect.insort(index.setdefault(self._key(name, column[row]), []), row)
+
+    def _key(self, name, value):
+        # Values of array columns are indexed as Python scalars.
+        return value if isinstance(self._columns[name], list) else value.item()
+
+    def _index(self, name):
+        # Map each value of a column to its rows, in order.
+        column = self[name]
+        if isinstance(column, list):
+            index = {}
+            for row, value in enumerate(column):
+                index.setdefault(value, []).append(row)
+        else:
+            order = np.argsort(column, kind="stable")
+            keys, starts = np.unique(column[order], return_index=True)
+            bounds = np.append(starts, len(order)).tolist()
+            order = order.tolist()
+            index = {key: order[bounds[i]:bounds[i + 1]] for i, key in enumerate(keys.tolist())}
+        self._indices[name] = index
+        return index
+
+    def rows(self, name, values):
+        """
+            Return the sorted indices of the rows whose value in column ``name`` is one
+            of ``values``.
+        """
+        index = self._indices.get(name)
+        if index is None:
+            index = self._index(name)
+        column = self._columns[name]
+        if not isinstance(column, list):
+            values = np.unique(np.asarray(values, dtype=column.dtype)).tolist()
+        found = [index[value] for value in values if value in index]
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        if len(found) == 1:
+            return np.array(found[0], dtype=np.intp)
+        return np.sort(np.concatenate([np.array(rows, dtype=np.intp) for rows in found]))
+
+    def select(self, **criteria):
+        """
+            Return the sorted indices of the rows that match all criteria. Each keyword
+            argument names a column and gives the values to select, or ``None`` to not
+            filter on that column.
+        """
+        rows = None
+        for name, values in criteria.items():
+            if values is None:
+                continue
+            selected = self.rows(name, values)
+            rows = selected if rows is None else np.intersect1d(rows, selected, assume_unique=True)
+        return np.arange(self._size) if rows is None else rows
+
+
+class SectionSynapses(Sequence):
+    """
+        Read-only view of the synapses of a section, in the order they were created. The
+        synapses are stored in the synapse table of the cell.
+    """
+    __slots__ = ("_cell", "_section")
+
+    def __init__(self, cell, section):
+        self._cell = cell
+        self._section = section
+
+    def _rows(self):
+        table = self._cell.__dict__.get("_synapse_table")
+        if table is None:
+            return []
+        return table.rows("section", [self._section]).tolist()
+
+    def __getitem__(self, index):
+        rows = self._rows()
+        if not rows:
+            return [][index]
+        synapses = self._cell._synapse_table["synapse"]
+        if isinstance(index, slice):
+            return [synapses[row] for row in rows[index]]
+        return synapses[rows[index]]
+
+    def __iter__(self):
+        rows = self._rows()
+        if rows:
+            synapses = self._cell._synapse_table["synapse"]
+            yield from (synapses[row] for row in rows)
+
+    def __len__(self):
+        return len(self._rows())
+
+    def __eq__(self, other):
+        return list(self) == list(other) if isinstance(other, (Sequence, list)) else NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class Receiver(Mapping):
+    """
+        Read-only view of a row in the receiver table of a cell, with the ``type``,
+        ``synapse``, ``gid`` and either the ``receiver`` or the ``source`` key.
+    """
+    __slots__ = ("_cell", "_row")
+
+    def __init__(self, cell, row):
+        self._cell = cell
+        self._row = row
+
+    def _keys(self):
+        return ("type", "synapse", "gid", "receiver" if self["synapse"].source is None else "source")
+
+    def __getitem__(self, key):
+        cell, table = self._cell, self._cell._receiver_table
+        if key == "type":
+            return cell.__class__._arbz_synapse_type_names[table.get("type", self._row)]
+        elif key == "gid":
+            return table.get("gid", self._row)
+        synapse = cell._synapse_table.get("synapse", table.get("synapse", self._row))
+        if key == "synapse":
+            return synapse
+        elif key == "receiver" and synapse.source is None:
+            return NetCon(p, table.get("receiver", self._row))
+        elif key == "source" and synapse.source is not None:
+            return synapse.source
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return 4
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Transmitter(Mapping):
+    """
+        Read-only view of a row in the transmitter table of a cell, with the ``gid``,
+        ``connector`` and, if a source variable was given, ``source`` key.
+    """
+    __slots__ = ("_cell", "_row")
+
+    def __init__(self, cell, row):
+        self._cell = cell
+        self._row = row
+
+    def _keys(self):
+        if self._cell._transmitter_table.get("source", self._row) is None:
+            return ("gid", "connector")
+        return ("gid", "connector", "source")
+
+    def __getitem__(self, key):
+        if key not in self._keys():
+            raise KeyError(key)
+        value = self._cell._transmitter_table.get(key, self._row)
+        return NetCon(p, value) if key == "connector" else value
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,385 @@
+"""
+    Benchmark suite of morphology loading, cell construction and synapse creation. It
+    runs on synthetic morphologies and NEURON's builtin mechanisms, so it only needs a
+    local NEURON install::
+
+        python benchmarks/suite.py
+        python benchmarks/suite.py --save benchmarks/baseline.json
+        python benchmarks/suite.py --compare benchmarks/baseline.json
+
+    Every benchmark runs in its own process, and reports a throughput and the peak RSS
+    of its process after each measurement. Comparing against a saved baseline prints
+    the relative throughput of every benchmark and exits with status 1 if any of them
+    regressed more than the tolerance.
+
+    The suite also runs against versions of arborize that predate the optimizations it
+    measures, such as the ``71f1e73`` base commit: the models then load the Neurolucida
+    twin of each synthetic SWC file through Import3D, select labels by diameter, build
+    populations one cell at a time, and the benchmarks of missing features are skipped.
+    ``benchmarks/baseline.json`` was saved against the base commit and
+    ``benchmarks/optimized.json`` against the optimized tree, in turn on the same
+    machine; each records the commit it ran on. The throughputs depend on the machine,
+    so save a baseline of the base commit on your own machine to compare a change::
+
+        git worktree add /tmp/arborize-base 71f1e73
+        PYTHONPATH=/tmp/arborize-base python benchmarks/suite.py --save base.json
+"""
+import os, sys, time, json, argparse, tempfile, resource, platform, subprocess, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(__file__))
+from synthetic import generate_swc, generate_asc
+import numpy as np
+import arborize
+from arborize import NeuronModel
+from arborize.core import make_builder
+from arborize.builders import rotate
+
+try:
+    import arborize.morphology
+    from arborize import connect_bulk
+    from arborize.builders import SWCBuilder
+    from arborize.builders.swc import _load_swc
+
+    legacy = False
+except ImportError:
+    legacy = True
+
+_benchmarks = []
+
+
+def benchmark(f):
+    _benchmarks.append(f)
+    return f
+
+
+def peak_rss():
+    # Peak RSS of this process so far. Linux reports kilobytes, macOS bytes.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1 << 20) if sys.platform == "darwin" else rss / (1 << 10)
+
+
+def timeit(f, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def result(name, count, elapsed, unit):
+    return name, {"rate": count / elapsed, "unit": unit, "count": count, "time": elapsed, "peak_rss_mb": peak_rss()}
+
+
+def cell_file(tmp):
+    """
+        Write the synthetic morphology of the model benchmarks, as SWC file or as
+        Neurolucida file for legacy versions, and return its path.
+    """
+    if legacy:
+        file = os.path.join(tmp, "cell.asc")
+        generate_asc(file, branches=8, depth=3)
+    else:
+        file = os.path.join(tmp, "cell.swc")
+        generate_swc(file, branches=8, depth=3)
+    return file
+
+
+def morphology(file):
+    return file if legacy else SWCBuilder(file)
+
+
+def build_population(model, n, rotations=None):
+    """
+        Build ``n`` cells of a model at the origin and return them with the build time.
+    """
+    if legacy:
+        start = time.perf_counter()
+        cells = [model() for _ in range(n)]
+        return cells, time.perf_counter() - start
+    population = model.create_population(np.zeros((n, 3)), rotations=rotations)
+    return population.cells, population.build_time
+
+
+def make_model(name, file, labels=0):
+    """
+        Create a model class with the synthetic morphology in ``file``, hh and pas on
+        the soma, pas on the dendrites and ``labels`` extra labels that each select the
+        dendrites of a diameter range and set their own attributes.
+    """
+    section_types = {
+        "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100, "cm": 1}},
+        "dendrites": {
+            "mechanisms": ["pas"],
+            "attributes": {"Ra": 100, "cm": 1, ("g", "pas"): 1e-5},
+            "synapses": ["AMPA", "NMDA"],
+        },
+        "axon": {"mechanisms": ["hh"], "attributes": {"Ra": 100}},
+    }
+    label_definitions = {}
+    edges = np.linspace(0, 2.5, labels + 1)
+    for i in range(labels):
+        label = f"band_{i}"
+        low, high = edges[i], edges[i + 1]
+        if legacy:
+            label_definitions[label] = {
+                "from": "dendrites",
+                "diam": lambda diam, low=low, high=high: low <= diam < high,
+            }
+        else:
+            label_definitions[label] = {
+                "from": "dendrites",
+                "where": lambda props, low=low, high=high: (props.diam >= low) & (props.diam < high),
+            }
+        section_types[label] = {"mechanisms": ["pas"], "attributes": {("e", "pas"): -70 - i}}
+    return type(name, (NeuronModel,), {
+        "morphologies": [morphology(file)],
+        "section_types": section_types,
+        "synapse_types": {"AMPA": {"point_process": "ExpSyn"}, "NMDA": {"point_process": "Exp2Syn"}},
+        "labels": label_definitions,
+    })
+
+
+@benchmark
+def bench_make_builder(tmp, scale):
+    # Parse synthetic SWC files of increasing size and create their sections.
+    if legacy:
+        return []
+
+    class Holder:
+        def __init__(self):
+            self.soma, self.dendrites, self.axon = [], [], []
+
+    results = []
+    for depth in range(2, 4 + 2 * scale):
+        file = os.path.join(tmp, f"make_builder_{depth}.swc")
+        samples = generate_swc(file, branches=8, depth=depth)
+
+        def load():
+            _load_swc.cache_clear()
+            make_builder(SWCBuilder(file)).get_morphology(Holder()).instantiate(Holder())
+
+        results.append(result(f"make_builder[{samples} samples]", samples, timeit(load), "samples/s"))
+    return results
+
+
+@benchmark
+def bench_make_builder_file(tmp, scale):
+    # Load Neurolucida files by path, through Import3D and the disk cache.
+    class Holder:
+        def __init__(self):
+            self.soma, self.dendrites, self.axon = [], [], []
+
+    results = []
+    for depth in range(2, 4 + 2 * scale):
+        file = os.path.join(tmp, f"make_builder_{depth}.asc")
+        points = generate_asc(file, branches=8, depth=depth)
+        caches = []
+
+        def cold():
+            # Parse the file with Import3D into an empty disk cache.
+            if not legacy:
+                caches.append(tempfile.mkdtemp(dir=tmp))
+                arborize.morphology.cache_directory = caches[-1]
+                arborize.morphology.clear_cache()
+            make_builder(file).instantiate(Holder())
+
+        def warm():
+            # Memory map the arrays cached on disk by the cold load.
+            if not legacy:
+                arborize.morphology.clear_cache()
+            make_builder(file).instantiate(Holder())
+
+        results.append(result(f"make_builder[{points} points, cold cache]", points, timeit(cold), "points/s"))
+        results.append(result(f"make_builder[{points} points, warm cache]", points, timeit(warm), "points/s"))
+    return results
+
+
+@benchmark
+def bench_instantiate(tmp, scale):
+    # Build populations of models with an increasing number of labels.
+    file = cell_file(tmp)
+    results = []
+    n = 10 * scale
+    for labels in (0, 10, 40):
+        model = make_model(f"Labels{labels}", file, labels=labels)
+        model()
+        _, elapsed = build_population(model, n)
+        results.append(result(f"instantiate[{labels} labels]", n, elapsed, "cells/s"))
+    return results
+
+
+@benchmark
+def bench_rotate(tmp, scale):
+    # Build rotated cells, from a rotate builder and from population rotations.
+    file = cell_file(tmp)
+    model = make_model("Rotated", file)
+    rotated = type("RotatedBuilder", (NeuronModel,), {
+        "morphologies": [(morphology(file), rotate([0., 1., 0.], [1., 0., 0.]))],
+        "section_types": model.section_types,
+        "synapse_types": model.synapse_types,
+    })
+    n = 10 * scale
+    rotated()
+    start = time.perf_counter()
+    for _ in range(n):
+        rotated()
+    results = [result("rotate[builder]", n, time.perf_counter() - start, "cells/s")]
+    if legacy:
+        return results
+    angles = np.linspace(0, np.pi, n)
+    rotations = np.zeros((n, 3, 3))
+    rotations[:, 0, 0] = rotations[:, 1, 1] = np.cos(angles)
+    rotations[:, 0, 1] = -np.sin(angles)
+    rotations[:, 1, 0] = np.sin(angles)
+    rotations[:, 2, 2] = 1
+    _, elapsed = build_population(model, n, rotations=rotations)
+    results.append(result("rotate[population]", n, elapsed, "cells/s"))
+    return results
+
+
+@benchmark
+def bench_synapses(tmp, scale):
+    # Create synapses and connections one by one and in bulk.
+    file = cell_file(tmp)
+    model = make_model("Synaptic", file)
+    cells, _ = build_population(model, 4)
+    n = 1000 * scale
+    rng = np.random.default_rng(0)
+    dendrites = [cells[0].sections.index(d) for d in cells[0].dendrites]
+    pre = rng.integers(len(cells), size=n)
+    post = rng.integers(len(cells), size=n)
+    post_sections = rng.choice(dendrites, size=n)
+    results = []
+
+    start = time.perf_counter()
+    for i in range(n):
+        cell = cells[post[i]]
+        cell.create_synapse(cell.sections[post_sections[i]], "AMPA")
+    results.append(result("create_synapse", n, time.perf_counter() - start, "synapses/s"))
+
+    start = time.perf_counter()
+    for i in range(n):
+        cell = cells[post[i]]
+        cell.connect(cells[pre[i]], cells[pre[i]].soma[0], cell.sections[post_sections[i]], "AMPA")
+    results.append(result("connect", n, time.perf_counter() - start, "synapses/s"))
+    if legacy:
+        return results
+
+    start = time.perf_counter()
+    connect_bulk(
+        [cells[i] for i in pre], np.zeros(n, dtype=int), [cells[i] for i in post], post_sections,
+        synapse_types="AMPA", weights=0.1, delays=1,
+    )
+    results.append(result("connect_bulk", n, time.perf_counter() - start, "synapses/s"))
+    return results
+
+
+@benchmark
+def bench_parallel(tmp, scale):
+    # Register transmitters on the somas and receivers on the dendrites.
+    file = cell_file(tmp)
+    model = make_model("Parallel", file)
+    n = 10 * scale
+    cells, _ = build_population(model, n)
+    offset = 10 ** 6
+    start = time.perf_counter()
+    for gid, cell in enumerate(cells):
+        cell.create_transmitter(cell.soma[0], offset + gid)
+    results = [result("create_transmitter", n, time.perf_counter() - start, "transmitters/s")]
+    count = 0
+    start = time.perf_counter()
+    for gid, cell in enumerate(cells):
+        for dendrite in cell.dendrites:
+            cell.create_receiver(dendrite, offset + (gid + 1) % n, "AMPA")
+            count += 1
+    results.append(result("create_receiver", count, time.perf_counter() - start, "receivers/s"))
+    return results
+
+
+def _run_benchmark(name, tmp, scale):
+    for bench in _benchmarks:
+        if bench.__name__ == "bench_" + name:
+            return bench(tmp, scale)
+
+
+def run(scale=1, select=None):
+    results = {}
+    # A fresh process per benchmark measures its own peak RSS and NEURON state.
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        for bench in _benchmarks:
+            name = bench.__name__[len("bench_"):]
+            if select and name not in select:
+                continue
+            with ProcessPoolExecutor(1, mp_context=context) as pool:
+                measured = pool.submit(_run_benchmark, name, tmp, scale).result()
+            for key, value in measured:
+                results[key] = value
+                print(f"{key:<44} {value['rate']:>12.1f} {value['unit']:<16} {value['peak_rss_mb']:>8.1f} MB")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+        Print the throughput of each benchmark relative to the baseline and return the
+        names of the benchmarks that regressed more than ``tolerance``.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<44} {'baseline':>12} {'current':>12} {'ratio':>7}")
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        ratio = value["rate"] / baseline[name]["rate"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<44} {baseline[name]['rate']:>12.1f} {value['rate']:>12.1f} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def _commit():
+    # Commit of the arborize package that ran the benchmarks, if it is a git checkout.
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(arborize.__file__),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the arborize benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", help="Names of the benchmarks to run, all by default.")
+    parser.add_argument("--scale", type=int, default=1, help="Multiplier of the problem sizes.")
+    parser.add_argument("--save", metavar="FILE", help="Save the results as a baseline.")
+    parser.add_argument("--compare", metavar="FILE", help="Compare the results to a baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown.")
+    args = parser.parse_args(argv)
+    results = run(args.scale, args.benchmarks)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({
+                "arborize": arborize.__version__,
+                "commit": _commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "scale": args.scale,
+                "results": results,
+            }, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("scale", 1) != args.scale:
+            print(f"Warning: baseline was run with --scale {baseline['scale']}.")
+        if compare(results, baseline["results"], args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
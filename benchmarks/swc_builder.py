@@ -0,0 +1,50 @@
+"""
+    Compare the NumPy based :class:`~arborize.builders.SWCBuilder` against NEURON's
+    Import3D on synthetic SWC files of increasing size::
+
+        python benchmarks/swc_builder.py
+"""
+import os, sys, time, tempfile
+
+sys.path.insert(0, os.path.dirname(__file__))
+from synthetic import generate_swc
+from patch import p
+from arborize.builders.swc import parse_swc
+from arborize.morphology import _suppress_stdout
+import numpy as np
+
+
+class _Model:
+    def __init__(self):
+        self.soma, self.axon = [], []
+
+
+def import3d(file):
+    loader = p.Import3d_SWC_read()
+    with _suppress_stdout():
+        loader.input(file)
+    p.Import3d_GUI(loader, 0).instantiate(_Model())
+
+
+def swc_builder(file):
+    parse_swc(np.loadtxt(file, ndmin=2)).instantiate(_Model())
+
+
+def timeit(f, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        f(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    print(f"{'samples':>10} {'import3d (s)':>14} {'SWCBuilder (s)':>16} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for depth in range(2, 9):
+            file = os.path.join(tmp, f"depth{depth}.swc")
+            n = generate_swc(file, branches=10, depth=depth)
+            t_import3d = timeit(import3d, file)
+            t_swc = timeit(swc_builder, file)
+            print(f"{n:>10} {t_import3d:>14.4f} {t_swc:>16.4f} {t_import3d / t_swc:>7.1f}x")
@@ -0,0 +1,81 @@
+"""
+    Generators of synthetic morphology files for the benchmarks.
+"""
+import numpy as np
+
+
+def generate_swc(file, branches=8, depth=4, samples=10, seed=0):
+    """
+        Write an SWC file with a 3 point soma, ``branches`` binary dendritic trees of
+        ``depth`` bifurcations and a short branching axon. Every unbranched stretch
+        consists of ``samples`` samples.
+
+        :returns: Number of samples written.
+    """
+    rng = np.random.default_rng(seed)
+    rows = [(1, 1, 0, 0, 0, 5, -1), (2, 1, 0, -5, 0, 5, 1), (3, 1, 0, 5, 0, 5, 1)]
+
+    def grow(parent, position, direction, depth, type, diameter):
+        for _ in range(samples):
+            position = position + direction * 5 + rng.normal(0, 0.5, 3)
+            rows.append((len(rows) + 1, type, *position, diameter / 2, parent))
+            parent = len(rows)
+        if depth > 0:
+            for _ in range(2):
+                d = direction + rng.normal(0, 0.3, 3)
+                grow(parent, position, d / np.linalg.norm(d), depth - 1, type, diameter * 0.8)
+
+    for _ in range(branches):
+        d = rng.normal(0, 1, 3)
+        grow(1, np.zeros(3), d / np.linalg.norm(d), depth, 3, 2.0)
+    grow(1, np.zeros(3), np.array([0.0, -1.0, 0.0]), 1, 2, 1.0)
+    with open(file, "w") as f:
+        for row in rows:
+            f.write("%d %d %.3f %.3f %.3f %.3f %d\n" % row)
+    return len(rows)
+
+
+def generate_asc(file, branches=8, depth=4, samples=10, seed=0):
+    """
+        Write a Neurolucida file with the same structure as :func:`generate_swc`: a
+        contour soma, ``branches`` binary dendritic trees of ``depth`` bifurcations and
+        a short branching axon, that NEURON's Import3D reads like the files of
+        :func:`arborize.morphology.load_morphology`.
+
+        :returns: Number of points written.
+    """
+    rng = np.random.default_rng(seed)
+    lines = ['("CellBody"', "  (Color Red)", "  (CellBody)"]
+    count = 0
+    for angle in np.linspace(0, 2 * np.pi, 8, endpoint=False):
+        lines.append("  ( %.3f %.3f 0.000 0.500)" % (5 * np.cos(angle), 5 * np.sin(angle)))
+        count += 1
+    lines.append(")")
+
+    def grow(position, direction, depth, diameter, indent):
+        nonlocal count
+        for _ in range(samples):
+            position = position + direction * 5 + rng.normal(0, 0.5, 3)
+            lines.append("%s( %.3f %.3f %.3f %.3f)" % (indent, *position, diameter))
+            count += 1
+        if depth > 0:
+            lines.append(indent + "(")
+            for i in range(2):
+                if i:
+                    lines.append(indent + "|")
+                d = direction + rng.normal(0, 0.3, 3)
+                grow(position, d / np.linalg.norm(d), depth - 1, diameter * 0.8, indent + "  ")
+            lines.append(indent + ")")
+
+    for _ in range(branches):
+        d = rng.normal(0, 1, 3)
+        d = d / np.linalg.norm(d)
+        lines += ["( (Color Green)", "  (Dendrite)"]
+        grow(d * 5, d, depth, 2.0, "  ")
+        lines.append(")")
+    lines += ["( (Color Blue)", "  (Axon)"]
+    grow(np.array([0.0, -5.0, 0.0]), np.array([0.0, -1.0, 0.0]), 1, 1.0, "  ")
+    lines.append(")")
+    with open(file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return count
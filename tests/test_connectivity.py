@@ -0,0 +1,66 @@
+import os, unittest
+import numpy as np
+from arborize import NeuronModel, connect_bulk, get_section_synapses, get_synapses
+from arborize.exceptions import AmbiguousSynapseError, SynapseNotPresentError
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+# Indices of the sections of the fixture in `cell.sections`.
+SOMA, DENDRITES, APIC = 0, list(range(1, 10)), list(range(16, 19))
+
+
+class Connected(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100}},
+        "dendrites": {"mechanisms": ["pas"], "attributes": {"Ra": 100}, "synapses": ["AMPA", "NMDA"]},
+        "apic": {"mechanisms": ["pas"], "attributes": {"Ra": 100}, "synapses": ["AMPA"]},
+    }
+    synapse_types = {
+        "AMPA": {"point_process": "ExpSyn", "attributes": {"tau": 2}},
+        "NMDA": {"point_process": "Exp2Syn", "attributes": {"tau2": 80}},
+    }
+
+
+class TestConnectBulk(unittest.TestCase):
+    def setUp(self):
+        self.cells = Connected.create_population(np.zeros((3, 3))).cells
+
+    def test_connect(self):
+        pre = [self.cells[0], self.cells[1], self.cells[1]]
+        post = [self.cells[2], self.cells[2], self.cells[0]]
+        sections = [DENDRITES[0], APIC[1], DENDRITES[4]]
+        synapses, netcons = connect_bulk(
+            pre, [SOMA] * 3, post, sections, ["NMDA", "AMPA", "AMPA"], weights=[0.1, 0.2, 0.3], delays=2,
+        )
+        self.assertEqual(len(synapses), 3)
+        self.assertEqual([s._type for s in synapses], ["NMDA", "AMPA", "AMPA"])
+        self.assertEqual(synapses[0].__neuron__().hname().split("[")[0], "Exp2Syn")
+        self.assertEqual(synapses[0].__neuron__().tau2, 80)
+        self.assertEqual(synapses[1].__neuron__().tau, 2)
+        for pre_cell, post_cell, section, synapse, netcon in zip(pre, post, sections, synapses, netcons):
+            nrn = netcon.__neuron__()
+            self.assertEqual(nrn.preseg().sec, pre_cell.soma[0].__neuron__())
+            self.assertEqual(nrn.syn(), synapse.__neuron__())
+            self.assertEqual(nrn.delay, 2)
+            self.assertIn(synapse, get_section_synapses(post_cell.sections[section]))
+        self.assertEqual([n.__neuron__().weight[0] for n in netcons], [0.1, 0.2, 0.3])
+        self.assertEqual(len(get_synapses(self.cells, "AMPA")), 2)
+        self.assertEqual(get_synapses(self.cells[2:], labels="apic"), [synapses[1]])
+
+    def test_single_type(self):
+        # Apical sections only have AMPA synapses, so the type can be omitted.
+        synapses, netcons = connect_bulk(self.cells[:1] * 2, [SOMA, SOMA], self.cells[1:], APIC[:2])
+        self.assertEqual([s._type for s in synapses], ["AMPA", "AMPA"])
+        self.assertEqual(len(netcons), 2)
+
+    def test_invalid_types(self):
+        with self.assertRaises(AmbiguousSynapseError):
+            connect_bulk(self.cells[:1], [SOMA], self.cells[1:2], [DENDRITES[0]])
+        with self.assertRaises(SynapseNotPresentError):
+            connect_bulk(self.cells[:1], [SOMA], self.cells[1:2], [APIC[0]], "NMDA")
+
+    def test_lengths(self):
+        with self.assertRaises(ValueError):
+            connect_bulk(self.cells[:2], [SOMA], self.cells[1:3], APIC[:2])
+        with self.assertRaises(ValueError):
+            connect_bulk(self.cells[:2], [SOMA, SOMA], self.cells[1:3], APIC[:2], "AMPA", weights=[1, 2, 3])
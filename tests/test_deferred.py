@@ -0,0 +1,99 @@
+import os, gc, unittest
+import numpy as np
+from patch import p
+import arborize
+from arborize import NeuronModel, SegmentParameter
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+class Eager(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100, "cm": 1, "ena": 55}},
+        "dendrites": {
+            "mechanisms": ["pas"],
+            "attributes": {"Ra": 150, ("g", "pas"): SegmentParameter(lambda s: 1e-5 + s.distance * 1e-8)},
+            "synapses": ["AMPA"],
+        },
+        "axon": {"mechanisms": ["hh"], "attributes": {"Ra": 100}},
+        "apic": {"mechanisms": ["pas"], "attributes": {"Ra": 200, "cm": 2}},
+    }
+    synapse_types = {"AMPA": {"point_process": "ExpSyn"}}
+    discretization = {"d_lambda": 0.1, "frequency": 100}
+
+    def boot(self):
+        self.booted = self.__dict__.get("booted", 0) + 1
+
+
+class Deferred(Eager):
+    deferred = True
+
+
+def _mechanisms(cell):
+    return [sorted(m.name() for m in seg) for s in cell.sections for seg in s.__neuron__()]
+
+
+def _state(cell):
+    # Discretization, mechanisms and parameters of every segment of a cell.
+    state = []
+    for section in cell.sections:
+        n = section.__neuron__()
+        state.append((tuple(section.labels), n.nseg, n.Ra))
+        for seg in n:
+            state.append((seg.cm, getattr(seg, "g_pas", None), getattr(seg, "ena", None)))
+    return state
+
+
+class TestDeferred(unittest.TestCase):
+    def test_plan(self):
+        # Deferred cells get their geometry, labels and synapse types, but no mechanisms.
+        cell = Deferred()
+        eager = Eager()
+        self.assertEqual([tuple(s.labels) for s in cell.sections], [tuple(s.labels) for s in eager.sections])
+        self.assertTrue(all(m == [] for m in _mechanisms(cell)))
+        self.assertEqual(len(cell._plan), len(cell.sections))
+        self.assertNotIn("booted", cell.__dict__)
+        synapse = cell.create_synapse(cell.dendrites[0])
+        self.assertEqual(synapse._type, "AMPA")
+        Deferred.materialize()
+
+    def test_materialize(self):
+        cells = Deferred.create_population(np.zeros((3, 3))).cells
+        eager = Eager()
+        Deferred.materialize()
+        for cell in cells:
+            self.assertIsNone(cell._plan)
+            self.assertEqual(cell.booted, 1)
+            self.assertEqual(_mechanisms(cell), _mechanisms(eager))
+            self.assertEqual(_state(cell), _state(eager))
+        # Materializing again doesn't touch the cells.
+        Deferred.materialize()
+        self.assertEqual([cell.booted for cell in cells], [1, 1, 1])
+
+    def test_override(self):
+        # Cells can be deferred per call, and eager cells of a deferred class.
+        cell, eager = Eager(deferred=True), Deferred(deferred=False)
+        self.assertIsNotNone(cell._plan)
+        self.assertIsNone(eager._plan)
+        self.assertEqual(_state(eager), _state(Eager()))
+        arborize.materialize()
+        self.assertEqual(_state(cell), _state(eager))
+
+    def test_finitialize(self):
+        # The deferred cells of all classes are materialized at the start of finitialize.
+        cell = Deferred()
+        other = Eager(deferred=True)
+        p.finitialize(-65)
+        self.assertIsNone(cell._plan)
+        self.assertIsNone(other._plan)
+        self.assertEqual(_mechanisms(cell), _mechanisms(other))
+
+    def test_collected(self):
+        # Deferred cells that were garbage collected are skipped.
+        cell = Deferred()
+        Deferred()
+        gc.collect()
+        Deferred.materialize()
+        self.assertEqual(cell.booted, 1)
+        self.assertEqual(Deferred._arbz_deferred, [])
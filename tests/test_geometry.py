@@ -0,0 +1,106 @@
+import os, unittest
+import numpy as np
+from patch import p
+from arborize import NeuronModel, SegmentParameter
+from arborize.exceptions import SectionAttributeError
+from arborize.geometry import SegmentProperties, discretize
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+class Graded(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100, ("gnabar", "hh"): SegmentParameter(lambda s: 0.2)}},
+        "dendrites": {
+            "mechanisms": ["pas", "hh"],
+            "attributes": {
+                "Ra": 100,
+                ("g", "pas"): SegmentParameter(lambda s: 1e-5 + s.distance * 1e-7),
+                ("gkbar", "hh"): SegmentParameter(lambda s: 0.01 * s.x),
+                ("gl", "hh"): 1e-4,
+            },
+        },
+        "apic": {"mechanisms": ["pas"], "attributes": {("g", "pas"): SegmentParameter(lambda s: 2e-5)}},
+        "thin": {"attributes": {("g", "pas"): SegmentParameter(lambda s: np.full(len(s), 3e-5))}},
+    }
+    labels = {"thin": {"from": "dendrites", "where": lambda s: s.diam < 1.8}}
+
+
+class TestSegmentParameter(unittest.TestCase):
+    def test_values(self):
+        cell = Graded()
+        origin = cell.soma[0].__neuron__()(0.5)
+        thick = [s for s in cell.dendrites if s not in cell.thin]
+        self.assertTrue(thick and all(s.nseg > 1 for s in thick))
+        for section in thick:
+            for seg in section.__neuron__():
+                self.assertAlmostEqual(seg.g_pas, 1e-5 + p.distance(origin, seg) * 1e-7)
+                self.assertAlmostEqual(seg.gkbar_hh, 0.01 * seg.x)
+                self.assertEqual(seg.gl_hh, 1e-4)
+        for section in cell.apic:
+            self.assertTrue(all(seg.g_pas == 2e-5 for seg in section.__neuron__()))
+        self.assertTrue(all(seg.gnabar_hh == 0.2 for seg in cell.soma[0].__neuron__()))
+
+    def test_override(self):
+        # The parameter of a later label overrides that of an earlier one.
+        cell = Graded()
+        self.assertTrue(cell.thin)
+        for section in cell.thin:
+            self.assertTrue(all(seg.g_pas == 3e-5 for seg in section.__neuron__()))
+            self.assertTrue(all(seg.gkbar_hh == 0.01 * seg.x for seg in section.__neuron__()))
+
+    def test_evaluate(self):
+        properties = SegmentProperties(np.array([0, 0, 1]), np.array([0.25, 0.75, 0.5]), np.ones(3), np.array([0, 10, 20.]))
+        np.testing.assert_array_equal(SegmentParameter(lambda s: 2).evaluate(properties), [2, 2, 2])
+        np.testing.assert_array_equal(SegmentParameter(lambda s: s.distance + s.x).evaluate(properties), [0.25, 10.75, 20.5])
+
+    def test_unknown_attribute(self):
+        class Unknown(NeuronModel):
+            morphologies = [FILE]
+            section_types = {"soma": {"attributes": {"unknown": SegmentParameter(lambda s: s.x)}}}
+
+        with self.assertRaises(SectionAttributeError):
+            Unknown()
+
+
+def _d_lambda(L, diam, Ra, cm, d_lambda, frequency):
+    # NEURON's d_lambda rule for a single cylindrical section.
+    lambda_f = 1e5 * (diam / (4 * np.pi * frequency * Ra * cm)) ** 0.5
+    return int((L / (d_lambda * lambda_f) + 0.9) / 2) * 2 + 1
+
+
+class TestDiscretize(unittest.TestCase):
+    def test_length(self):
+        np.testing.assert_array_equal(discretize([10, 40, 85, 0], [1] * 4, 100, 1), [1, 3, 5, 1])
+        np.testing.assert_array_equal(discretize([10, 40, 85], [1] * 3, 100, 1, length=10), [3, 9, 17])
+
+    def test_d_lambda(self):
+        rng = np.random.default_rng(0)
+        L, diam = rng.uniform(1, 500, 50), rng.uniform(0.2, 5, 50)
+        Ra, cm = rng.uniform(50, 200, 50), rng.uniform(0.5, 2, 50)
+        nseg = discretize(L, diam, Ra, cm, d_lambda=0.1, frequency=100)
+        expected = [_d_lambda(*args, 0.1, 100) for args in zip(L, diam, Ra, cm)]
+        np.testing.assert_array_equal(nseg, expected)
+        self.assertTrue(np.all(nseg % 2 == 1))
+
+    def test_max_nseg(self):
+        np.testing.assert_array_equal(discretize([10, 400], [1, 1], 100, 1, max_nseg=4), [1, 3])
+        np.testing.assert_array_equal(discretize([10, 400], [1, 1], 100, 1, max_nseg=5), [1, 5])
+
+    def test_model(self):
+        # The policy is evaluated with the attributes set by the section types, and
+        # segment parameters are set on the discretized segments.
+        model = type("Discretized", (Graded,), {"discretization": {"d_lambda": 0.05, "frequency": 1000}})
+        cell = model()
+        sections = [s.__neuron__() for s in cell.sections]
+        self.assertEqual(
+            [s.nseg for s in sections],
+            [_d_lambda(s.L, s.diam, s.Ra, s.cm, 0.05, 1000) for s in sections],
+        )
+        self.assertGreater(cell.compartment_count, Graded().compartment_count)
+        origin = sections[0](0.5)
+        for section in cell.dendrites:
+            if section not in cell.thin:
+                for seg in section.__neuron__():
+                    self.assertAlmostEqual(seg.g_pas, 1e-5 + p.distance(origin, seg) * 1e-7)
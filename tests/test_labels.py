@@ -0,0 +1,117 @@
+import os, unittest
+from patch import p
+from arborize import NeuronModel, LabelSet
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+class Labelled(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas"]},
+        "dendrites": {"mechanisms": ["pas"]},
+        "apic": {"mechanisms": ["pas"]},
+        "even": {},
+        "tagged": {},
+    }
+    labels = {"even": {"from": "dendrites", "id": lambda id: id % 2 == 0}}
+
+
+def _scan(cell, label):
+    return [s for s in cell.sections if label in s.labels]
+
+
+class TestLabelIndex(unittest.TestCase):
+    def test_lookup(self):
+        cell = Labelled()
+        for label in ("soma", "dendrites", "axon", "apic", "even", "tagged"):
+            self.assertEqual(getattr(cell, label), _scan(cell, label), label)
+        self.assertEqual([len(cell.soma), len(cell.dendrites), len(cell.apic), len(cell.even)], [1, 9, 3, 5])
+        self.assertEqual(cell.tagged, [])
+
+    def test_shared(self):
+        # Cells of the same morphology share their index until their labels change.
+        a, b = Labelled(), Labelled()
+        self.assertIs(a._label_index, b._label_index)
+        a.dendrites[1].labels.add("tagged")
+        self.assertIsNot(a._label_index, b._label_index)
+        self.assertEqual(a.tagged, [a.dendrites[1]])
+        self.assertEqual(b.tagged, [])
+        self.assertEqual(Labelled().tagged, [])
+
+    def test_changes(self):
+        cell = Labelled()
+        dendrites = cell.dendrites
+        for i in (6, 2, 4):
+            dendrites[i].labels.add("tagged")
+        self.assertEqual(cell.tagged, [dendrites[2], dendrites[4], dendrites[6]])
+        dendrites[4].labels.remove("tagged")
+        dendrites[0].labels.remove("even")
+        self.assertEqual(cell.tagged, _scan(cell, "tagged"))
+        self.assertEqual(cell.even, _scan(cell, "even"))
+        self.assertEqual(len(cell.even), 4)
+
+
+class TestLabelSet(unittest.TestCase):
+    def test_order(self):
+        labels = LabelSet(["dendrites", "even"])
+        labels.add("even")
+        labels.insert(0, "first")
+        labels.append("last")
+        self.assertEqual(list(labels), ["first", "dendrites", "even", "last"])
+        self.assertEqual(labels, ["first", "dendrites", "even", "last"])
+        self.assertEqual(labels[1], "dendrites")
+        self.assertIn("even", labels)
+        labels.remove("even")
+        self.assertEqual(len(labels), 3)
+        with self.assertRaises(KeyError):
+            labels.remove("even")
+
+
+def _branch_order(section):
+    # Number of sections between a section and the root.
+    order, parent = 0, section.parentseg()
+    while parent is not None:
+        order, parent = order + 1, parent.sec.parentseg()
+    return order
+
+
+class Predicated(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas"]},
+        "dendrites": {"mechanisms": ["pas"]},
+        "apic": {"mechanisms": ["pas"]},
+        "thin": {"mechanisms": ["hh"]},
+        "proximal": {},
+        "odd": {},
+        "long": {},
+    }
+    labels = {
+        "thin": {"from": "dendrites", "where": lambda s: s.diam < 1.8},
+        "proximal": {"from": "apic", "where": lambda s: (s.branch_order == 1) & (s.distance < 30)},
+        "odd": {"from": "axon", "where": lambda s: s.ids % 2 == 1},
+        "long": {"from": "axon", "where": lambda s: s.L > 50},
+    }
+
+
+class TestWhereLabels(unittest.TestCase):
+    def test_predicates(self):
+        cell = Predicated()
+        origin = cell.soma[0].__neuron__()(0.5)
+        self.assertEqual(cell.thin, [s for s in cell.dendrites if s.__neuron__()(0.5).diam < 1.8])
+        self.assertEqual(len(cell.thin), 6)
+        self.assertEqual(cell.proximal, [
+            s for s in cell.apic
+            if _branch_order(s.__neuron__()) == 1 and p.distance(origin, s.__neuron__()(0.5)) < 30
+        ])
+        self.assertEqual(len(cell.proximal), 1)
+        self.assertEqual(cell.odd, cell.axon[1::2])
+        self.assertEqual(cell.long, [s for s in cell.axon if s.__neuron__().L > 50])
+
+    def test_section_types(self):
+        # Sections selected by a predicate get the definitions of the label.
+        cell = Predicated()
+        for section in cell.dendrites:
+            mechanisms = {m.name() for m in section.__neuron__()(0.5)}
+            self.assertEqual("hh" in mechanisms, section in cell.thin)
@@ -0,0 +1,80 @@
+import os, shutil, tempfile, unittest
+import numpy as np
+import arborize.morphology
+from arborize import NeuronModel
+from arborize.core import import3d
+from arborize.morphology import SECTION_TYPES, Morphology, load_morphology, clear_cache, _read_pt3d
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+def _topology(cell):
+    # Labels, parent index and connection points of each section of a cell.
+    index = {s.__neuron__(): i for i, s in enumerate(cell.sections)}
+    topology = []
+    for section in cell.sections:
+        parent = section.__neuron__().parentseg()
+        if parent is None:
+            topology.append((tuple(section.labels), -1, None))
+        else:
+            topology.append((tuple(section.labels), index[parent.sec], parent.x))
+    return topology
+
+
+class TestCachedGeometry(unittest.TestCase):
+    def setUp(self):
+        self._cache_directory = arborize.morphology.cache_directory
+        self.tmp = tempfile.mkdtemp()
+        arborize.morphology.cache_directory = self.tmp
+        clear_cache()
+
+    def tearDown(self):
+        arborize.morphology.cache_directory = self._cache_directory
+        clear_cache()
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _models(self):
+        class Cached(NeuronModel):
+            morphologies = [FILE]
+
+        class Imported(NeuronModel):
+            morphologies = [lambda model: import3d(FILE, model)]
+
+        return Cached, Imported
+
+    def assertSameGeometry(self, a, b):
+        self.assertEqual(len(a.sections), len(b.sections))
+        self.assertEqual(_topology(a), _topology(b))
+        for sa, sb in zip(a.sections, b.sections):
+            pa, da = _read_pt3d(sa)
+            pb, db = _read_pt3d(sb)
+            np.testing.assert_allclose(pa, pb)
+            np.testing.assert_allclose(da, db)
+            self.assertEqual(sa.nseg, sb.nseg)
+
+    def test_import3d_equivalence(self):
+        cached, imported = self._models()
+        a, b = cached(), imported()
+        self.assertSameGeometry(a, b)
+        self.assertEqual([len(a.soma), len(a.dendrites), len(a.axon), len(a.apic)], [1, 9, 6, 3])
+        self.assertTrue(all("apic" in s.labels for s in a.apic))
+
+    def test_disk_cache_equivalence(self):
+        # The second load memory maps the arrays written by the first.
+        first = load_morphology(FILE)
+        clear_cache()
+        second = load_morphology(FILE)
+        self.assertIsInstance(second.points, np.memmap)
+        for name in ("points", "diameters", "offsets", "types", "parents", "parent_x", "child_x"):
+            np.testing.assert_array_equal(getattr(first, name), getattr(second, name))
+        self.assertIn(SECTION_TYPES.index("apic"), second.types.tolist())
+
+    def test_from_sections_roundtrip(self):
+        morphology = load_morphology(FILE)
+        cached, _ = self._models()
+        cell = cached()
+        types = [SECTION_TYPES.index(s.labels[0] if s.labels[0] != "dendrites" else "dend") for s in cell.sections]
+        read = Morphology.from_sections(cell.sections, types)
+        np.testing.assert_allclose(read.points, morphology.points)
+        np.testing.assert_array_equal(read.types, morphology.types)
+        np.testing.assert_array_equal(read.parents, morphology.parents)
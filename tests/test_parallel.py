@@ -0,0 +1,126 @@
+import os, unittest
+import numpy as np
+from patch import p
+from arborize import NeuronModel, partition, register_transmitters, register_receivers, get_receivers
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+def _model(deferred):
+    return type("Deferred" if deferred else "Eager", (NeuronModel,), {
+        "morphologies": [FILE],
+        "section_types": {
+            "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100, "cm": 1}},
+            "dendrites": {"mechanisms": ["pas"], "attributes": {"Ra": 100, "cm": 1}},
+            "axon": {"mechanisms": ["hh"], "attributes": {"Ra": 100}},
+            "apic": {"mechanisms": ["pas"], "attributes": {"Ra": 200, "cm": 2}},
+        },
+        "discretization": {"d_lambda": 0.1, "frequency": 100},
+        "mechanism_costs": {"hh": 5},
+        "deferred": deferred,
+    })
+
+
+class Networked(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100, "cm": 1}},
+        "dendrites": {"mechanisms": ["pas"], "attributes": {"Ra": 100}, "synapses": ["AMPA", "NMDA"]},
+        "apic": {"mechanisms": ["pas"], "attributes": {"Ra": 100}, "synapses": ["AMPA"]},
+    }
+    synapse_types = {"AMPA": {"point_process": "ExpSyn"}, "NMDA": {"point_process": "Exp2Syn"}}
+
+
+class TestCost(unittest.TestCase):
+    def test_deferred_estimate(self):
+        # The estimate of a deferred class uses the nseg set by the discretization.
+        eager, deferred = _model(False), _model(True)
+        expected = eager().cost
+        self.assertEqual(deferred.estimate_cost(), expected)
+        self.assertEqual(eager.estimate_cost(), expected)
+        cell = deferred()
+        deferred.materialize()
+        self.assertEqual(cell.cost, expected)
+
+
+class TestPartition(unittest.TestCase):
+    def assertBalanced(self, costs, ranks):
+        costs = np.asarray(costs, dtype=float)
+        assignment = partition(costs, ranks)
+        self.assertEqual(assignment.shape, costs.shape)
+        self.assertTrue(np.all((assignment >= 0) & (assignment < ranks)))
+        loads = np.bincount(assignment, weights=costs, minlength=ranks)
+        self.assertAlmostEqual(loads.sum(), costs.sum())
+        # Bound of the longest processing time rule.
+        self.assertLessEqual(loads.max(), costs.sum() / ranks + costs.max())
+        return loads
+
+    def test_equal_costs(self):
+        loads = self.assertBalanced(np.ones(100), 8)
+        self.assertLessEqual(loads.max() - loads.min(), 1)
+
+    def test_random_costs(self):
+        rng = np.random.default_rng(0)
+        for ranks in (1, 3, 16):
+            loads = self.assertBalanced(rng.lognormal(0, 1, 1000), ranks)
+            self.assertLess(loads.max() / loads.mean(), 1.01)
+
+    def test_heavy_item(self):
+        # An item heavier than the rest together gets a rank of its own.
+        costs = [100] + [1] * 10
+        assignment = partition(costs, 2)
+        self.assertNotIn(assignment[0], assignment[1:])
+
+    def test_more_ranks_than_items(self):
+        assignment = partition([3, 2, 1], 5)
+        self.assertEqual(len(set(assignment.tolist())), 3)
+
+    def test_cell_costs(self):
+        model = _model(False)
+        costs = [model.estimate_cost()] * 7 + [model.estimate_cost() / 2] * 6
+        loads = self.assertBalanced(costs, 4)
+        self.assertLessEqual(loads.max() - loads.min(), model.estimate_cost())
+
+
+class TestRegistration(unittest.TestCase):
+    # GIDs are global to the process, so every test uses its own range.
+    offset = 3 * 10 ** 6
+
+    def test_register(self):
+        cells = Networked.create_population(np.zeros((3, 3))).cells
+        gids = self.offset + np.arange(3)
+        self.assertEqual(register_transmitters(cells, gids)["transmitters"], 3)
+        # Registering the same sections again creates no transmitters.
+        self.assertEqual(register_transmitters(cells, gids)["transmitters"], 0)
+        pc = p.parallel.__neuron__()
+        self.assertTrue(all(pc.gid_exists(int(gid)) for gid in gids))
+        self.assertEqual(cells[1].create_transmitter(cells[1].soma[0], int(gids[1]))["gid"], gids[1])
+
+        report = register_receivers([cells[1], cells[2], cells[2]], [1, 16, 3], gids[[0, 0, 1]], ["NMDA", "AMPA", "AMPA"])
+        self.assertEqual(report["receivers"], 3)
+        receivers = get_receivers(cells)
+        self.assertEqual([r["gid"] for r in receivers], gids[[0, 0, 1]].tolist())
+        self.assertEqual([r["type"] for r in receivers], ["NMDA", "AMPA", "AMPA"])
+        self.assertEqual([r["receiver"].__neuron__().srcgid() for r in receivers], gids[[0, 0, 1]].tolist())
+        self.assertEqual(get_receivers(cells[2:], labels="apic")[0]["synapse"].__neuron__().hname().split("[")[0], "ExpSyn")
+
+        # A spike of the first cell reaches the synapses that listen to its gid.
+        for receiver in receivers:
+            receiver["receiver"].__neuron__().weight[0] = 0.01
+        clamp = p.IClamp(cells[0].soma[0].__neuron__()(0.5))
+        clamp.delay, clamp.dur, clamp.amp = 1, 2, 5
+        conductances = [p.record(r["synapse"].__neuron__()._ref_g) for r in receivers]
+        pc.set_maxstep(10)
+        p.finitialize(-65)
+        pc.psolve(10)
+        peaks = [max(g) for g in conductances]
+        self.assertGreater(peaks[0], 0)
+        self.assertGreater(peaks[1], 0)
+        self.assertEqual(peaks[2], 0)
+
+    def test_lengths(self):
+        cells = Networked.create_population(np.zeros((2, 3))).cells
+        with self.assertRaises(ValueError):
+            register_transmitters(cells, [self.offset + 10])
+        with self.assertRaises(ValueError):
+            register_receivers(cells, [1], [self.offset, self.offset], "AMPA")
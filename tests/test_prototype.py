@@ -0,0 +1,109 @@
+import os, unittest
+import numpy as np
+from arborize import NeuronModel
+from arborize.builders import TransformBuilder
+from arborize.core import import3d
+from arborize.morphology import _read_pt3d
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+SECTION_TYPES = {
+    "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100}},
+    "dendrites": {"mechanisms": ["pas"], "attributes": {"Ra": 150}},
+    "axon": {"mechanisms": ["hh"]},
+    "apic": {"mechanisms": ["pas"], "attributes": {"cm": 2}},
+    "thick": {"attributes": {("g", "pas"): 2e-4}},
+}
+LABELS = {"thick": {"from": "dendrites", "where": lambda s: s.diam > 1.8}}
+
+
+def _model(name, morphology, prototype):
+    return type(name, (NeuronModel,), {
+        "morphologies": [morphology],
+        "section_types": SECTION_TYPES,
+        "labels": LABELS,
+        "prototype_geometry": prototype,
+    })
+
+
+def _counted(calls):
+    def build(model):
+        calls.append(model)
+        import3d(FILE, model)
+
+    return build
+
+
+def _geometry(cell):
+    # Labels, topology, nseg and mechanisms of every section of a cell, and its 3D points.
+    index = {s.__neuron__(): i for i, s in enumerate(cell.sections)}
+    geometry, points = [], []
+    for section in cell.sections:
+        n = section.__neuron__()
+        parent = n.parentseg()
+        xyz, diameters = _read_pt3d(n)
+        geometry.append((
+            tuple(section.labels), None if parent is None else (index[parent.sec], parent.x), n.nseg,
+            diameters.tolist(), [sorted(m.name() for m in seg) for seg in n],
+            n(0.5).cm, n.Ra, getattr(n(0.5), "g_pas", None),
+        ))
+        points.append(xyz)
+    return geometry, np.concatenate(points)
+
+
+class TestPrototype(unittest.TestCase):
+    def assertSameCell(self, a, b):
+        (geometry_a, points_a), (geometry_b, points_b) = _geometry(a), _geometry(b)
+        self.assertEqual(geometry_a, geometry_b)
+        # Translated points are only equal up to the precision of NEURON's 3D points.
+        np.testing.assert_allclose(points_a, points_b, atol=1e-4)
+
+    def test_builder_calls(self):
+        # Only the first cell of a morphology is built by its builders.
+        calls, reference_calls = [], []
+        prototyped = _model("Prototyped", _counted(calls), True)
+        reference = _model("Reference", _counted(reference_calls), False)
+        cells = [prototyped() for _ in range(3)]
+        self.assertEqual(len(calls), 1)
+        self.assertIsNotNone(prototyped._arbz_prototypes[0])
+        expected = reference()
+        self.assertEqual(len(expected.sections), 19)
+        for cell in cells:
+            self.assertSameCell(cell, expected)
+
+    def test_translated(self):
+        # Prototypes of translating pipelines follow the position of each cell.
+        pipeline = (FILE, TransformBuilder(translate=True))
+        prototyped = _model("TranslatedPrototype", pipeline, True)
+        reference = _model("TranslatedReference", pipeline, False)
+        prototyped(position=[1.0, 2.0, 3.0])
+        for position in ([10.0, 0.0, -5.0], [0.0, 100.0, 0.0]):
+            cell = prototyped(position=position)
+            self.assertSameCell(cell, reference(position=position))
+        points, _ = _read_pt3d(cell.soma[0].__neuron__())
+        self.assertGreater(points[:, 1].mean(), 50)
+
+    def test_untranslatable(self):
+        # A translation followed by other builders can't be prototyped.
+        calls = []
+        pipeline = (_counted(calls), TransformBuilder(translate=True), TransformBuilder(scale=2))
+        model = _model("Untranslatable", pipeline, True)
+        model(), model()
+        self.assertIsNone(model._arbz_prototypes[0])
+        self.assertEqual(len(calls), 2)
+
+    def test_rotation(self):
+        # Rotated cells are always built by their builders.
+        calls = []
+        model = _model("RotatedPrototype", _counted(calls), True)
+        model()
+        model(rotation=np.diag([1.0, -1.0, -1.0]))
+        self.assertEqual(len(calls), 2)
+
+    def test_labels(self):
+        # Label changes of a cell don't change the prototype.
+        model = _model("LabelledPrototype", FILE, True)
+        first = model()
+        first.dendrites[0].labels.add("extra")
+        second = model()
+        self.assertNotIn("extra", second.dendrites[0].labels)
+        self.assertEqual(second.thick, [s for s in second.dendrites if "thick" in s.labels])
@@ -0,0 +1,58 @@
+import os, shutil, tempfile, unittest
+import numpy as np
+from patch import p
+from arborize import NeuronModel, PopulationRecorder, StreamingRecorder, StreamReader
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+class Recorded(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100, "cm": 1}},
+        "dendrites": {"mechanisms": ["pas"], "attributes": {"Ra": 100, "cm": 1}},
+        "axon": {"mechanisms": ["hh"], "attributes": {"Ra": 100}},
+        "apic": {"mechanisms": ["pas"], "attributes": {"Ra": 100, "cm": 1}},
+    }
+
+
+class TestStreamingRecorder(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cells = Recorded.create_population(np.zeros((3, 3))).cells
+        self.clamps = []
+        for i, cell in enumerate(self.cells):
+            clamp = p.IClamp(cell.soma[0].__neuron__()(0.5))
+            clamp.delay, clamp.dur, clamp.amp = 1, 20, 0.5 * (i + 1)
+            self.clamps.append(clamp)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def _run(self, dt):
+        memory = PopulationRecorder.soma(self.cells, dt=dt, tstop=30)
+        stream = StreamingRecorder.soma(self.tmp, self.cells, dt=dt, interval=7)
+        p.finitialize(-65)
+        stream.run(30)
+        return memory, StreamReader(self.tmp)
+
+    def assertSameRecording(self, memory, reader):
+        self.assertEqual(len(reader), len(memory))
+        self.assertEqual(reader.samples, memory.to_array().shape[1])
+        np.testing.assert_array_equal(reader.time(), memory.time)
+        np.testing.assert_array_equal(reader.read(), memory.to_array())
+        # The clamps depolarize the cells, so the traces are not trivially equal.
+        self.assertTrue(np.all(np.ptp(memory.to_array(), axis=1) > 1))
+
+    def test_every_step(self):
+        self.assertSameRecording(*self._run(None))
+
+    def test_sampled(self):
+        self.assertSameRecording(*self._run(0.1))
+
+    def test_window(self):
+        memory, reader = self._run(None)
+        time = memory.time
+        mask = (time >= 5) & (time <= 16)
+        np.testing.assert_array_equal(reader.read(targets=1, start=5, stop=16), memory.to_array()[1, mask])
+        np.testing.assert_array_equal(reader.time(5, 16), time[mask])
@@ -0,0 +1,184 @@
+import os, json, unittest
+import numpy as np
+from arborize import NeuronModel
+from arborize.builders import SimplifyBuilder, simplify_morphology
+from arborize.builders.simplification import _merge_chains, _reduce_subtrees
+from arborize.core import _morphology_labels
+from arborize.geometry import SectionProperties
+from arborize.morphology import SECTION_TYPES, Morphology, load_morphology
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+def _morphology(sections):
+    # Morphology of (type, parent, parent_x, points, diameter) sections.
+    points = [np.asarray(s[3], dtype=float) for s in sections]
+    offsets = np.concatenate(([0], np.cumsum([len(p) for p in points])))
+    return Morphology(
+        np.concatenate(points), np.concatenate([np.full(len(p), s[4], dtype=float) for s, p in zip(sections, points)]),
+        offsets, np.array([SECTION_TYPES.index(s[0]) for s in sections]), np.array([s[1] for s in sections]),
+        np.array([s[2] for s in sections], dtype=float), np.zeros(len(sections)),
+    )
+
+
+def _line(start, end, n=3):
+    return np.linspace(start, end, n)
+
+
+SOMA = ("soma", -1, 0, _line([-5, 0, 0], [5, 0, 0]), 10)
+
+
+def _chain(length):
+    # A soma with a chain of 3 dendrites and a child off the middle of the last one.
+    return _morphology([
+        SOMA,
+        ("dend", 0, 0.5, _line([5, 0, 0], [5 + length, 0, 0]), 2),
+        ("dend", 1, 1, _line([5 + length, 0, 0], [5 + 2 * length, 0, 0]), 2),
+        ("dend", 2, 1, _line([5 + 2 * length, 0, 0], [5 + 3 * length, 0, 0]), 2),
+        ("dend", 3, 0.5, _line([5 + 2.5 * length, 0, 0], [5 + 2.5 * length, 10, 0]), 1),
+    ])
+
+
+def _default_nseg(L, diam, keys):
+    return 1 + 2 * (np.asarray(L) // 40).astype(int)
+
+
+def _area(morphology):
+    properties = SectionProperties.from_morphology(morphology)
+    return np.sum(np.pi * properties.diam * properties.L)
+
+
+def _rall(child_diameter=4 / 2 ** (2 / 3), child_lengths=(20, 20)):
+    # A dendrite that branches into 2 children, that satisfy the 3/2 power rule by
+    # default.
+    return _morphology([
+        SOMA,
+        ("dend", 0, 0.5, _line([5, 0, 0], [25, 0, 0]), 4),
+        ("dend", 1, 1, _line([25, 0, 0], [25 + child_lengths[0], 0, 0]), child_diameter),
+        ("dend", 1, 1, _line([25, 0, 0], [25, child_lengths[1], 0]), child_diameter),
+    ])
+
+
+class TestMergeChains(unittest.TestCase):
+    def test_chain(self):
+        morphology = _chain(10)
+        merged, new_index, count = _merge_chains(morphology, np.zeros(5, dtype=int), np.zeros(5, dtype=bool))
+        self.assertEqual(count, 2)
+        np.testing.assert_array_equal(new_index, [0, 1, 1, 1, 2])
+        self.assertEqual(len(merged), 3)
+        # The repeated first points of the merged sections are dropped.
+        points, _ = merged.section_points(1)
+        np.testing.assert_allclose(points[:, 0], [5, 10, 15, 20, 25, 30, 35])
+        np.testing.assert_array_equal(merged.parents, [-1, 0, 1])
+        # The child is moved to the same location on the merged section.
+        np.testing.assert_allclose(merged.parent_x, [0, 0.5, 25 / 30])
+
+    def test_keys(self):
+        # Sections with other labels, or excluded sections, aren't merged.
+        morphology = _chain(10)
+        _, new_index, _ = _merge_chains(morphology, np.array([0, 0, 0, 1, 1]), np.zeros(5, dtype=bool))
+        np.testing.assert_array_equal(new_index, [0, 1, 1, 2, 3])
+        _, new_index, _ = _merge_chains(morphology, np.zeros(5, dtype=int), np.array([0, 1, 0, 0, 0], dtype=bool))
+        np.testing.assert_array_equal(new_index, [0, 1, 2, 2, 3])
+
+    def test_compartments(self):
+        # Chains are only merged as far as that doesn't add segments.
+        for length, expected in ((10, [0, 1, 1, 1, 2]), (30, [0, 1, 2, 3, 4])):
+            morphology = _chain(length)
+            keys, excluded = np.zeros(5, dtype=int), np.zeros(5, dtype=bool)
+            merged, new_index, _ = _merge_chains(morphology, keys, excluded, _default_nseg)
+            np.testing.assert_array_equal(new_index, expected)
+            before = _default_nseg(SectionProperties.from_morphology(morphology).L, None, None).sum()
+            after = _default_nseg(SectionProperties.from_morphology(merged).L, None, None).sum()
+            self.assertLessEqual(after, before)
+
+
+class TestReduceSubtrees(unittest.TestCase):
+    def test_reduced(self):
+        morphology = _rall()
+        reduced, index, count = _reduce_subtrees(morphology, np.zeros(4, dtype=int), np.zeros(4, dtype=bool), 1, 0.05)
+        self.assertEqual(count, 1)
+        np.testing.assert_array_equal(index, [0, 1, 1, 1])
+        self.assertEqual(len(reduced), 2)
+        points, diameters = reduced.section_points(1)
+        np.testing.assert_array_equal(diameters, [4, 4])
+        # The electrotonic length and membrane area of the subtree are preserved.
+        expected = 20 + 20 * (4 / (4 / 2 ** (2 / 3))) ** 0.5
+        self.assertAlmostEqual(np.linalg.norm(points[1] - points[0]), expected)
+        self.assertAlmostEqual(_area(reduced), _area(morphology))
+
+    def test_not_reduced(self):
+        keys, excluded = np.zeros(4, dtype=int), np.zeros(4, dtype=bool)
+        for morphology in (_rall(child_diameter=1), _rall(child_lengths=(20, 40))):
+            reduced, index, count = _reduce_subtrees(morphology, keys, excluded, 1, 0.05)
+            self.assertEqual((count, len(reduced)), (0, 4))
+            np.testing.assert_array_equal(index, np.arange(4))
+        # Subtrees with other labels aren't reduced.
+        _, _, count = _reduce_subtrees(_rall(), np.array([0, 0, 0, 1]), excluded, 1, 0.05)
+        self.assertEqual(count, 0)
+        # Subtrees from a higher order only contain single sections.
+        _, _, count = _reduce_subtrees(_rall(), keys, excluded, 2, 0.05)
+        self.assertEqual(count, 0)
+
+
+class Labelled(NeuronModel):
+    morphologies = [FILE]
+    section_types = {"soma": {}, "dendrites": {}, "axon": {}, "apic": {}, "thick": {}}
+    labels = {"thick": {"from": "dendrites", "where": lambda s: s.diam > 1.8}}
+
+
+class TestSimplifyMorphology(unittest.TestCase):
+    def test_report(self):
+        morphology = load_morphology(FILE)
+        simplified, report = simplify_morphology(morphology)
+        self.assertEqual(report.sections_before, 19)
+        self.assertEqual(report.sections_after, len(simplified))
+        self.assertEqual(report.sections_before - report.merged, report.sections_after)
+        self.assertLessEqual(report.compartments_after, report.compartments_before)
+        self.assertEqual(json.loads(json.dumps(report.to_dict()))["merged"], report.merged)
+        unchanged, report = simplify_morphology(morphology, merge_chains=False)
+        self.assertEqual((len(unchanged), report.merged, report.reduced), (19, 0, 0))
+
+    def test_labels(self):
+        # Merged sections keep their labels, and the length of each label is preserved.
+        morphology = load_morphology(FILE)
+        simplified, report = simplify_morphology(morphology, Labelled)
+        self.assertEqual(report.label_changes, 0)
+        for label in ("dendrites", "thick"):
+            lengths = []
+            for m in (morphology, simplified):
+                L = SectionProperties.from_morphology(m).L
+                lengths.append(sum(l for l, labels in zip(L, _morphology_labels(m, Labelled)) if label in labels))
+            self.assertAlmostEqual(*lengths, places=3)
+
+    def test_reduce(self):
+        simplified, report = simplify_morphology(_rall(), merge_chains=False, reduce_order=1)
+        self.assertEqual((report.reduced, len(simplified)), (1, 2))
+        _, report = simplify_morphology(_rall(child_diameter=3), merge_chains=False, reduce_order=1)
+        self.assertEqual(report.reduced, 0)
+        _, report = simplify_morphology(_rall(child_diameter=3), merge_chains=False, reduce_order=1, tolerance=0.5)
+        self.assertEqual(report.reduced, 1)
+
+
+class TestSimplifyBuilder(unittest.TestCase):
+    def test_arrays(self):
+        builder = SimplifyBuilder()
+        model = type("Simplified", (NeuronModel,), {"morphologies": [(_chain(10), builder)]})
+        cell = model()
+        model()
+        self.assertEqual(len(builder.reports), 1)
+        report = builder.reports[0]
+        self.assertEqual((len(cell.sections), report.merged), (3, 2))
+        self.assertEqual(cell.compartment_count, report.compartments_after)
+
+    def test_sections(self):
+        # Sections created by a builder function are replaced by the simplified ones.
+        builder = SimplifyBuilder()
+        model = type("SimplifiedSections", (NeuronModel,), {"morphologies": [(lambda m: _chain(10).instantiate(m), builder)]})
+        cell = model()
+        self.assertEqual(len(builder.reports), 1)
+        self.assertEqual(len(cell.sections), 3)
+        self.assertAlmostEqual(cell.dendrites[0].__neuron__().L, 30, places=4)
+        parent = cell.dendrites[1].__neuron__().parentseg()
+        self.assertEqual(parent.sec, cell.dendrites[0].__neuron__())
+        self.assertAlmostEqual(parent.x, 25 / 30, places=4)
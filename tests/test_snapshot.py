@@ -0,0 +1,81 @@
+import os, shutil, tempfile, unittest
+import numpy as np
+from arborize import NeuronModel, SegmentParameter, connect_bulk, get_synapses, save_snapshot, load_snapshot
+from arborize.morphology import _read_pt3d
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+class Snapshotted(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas", "hh"], "attributes": {"Ra": 100, "cm": 1, "ena": 55}},
+        "dendrites": {
+            "mechanisms": ["pas"],
+            "attributes": {
+                "Ra": 100,
+                ("g", "pas"): SegmentParameter(lambda s: 1e-5 + s.distance * 1e-8),
+            },
+            "synapses": ["AMPA"],
+        },
+        "axon": {"mechanisms": ["hh"], "attributes": {"Ra": 100}},
+        "apic": {"mechanisms": ["pas"], "attributes": {"Ra": 200, "cm": 2}, "synapses": ["AMPA"]},
+    }
+    synapse_types = {"AMPA": {"point_process": "ExpSyn", "attributes": {"tau": 3}}}
+
+
+def _state(cells):
+    # Geometry, labels and parameters of every segment of the cells.
+    state = []
+    for cell in cells:
+        for section in cell.sections:
+            n = section.__neuron__()
+            points, diameters = _read_pt3d(n)
+            state.append((tuple(section.labels), n.nseg, n.Ra, points.tolist(), diameters.tolist()))
+            for seg in n:
+                state.append((
+                    seg.cm, seg.diam, sorted(m.name() for m in seg),
+                    getattr(seg, "g_pas", None), getattr(seg, "e_pas", None),
+                    getattr(seg, "ena", None), getattr(seg, "gnabar_hh", None),
+                ))
+    return state
+
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_roundtrip(self):
+        population = Snapshotted.create_population(np.arange(12).reshape(4, 3) * 100.0)
+        cells = population.cells
+        synapses, netcons = connect_bulk(cells[:2], [0, 0], cells[2:], [3, 3], "AMPA", weights=0.5, delays=2)
+        synapses[0].__neuron__().tau = 7
+        cells[1].dendrites[2].__neuron__()(0.5).e_pas = -80
+        save_snapshot(population, self.tmp, netcons=netcons)
+
+        restored, restored_netcons = load_snapshot(self.tmp, Snapshotted)
+        self.assertEqual(len(restored), len(cells))
+        self.assertEqual(_state(restored), _state(cells))
+        np.testing.assert_array_equal(restored.positions, population.positions)
+        self.assertEqual(
+            [[s.__neuron__().tau for s in get_synapses([cell])] for cell in restored],
+            [[s.__neuron__().tau for s in get_synapses([cell])] for cell in cells],
+        )
+        self.assertEqual(len(restored_netcons), len(netcons))
+        netcon = restored_netcons[0].__neuron__()
+        self.assertEqual((netcon.weight[0], netcon.delay), (0.5, 2))
+        self.assertEqual(netcon.preseg().sec, restored[0].sections[0].__neuron__())
+        self.assertEqual(restored[0].cost, cells[0].cost)
+
+    def test_wrong_model(self):
+        population = Snapshotted.create_population(np.zeros((1, 3)))
+        save_snapshot(population, self.tmp)
+
+        class Other(Snapshotted):
+            pass
+
+        with self.assertRaises(ValueError):
+            load_snapshot(self.tmp, Other)
@@ -0,0 +1,97 @@
+import os, unittest
+import numpy as np
+from arborize import NeuronModel, get_section_synapses, get_section_receivers, get_synapses, get_receivers
+from arborize.tables import Table
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+class Queried(NeuronModel):
+    morphologies = [FILE]
+    section_types = {
+        "soma": {"mechanisms": ["pas"]},
+        "dendrites": {"mechanisms": ["pas"], "synapses": ["AMPA", "NMDA"]},
+        "apic": {"mechanisms": ["pas"], "synapses": ["AMPA"]},
+    }
+    synapse_types = {"AMPA": {"point_process": "ExpSyn"}, "NMDA": {"point_process": "Exp2Syn"}}
+
+
+class TestTable(unittest.TestCase):
+    def test_columns(self):
+        table = Table({"a": np.int32, "b": np.float64, "c": None})
+        for i in range(10):
+            self.assertEqual(table.append(i % 3, i / 2, str(i)), i)
+        self.assertEqual(len(table), 10)
+        np.testing.assert_array_equal(table["a"], np.arange(10) % 3)
+        self.assertEqual(table["c"][4], "4")
+        self.assertEqual(table.get("b", 3), 1.5)
+        self.assertIsInstance(table.get("a", 3), int)
+        table.set("c", 4, "four")
+        self.assertEqual(table.get("c", 4), "four")
+
+    def test_rows(self):
+        table = Table({"a": np.int32, "b": np.int64})
+        for i in range(12):
+            table.append(i % 4, i // 4)
+        np.testing.assert_array_equal(table.rows("a", [1]), [1, 5, 9])
+        np.testing.assert_array_equal(table.rows("a", [3, 1, 7]), [1, 3, 5, 7, 9, 11])
+        self.assertEqual(len(table.rows("a", [])), 0)
+        np.testing.assert_array_equal(table.select(a=[1, 2], b=[2]), [9, 10])
+        np.testing.assert_array_equal(table.select(a=None, b=1), [4, 5, 6, 7])
+        np.testing.assert_array_equal(table.select(), np.arange(12))
+
+    def test_interleaved(self):
+        # Appends and changes between queries update the index of a column.
+        rng = np.random.default_rng(0)
+        table = Table({"a": np.int16})
+        values = []
+        for i in range(500):
+            values.append(int(rng.integers(10)))
+            table.append(values[-1])
+            if i % 5 == 0:
+                query = rng.integers(12, size=rng.integers(1, 4)).tolist()
+                expected = [row for row, value in enumerate(values) if value in query]
+                np.testing.assert_array_equal(table.rows("a", query), expected)
+            if i % 7 == 0:
+                row, value = int(rng.integers(len(values))), int(rng.integers(10))
+                table.set("a", row, value)
+                values[row] = value
+        for value in range(10):
+            np.testing.assert_array_equal(table.rows("a", [value]), np.flatnonzero(np.array(values) == value))
+
+
+class TestQueries(unittest.TestCase):
+    def setUp(self):
+        self.cell = Queried()
+        dendrites, apic = self.cell.dendrites, self.cell.apic
+        self.created = [
+            self.cell.create_synapse(dendrites[2], "NMDA"),
+            self.cell.create_synapse(apic[0], "AMPA"),
+            self.cell.create_synapse(dendrites[2], "AMPA"),
+            self.cell.create_synapse(dendrites[0], "AMPA"),
+            self.cell.create_synapse(dendrites[2], "NMDA"),
+        ]
+
+    def test_synapses(self):
+        dendrites, apic = self.cell.dendrites, self.cell.apic
+        s = self.created
+        self.assertEqual(list(dendrites[2].synapses), [s[0], s[2], s[4]])
+        self.assertEqual(len(dendrites[1].synapses), 0)
+        self.assertEqual(get_section_synapses(dendrites[2], "NMDA"), [s[0], s[4]])
+        self.assertEqual(get_section_synapses(dendrites[2], ["AMPA", "NMDA"]), [s[0], s[2], s[4]])
+        self.assertEqual(get_synapses([self.cell], "AMPA"), [s[1], s[2], s[3]])
+        self.assertEqual(get_synapses([self.cell], labels="apic"), [s[1]])
+        self.assertEqual(get_synapses([self.cell], "NMDA", labels="apic"), [])
+        self.assertEqual(get_section_synapses(apic[1]), [])
+
+    def test_receivers(self):
+        dendrites, apic = self.cell.dendrites, self.cell.apic
+        offset = 2 * 10 ** 6
+        self.cell.create_receiver(dendrites[2], offset + 1, "AMPA")
+        self.cell.create_receiver(apic[0], offset + 2, "AMPA")
+        self.cell.create_receiver(dendrites[2], offset + 2, "NMDA")
+        self.assertEqual([r["gid"] for r in get_section_receivers(dendrites[2])], [offset + 1, offset + 2])
+        self.assertEqual([r["type"] for r in get_section_receivers(dendrites[2], "NMDA")], ["NMDA"])
+        self.assertEqual([r["gid"] for r in get_receivers([self.cell], gids=offset + 2)], [offset + 2] * 2)
+        self.assertEqual(len(get_receivers([self.cell], "AMPA", labels="dendrites")), 1)
+        self.assertEqual(get_receivers([self.cell], gids=[offset + 3]), [])
@@ -0,0 +1,166 @@
+import os, json, unittest, warnings
+import numpy as np
+from patch import p
+from arborize import NeuronModel
+from arborize.builders import ValidationBuilder, validate_morphology
+from arborize.exceptions import MorphologyValidationError
+from arborize.morphology import SECTION_TYPES, Morphology, load_morphology, _read_pt3d
+
+FILE = os.path.join(os.path.dirname(__file__), "data", "apic.asc")
+
+
+def _morphology(sections):
+    # Morphology of (type, parent, points, diameters) sections, connected at the middle
+    # of the soma or the end of other parents.
+    types = [SECTION_TYPES.index(s[0]) for s in sections]
+    parents = [s[1] for s in sections]
+    points = [np.asarray(s[2], dtype=float).reshape(-1, 3) for s in sections]
+    diameters = [np.broadcast_to(np.asarray(s[3], dtype=float), (len(p),)) for s, p in zip(sections, points)]
+    offsets = np.concatenate(([0], np.cumsum([len(p) for p in points])))
+    parent_x = [0.5 if 0 <= p < len(types) and types[p] == 0 else 1.0 for p in parents]
+    return Morphology(
+        np.concatenate(points), np.concatenate(diameters), offsets, np.array(types),
+        np.array(parents), np.array(parent_x), np.zeros(len(sections)),
+    )
+
+
+def _line(start, length, n=3, axis=0):
+    points = np.zeros((n, 3))
+    points[:, axis] = np.linspace(start, start + length, n)
+    return points
+
+
+SOMA = ("soma", -1, _line(-5, 10), 10)
+
+
+class TestValidateMorphology(unittest.TestCase):
+    def test_valid(self):
+        morphology = load_morphology(FILE)
+        validated, report = validate_morphology(morphology)
+        self.assertIs(validated, morphology)
+        self.assertEqual(report.problems, {})
+        self.assertEqual((report.sections, report.points), (19, len(morphology.points)))
+
+        class Plain(NeuronModel):
+            morphologies = [FILE]
+
+        self.assertEqual(report.compartments, Plain().compartment_count)
+        self.assertEqual(json.loads(json.dumps(report.to_dict()))["compartments"], report.compartments)
+
+    def test_thin_diameters(self):
+        morphology = _morphology([SOMA, ("dend", 0, _line(5, 50), [1, 0.01, 0])])
+        validated, report = validate_morphology(morphology, min_diameter=0.2)
+        self.assertEqual(report.problems, {"thin_diameters": 2})
+        self.assertEqual(report.repaired, ["thin_diameters"])
+        np.testing.assert_array_equal(validated.section_points(1)[1], [1, 0.2, 0.2])
+        # The given morphology is left untouched.
+        np.testing.assert_array_equal(morphology.section_points(1)[1], [1, 0.01, 0])
+
+    def test_duplicate_points(self):
+        points = np.array([[5, 0, 0], [5, 0, 0], [10, 0, 0], [20, 0, 0], [20, 0, 0]])
+        morphology = _morphology([
+            SOMA, ("dend", 0, points, 1), ("dend", 1, [[20, 0, 0]] * 2 + [[30, 0, 0]], 1),
+            ("dend", 2, [[30, 0, 0]] * 3, 1),
+        ])
+        validated, report = validate_morphology(morphology)
+        self.assertEqual(report.problems, {"duplicate_points": 4, "short_sections": 1})
+        np.testing.assert_array_equal(validated.section_points(1)[0], [[5, 0, 0], [10, 0, 0], [20, 0, 0]])
+        np.testing.assert_array_equal(validated.section_points(2)[0], [[20, 0, 0], [30, 0, 0]])
+        # Sections at a single location keep 2 points, and are lengthened.
+        np.testing.assert_allclose(validated.section_points(3)[0], [[30, 0, 0], [30.01, 0, 0]])
+        self.assertEqual(report.points, 10)
+
+    def test_short_sections(self):
+        morphology = _morphology([SOMA, ("dend", 0, _line(5, 20), 1), ("dend", 1, _line(25, 0.001), 1)])
+        validated, report = validate_morphology(morphology, min_length=0.5)
+        self.assertEqual(report.problems, {"short_sections": 1})
+        points, _ = validated.section_points(2)
+        # Lengthened in the direction of the parent's last segment.
+        np.testing.assert_allclose(points[-1], [25.5, 0, 0])
+        self.assertEqual(validate_morphology(validated, min_length=0.5)[1].problems, {})
+
+    def test_disconnected_trees(self):
+        morphology = _morphology([SOMA, ("dend", 0, _line(5, 20), 1), ("axon", -1, _line(-5, -30), 1)])
+        validated, report = validate_morphology(morphology)
+        self.assertEqual(report.problems, {"disconnected_trees": 1})
+        self.assertEqual((validated.parents[2], validated.parent_x[2]), (0, 0.5))
+        self.assertEqual(morphology.parents[2], -1)
+
+    def test_unrepairable(self):
+        # Broken structure is reported, and prevents all repairs.
+        cycle = _morphology([SOMA, ("dend", 2, _line(5, 20), 0.01), ("dend", 1, _line(25, 20), 1)])
+        validated, report = validate_morphology(cycle)
+        self.assertIs(validated, cycle)
+        self.assertEqual(report.problems, {"invalid_parents": 2, "thin_diameters": 3})
+        self.assertEqual(report.unrepaired, report.problems)
+        points = _line(5, 20)
+        points[1, 1] = np.nan
+        _, report = validate_morphology(_morphology([SOMA, ("dend", 0, points, 1), ("dend", 7, _line(25, 5), 1)]))
+        self.assertEqual(report.problems, {"invalid_parents": 1, "non_finite_points": 1})
+
+    def test_compartments(self):
+        morphology = _morphology([SOMA, ("dend", 0, _line(5, 200), 1)])
+        _, report = validate_morphology(morphology, max_compartments=5)
+        # 1 for the soma and 1 + 2 * 5 for the dendrite.
+        self.assertEqual((report.compartments, report.max_nseg), (12, 11))
+        self.assertEqual(report.unrepaired, {"too_many_compartments": 12})
+
+    def test_no_repair(self):
+        morphology = _morphology([SOMA, ("dend", 0, _line(5, 20), 0.01), ("axon", -1, _line(-5, -30), 1)])
+        validated, report = validate_morphology(morphology, repair=False)
+        self.assertIs(validated, morphology)
+        self.assertEqual(report.repaired, [])
+        self.assertEqual(set(report.unrepaired), {"thin_diameters", "disconnected_trees"})
+
+
+def _broken():
+    return _morphology([SOMA, ("dend", 0, _line(5, 50), [1, 0.01, 1]), ("axon", -1, _line(-5, -30), 1)])
+
+
+def _build(model):
+    # Create the sections of the broken morphology one by one.
+    morphology = _broken()
+    sections = []
+    for i, name in enumerate(("soma", "dendrites", "axon")):
+        section = p.Section(name="{}[0]".format(name))
+        for (x, y, z), d in zip(*morphology.section_points(i)):
+            section.pt3dadd(x, y, z, d)
+        setattr(model, name, [section])
+        sections.append(section)
+    sections[1].connect(sections[0], 0.5, 0)
+
+
+class TestValidationBuilder(unittest.TestCase):
+    def assertRepaired(self, cell):
+        diameters = _read_pt3d(cell.dendrites[0])[1]
+        np.testing.assert_allclose(diameters, [1, 0.1, 1], rtol=1e-6)
+        parent = cell.axon[0].__neuron__().parentseg()
+        self.assertEqual((parent.sec, parent.x), (cell.soma[0].__neuron__(), 0.5))
+
+    def test_arrays(self):
+        builder = ValidationBuilder()
+        model = type("ValidatedArrays", (NeuronModel,), {"morphologies": [(_broken(), builder)]})
+        self.assertRepaired(model())
+        model()
+        self.assertEqual(len(builder.reports), 1)
+        self.assertEqual(builder.reports[0].repaired, ["thin_diameters", "disconnected_trees"])
+
+    def test_sections(self):
+        # Sections created by a builder function are repaired in place.
+        builder = ValidationBuilder()
+        model = type("ValidatedSections", (NeuronModel,), {"morphologies": [(_build, builder)]})
+        self.assertRepaired(model())
+        self.assertEqual(len(builder.reports), 1)
+
+    def test_strict(self):
+        model = type("Strict", (NeuronModel,), {"morphologies": [(FILE, ValidationBuilder(max_compartments=5))]})
+        with self.assertRaises(MorphologyValidationError) as context:
+            model()
+        self.assertIn("too_many_compartments", context.exception.report.problems)
+        lenient = ValidationBuilder(strict=False, max_compartments=5)
+        model = type("Lenient", (NeuronModel,), {"morphologies": [(FILE, lenient)]})
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            model()
+        self.assertEqual(len(caught), 1)
+        self.assertIn("too_many_compartments", str(caught[0].message))